@@ -0,0 +1,42 @@
+import os
+import time
+import numpy as np
+
+from music_tools.midi_frame import MidiFrame
+from music_tools.smf_reader import open_smf
+
+MIDI_PATH = "MIDI_Files"
+# Bars before and after every bar, as the default MidiPlayer analysis window
+WINDOW_EXTENT = (1, 1)
+
+def main():
+    print("Scale suggestions of every bar of the song (key map)")
+    print(f"{'File':40} {'Bars':>5} {'per bar (ms)':>13} {'batch (ms)':>11} {'Speedup':>8}")
+    total_loop = 0
+    total_batch = 0
+    for file_name in sorted(os.listdir(MIDI_PATH)):
+        midiframe = MidiFrame(open_smf(os.path.join(MIDI_PATH, file_name)))
+        midiframe.make_playing_track_frame(list(range(16)))
+        track_frame = midiframe.playing_track_frame
+        if len(track_frame.dataframe) == 0:
+            continue
+        bars = np.arange(int(np.ceil(track_frame.dataframe.bartime_release.max())) + 1)
+        starts = bars - WINDOW_EXTENT[0]
+        ends = bars + WINDOW_EXTENT[1]
+        
+        start = time.perf_counter()
+        for bar_start, bar_end in zip(starts, ends):
+            track_frame.suggest_scale(bar_start, bar_end, threshold=0.9)
+        loop = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        track_frame.suggest_scale_windows(starts, ends, threshold=0.9)
+        batch = time.perf_counter() - start
+        
+        total_loop += loop
+        total_batch += batch
+        print(f"{file_name[:40]:40} {len(bars):5} {loop*1e3:13.1f} {batch*1e3:11.1f} {loop/batch:7.1f}x")
+    print(f"{'Total':40} {'':5} {total_loop*1e3:13.1f} {total_batch*1e3:11.1f} {total_loop/total_batch:7.1f}x")
+
+if __name__ == "__main__":
+    main()
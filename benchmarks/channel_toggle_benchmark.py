@@ -0,0 +1,61 @@
+import os
+import time
+import mido
+import numpy as np
+
+import music_tools.midi_utils as mu
+from music_tools.midi_frame import MidiFrame, MidiTrackFrame
+from music_tools.smf_reader import open_smf
+
+MIDI_PATH = "MIDI_Files"
+REPEAT = 3
+
+def legacy_playing_track_frame(midiframe, channels):
+    """Former make_playing_track_frame: merging the selected mido tracks and extracting the notes again"""
+    tracks = [track_frame.track for track_frame in midiframe.track_frames
+              if not set(track_frame.channel_count.keys()).isdisjoint(channels)]
+    return MidiTrackFrame(mido.merge_tracks(tracks),
+                          converters=midiframe.converters,
+                          track_name="Playing Track").dataframe
+
+def mixed_playing_track_frame(midiframe, channels):
+    # New selection each time, as the playing track frames are kept by selection
+    midiframe.playing_track_frames.clear()
+    midiframe.make_playing_track_frame(channels)
+    return midiframe.playing_track_frame.dataframe
+
+def toggle_all_channels(function, midiframe, channels):
+    """Remove then add back each channel, as MidiPlayer.remove_channel/add_channel"""
+    for channel in channels:
+        function(midiframe, [c for c in channels if c != channel])
+        function(midiframe, channels)
+
+def best_time(function, *args):
+    best = np.inf
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    print(f"{'File':40} {'Channels':>8} {'legacy (ms)':>12} {'mixed (ms)':>12} {'Speedup':>8}")
+    total_legacy = 0
+    total_mixed = 0
+    for file_name in sorted(os.listdir(MIDI_PATH)):
+        midiframe = MidiFrame(open_smf(os.path.join(MIDI_PATH, file_name)))
+        channels = sorted(set().union(*[track_frame.channel_count.keys() for track_frame in midiframe.track_frames]))
+        # Per channel dataframes are built once and cached by the track frames
+        for track_frame in midiframe.track_frames:
+            track_frame.dataframe
+
+        toggle_count = 2 * len(channels)
+        legacy = best_time(toggle_all_channels, legacy_playing_track_frame, midiframe, channels) / toggle_count
+        mixed = best_time(toggle_all_channels, mixed_playing_track_frame, midiframe, channels) / toggle_count
+        total_legacy += legacy
+        total_mixed += mixed
+        print(f"{file_name[:40]:40} {len(channels):8} {legacy*1e3:12.2f} {mixed*1e3:12.2f} {legacy/mixed:7.1f}x")
+    print(f"{'Total (per toggle)':40} {'':8} {total_legacy*1e3:12.2f} {total_mixed*1e3:12.2f} {total_legacy/total_mixed:7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import time
+import numpy as np
+
+import music_tools.midi_utils as mu
+import music_tools.scales as scales
+from music_tools.scales import ChromaBitmap
+
+REPEAT = 20000
+
+class LegacyChromaBitmap(ChromaBitmap):
+    """Former ChromaBitmap queries: NumPy for single chromas, a divide loop and up to 12 rolls"""
+    BIT_FILTER = 0x0FFF
+    
+    def set(self, index):
+        self.bitmap |= (np.sum(1 << ((11 - np.array(index)) % 12)) & ChromaBitmap.BIT_FILTER)
+    
+    def on(self, index):
+        return (1 << ((11 - np.array(index)) % 12)) & self.bitmap != 0
+    
+    def chromas(self):
+        return mu.CHROMA_IDS[self.on(mu.CHROMA_IDS)]
+    
+    def roll(self, n):
+        n = (n%12)
+        a = self.bitmap << n
+        b = self.bitmap >> (12 - n)
+        return (a | b) & ChromaBitmap.BIT_FILTER
+    
+    def circular_distance(self, other):
+        other &= ChromaBitmap.BIT_FILTER
+        for i in range(12):
+            if self.roll(i) == other:
+                return i
+        return None
+    
+    def note_count(self):
+        n = int(self.bitmap)
+        i = 0
+        while(n):
+            i += n % 2
+            n //= 2
+        return i
+
+def time_per_call(function, bitmap_class):
+    bitmap = bitmap_class(0b101011010101)
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        function(bitmap)
+    return (time.perf_counter() - start) / REPEAT
+
+def main():
+    # The major scale, and its rotation the furthest away
+    queries = {"note_count": lambda bitmap: bitmap.note_count(),
+               "on (one chroma)": lambda bitmap: bitmap.on(4),
+               "set (one chroma)": lambda bitmap: bitmap.set(4),
+               "set (7 chromas)": lambda bitmap: bitmap.set([0, 2, 4, 5, 7, 9, 11]),
+               "chromas": lambda bitmap: bitmap.chromas(),
+               "roll": lambda bitmap: bitmap.roll(5),
+               "circular_distance": lambda bitmap: bitmap.circular_distance(ChromaBitmap(0b101011010101).roll(11))}
+    
+    print(f"{'Query':20} {'legacy (us)':>12} {'tables (us)':>12} {'Speedup':>8}")
+    for name, query in queries.items():
+        legacy = time_per_call(query, LegacyChromaBitmap)
+        tables = time_per_call(query, ChromaBitmap)
+        print(f"{name:20} {legacy*1e6:12.2f} {tables*1e6:12.2f} {legacy/tables:7.1f}x")
+    
+    start = time.perf_counter()
+    for scale_id in scales.BITMAPS.tolist():
+        LegacyChromaBitmap(scale_id).circular_distance(LegacyChromaBitmap(scale_id).canonical_rotation())
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    for scale_id in scales.BITMAPS.tolist():
+        ChromaBitmap(scale_id).circular_distance(ChromaBitmap(scale_id).canonical_rotation())
+    tables = time.perf_counter() - start
+    print(f"{'all 4096 distances':20} {legacy*1e3:10.2f}ms {tables*1e3:10.2f}ms {legacy/tables:7.1f}x")
+
+if __name__ == "__main__":
+    main()
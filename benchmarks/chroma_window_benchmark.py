@@ -0,0 +1,61 @@
+import os
+import time
+import numpy as np
+
+import music_tools.midi_utils as mu
+import music_tools.scales as scales
+from music_tools.midi_frame import MidiFrame, SlidingChromaWindow
+from music_tools.smf_reader import open_smf
+
+MIDI_PATH = "MIDI_Files"
+# Bars before and after the cursor bar, as the default MidiPlayer analysis window
+WINDOW_EXTENT = (1, 1)
+REPEAT = 3
+
+def legacy_chroma_counts(dataframe, start, end, weighted):
+    """Former MidiTrackFrame.suggest_scale histogram: masking the whole dataframe for every window"""
+    mask = (dataframe["bartime"] >= start) & (dataframe["bartime_release"] < end)
+    if not np.any(mask):
+        return None, 0
+    weights = dataframe.weight[mask].to_numpy() if weighted else None
+    return scales.music_chroma_counts(mu.to_chroma(dataframe.note[mask].to_numpy()), weights=weights)
+
+def play_legacy(dataframe, bars, weighted):
+    for bar in bars:
+        legacy_chroma_counts(dataframe, bar - WINDOW_EXTENT[0], bar + WINDOW_EXTENT[1], weighted)
+
+def play_sliding(dataframe, bars, weighted):
+    window = SlidingChromaWindow(dataframe)
+    for bar in bars:
+        window.chroma_counts(bar - WINDOW_EXTENT[0], bar + WINDOW_EXTENT[1], weighted)
+
+def best_time(function, *args):
+    best = np.inf
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    print("Histogram of the analysis window at every bar change of a playback, per bar")
+    print(f"{'File':40} {'Notes':>7} {'Bars':>5} {'legacy (us)':>12} {'sliding (us)':>13} {'Speedup':>8}")
+    total_legacy = 0
+    total_sliding = 0
+    for file_name in sorted(os.listdir(MIDI_PATH)):
+        midiframe = MidiFrame(open_smf(os.path.join(MIDI_PATH, file_name)))
+        midiframe.make_playing_track_frame(list(range(16)))
+        dataframe = midiframe.playing_track_frame.dataframe
+        if len(dataframe) == 0:
+            continue
+        bars = np.arange(int(np.ceil(dataframe.bartime_release.max())) + 1)
+        
+        legacy = best_time(play_legacy, dataframe, bars, True) / len(bars)
+        sliding = best_time(play_sliding, dataframe, bars, True) / len(bars)
+        total_legacy += legacy
+        total_sliding += sliding
+        print(f"{file_name[:40]:40} {len(dataframe):7} {len(bars):5} {legacy*1e6:12.1f} {sliding*1e6:13.1f} {legacy/sliding:7.1f}x")
+    print(f"{'Total (per bar)':40} {'':7} {'':5} {total_legacy*1e6:12.1f} {total_sliding*1e6:13.1f} {total_legacy/total_sliding:7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import os
+import sys
+import mido
+import numpy as np
+import pandas as pd
+
+import music_tools.midi_utils as mu
+import music_tools.scales as scales
+from music_tools.midi_frame import MidiFrame, SlidingChromaWindow
+from music_tools.scales import ChromaBitmap
+from music_tools.smf_reader import open_smf
+from benchmarks.chroma_bitmap_benchmark import LegacyChromaBitmap
+from benchmarks.chroma_window_benchmark import legacy_chroma_counts
+from benchmarks.scale_bank_benchmark import legacy_compute_accuracy
+
+# Checks that the optimized implementations give the same results as the former ones (or as a brute force),
+# each row reporting the number of compared cases and of mismatches. Exits with status 1 on any mismatch.
+
+MIDI_PATH = "MIDI_Files"
+RANDOM_WINDOW_COUNT = 30
+TOLERANCE = 1e-9
+
+def midi_files():
+    return [os.path.join(MIDI_PATH, file_name) for file_name in sorted(os.listdir(MIDI_PATH))]
+
+def playing_track_frames():
+    """Playing track frame of every channel of every file with notes"""
+    track_frames = []
+    for path in midi_files():
+        midiframe = MidiFrame(open_smf(path))
+        midiframe.make_playing_track_frame(list(range(16)))
+        if len(midiframe.playing_track_frame.dataframe) > 0:
+            track_frames.append(midiframe.playing_track_frame)
+    return track_frames
+
+def analysis_windows(dataframe, rng):
+    """Windows of 4 bars ending at every bar, random windows and the whole song"""
+    last_bar = int(np.ceil(dataframe.bartime_release.max()))
+    windows = [(bar - 3, bar + 1) for bar in range(-1, last_bar + 2)]
+    for _ in range(RANDOM_WINDOW_COUNT):
+        start, end = sorted(rng.integers(-2, last_bar + 2, 2))
+        windows.append((start, end + 1))
+    windows.append((0, last_bar + 1))
+    return windows
+
+def same_dataframes(a, b):
+    try:
+        pd.testing.assert_frame_equal(a.reset_index(drop=True), b.reset_index(drop=True), check_dtype=False)
+    except AssertionError:
+        return False
+    return True
+
+def check_smf_reader():
+    """Track frames and note dataframes of every file, read with mido or with the smf_reader"""
+    cases = mismatches = 0
+    for path in midi_files():
+        mido_frame = MidiFrame(mido.MidiFile(path))
+        smf_frame = MidiFrame(open_smf(path))
+        pairs = list(zip(mido_frame.track_frames, smf_frame.track_frames))
+        mismatches += len(mido_frame.track_frames) != len(smf_frame.track_frames) \
+                      or abs(mido_frame.length - smf_frame.length) > TOLERANCE
+        for channels in (list(range(16)), [0]):
+            mido_frame.make_playing_track_frame(channels)
+            smf_frame.make_playing_track_frame(channels)
+            pairs.append((mido_frame.playing_track_frame, smf_frame.playing_track_frame))
+        for a, b in pairs:
+            cases += 1
+            mismatches += a.name != b.name or a.channel_count != b.channel_count \
+                          or not same_dataframes(a.dataframe, b.dataframe)
+    return cases, mismatches
+
+def check_sliding_chroma_counts():
+    """Chroma histograms of the SlidingChromaWindow, against masking the dataframe for every window: 
+    the histograms must be the same bit for bit"""
+    rng = np.random.default_rng(0)
+    cases = mismatches = 0
+    for track_frame in playing_track_frames():
+        dataframe = track_frame.dataframe
+        window = SlidingChromaWindow(dataframe)
+        for weighted in (False, True):
+            for start, end in analysis_windows(dataframe, rng):
+                expected, expected_sum = legacy_chroma_counts(dataframe, start, end, weighted)
+                found, found_sum = window.chroma_counts(start, end, weighted)
+                cases += 1
+                if expected is None or found is None:
+                    mismatches += (expected is None) != (found is None)
+                else:
+                    mismatches += not (np.array_equal(expected, found) and expected_sum == found_sum)
+    return cases, mismatches
+
+def suggestion_rows(suggestions):
+    return [(general_scale.scale_id, tonic, accuracy) for general_scale, tonic, accuracy in suggestions]
+
+def check_sliding_suggestions():
+    """Suggestions of MidiTrackFrame.suggest_scale, against suggest_scales of the masked dataframe: 
+    the same suggestions in the same order, with the same accuracies"""
+    rng = np.random.default_rng(0)
+    cases = mismatches = 0
+    for track_frame in playing_track_frames():
+        dataframe = track_frame.dataframe
+        for weighted in (False, True):
+            for start, end in analysis_windows(dataframe, rng):
+                mask = (dataframe["bartime"] >= start) & (dataframe["bartime_release"] < end)
+                expected = []
+                if np.any(mask):
+                    weights = dataframe.weight[mask].to_numpy() if weighted else None
+                    expected = scales.suggest_scales(mu.to_chroma(dataframe.note[mask].to_numpy()), weights=weights,
+                                                     threshold=0.9)
+                found = track_frame.suggest_scale(start, end, weighted=weighted, threshold=0.9)
+                cases += 1
+                mismatches += suggestion_rows(expected) != suggestion_rows(found)
+    return cases, mismatches
+
+def check_scale_bank():
+    """Accuracies of scales.compute_accuracy (cached ScaleBank), against building the rotated scale matrix"""
+    rng = np.random.default_rng(0)
+    subsets = [scales.ALL_GENERAL_ROTZERO_SCALES, scales.ALL_GENERAL_SCALES, scales.create_general_scale_subset(7)]
+    cases = mismatches = 0
+    for subset in subsets:
+        for chroma_counts in rng.integers(0, 10, size=(100, 12)).astype(np.float64) + np.eye(12)[rng.integers(0, 12, 100)]:
+            for normalize_accuracy in (False, True):
+                expected = legacy_compute_accuracy(subset, chroma_counts, chroma_counts.sum(),
+                                                   normalize_accuracy=normalize_accuracy)
+                found = scales.compute_accuracy(subset, chroma_counts, chroma_counts.sum(),
+                                                normalize_accuracy=normalize_accuracy)
+                cases += 1
+                mismatches += not np.array_equal(expected, found)
+    return cases, mismatches
+
+def close_suggestions(a, b, threshold):
+    """The same suggestions with accuracies within TOLERANCE, b being sorted by decreasing accuracy. Accuracies 
+    computed differently differ by rounding errors, so the suggestions at the threshold can be in only one of them, 
+    and suggestions of nearly equal accuracies can be in another order."""
+    a = {(general_scale.scale_id, tonic): accuracy for general_scale, tonic, accuracy in a}
+    b_accuracies = [accuracy for _, _, accuracy in b]
+    b = {(general_scale.scale_id, tonic): accuracy for general_scale, tonic, accuracy in b}
+    at_threshold = [key for key, accuracy in {**a, **b}.items() if abs(accuracy - threshold) <= TOLERANCE]
+    for key in at_threshold:
+        a.pop(key, None)
+        b.pop(key, None)
+    return a.keys() == b.keys() and all(abs(a[key] - b[key]) <= TOLERANCE for key in a) \
+           and all(np.diff(b_accuracies) <= 0)
+
+def check_batch_suggestions():
+    """Suggestions of every bar window with MidiTrackFrame.suggest_scale_windows, against suggest_scale bar by bar"""
+    parameters = [{"threshold": 0.9},
+                  {"threshold": 0.5, "general_scale_subset": scales.ALL_GENERAL_SCALES, "normalize_accuracy": False}]
+    cases = mismatches = 0
+    for track_frame in playing_track_frames():
+        bars = np.arange(-1, int(np.ceil(track_frame.dataframe.bartime_release.max())) + 1)
+        for weighted in (False, True):
+            for kwargs in parameters:
+                expected = [track_frame.suggest_scale(bar - 1, bar + 1, weighted=weighted, **kwargs) for bar in bars]
+                found = track_frame.suggest_scale_windows(bars - 1, bars + 1, weighted=weighted, **kwargs)
+                cases += len(bars)
+                mismatches += sum(not close_suggestions(a, b, kwargs["threshold"]) for a, b in zip(expected, found))
+    return cases, mismatches
+
+def check_chroma_bitmap():
+    """ChromaBitmap queries of the lookup tables, against the former computations, on the 4096 chroma sets"""
+    cases = mismatches = 0
+    for bitmap in range(scales.BITMAP_COUNT):
+        legacy, tables = LegacyChromaBitmap(bitmap), ChromaBitmap(bitmap)
+        expected = (legacy.note_count(), legacy.chromas().tolist(), [legacy.roll(n) for n in range(12)],
+                    [bool(legacy.on(chroma)) for chroma in range(12)],
+                    [legacy.circular_distance(other) for other in (legacy.roll(5), bitmap ^ 1, 0x0FFF)])
+        found = (tables.note_count(), list(tables.chromas()), [tables.roll(n) for n in range(12)],
+                 [bool(tables.on(chroma)) for chroma in range(12)],
+                 [tables.circular_distance(other) for other in (tables.roll(5), bitmap ^ 1, 0x0FFF)])
+        cases += 1
+        mismatches += expected != found
+    return cases, mismatches
+
+def brute_force_inclusion(scale_ids, mask):
+    """Supersets, subsets, ancestors, descendants, parents and children of a chroma set, comparing every pair"""
+    supersets = [i for i in scale_ids if i & mask == mask]
+    subsets = [i for i in scale_ids if i & mask == i]
+    ancestors = [i for i in supersets if i != mask]
+    descendants = [i for i in subsets if i != mask]
+    parents = [i for i in ancestors if not any(j != i and j & i == j for j in ancestors)]
+    children = [i for i in descendants if not any(j != i and j & i == i for j in descendants)]
+    return supersets, subsets, ancestors, descendants, parents, children
+
+def check_inclusion_dag():
+    """Inclusion relations of the 4096 chroma sets with the scales of the catalogue, and the catalogue links"""
+    catalogue = scales.SCALE_CATALOGUE
+    dag = catalogue.inclusion_dag()
+    scale_ids = dag.scale_ids.tolist()
+    cases = mismatches = 0
+    for mask in range(scales.BITMAP_COUNT):
+        expected = brute_force_inclusion(scale_ids, mask)
+        found = (dag.supersets(mask), dag.subsets(mask), dag.ancestors(mask), dag.descendants(mask),
+                 dag.parents(mask), dag.children(mask))
+        if mask in catalogue:
+            found += (catalogue.parents(mask), catalogue.children(mask))
+            expected += (expected[4], expected[5])
+        cases += 1
+        mismatches += any(sorted(a) != sorted(b.tolist()) for a, b in zip(expected, found))
+    return cases, mismatches
+
+CHECKS = {"smf_reader vs mido track frames": check_smf_reader,
+          "sliding vs recomputed chroma counts": check_sliding_chroma_counts,
+          "sliding vs recomputed suggestions": check_sliding_suggestions,
+          "ScaleBank vs legacy accuracy": check_scale_bank,
+          "batch vs per-window suggestions": check_batch_suggestions,
+          "ChromaBitmap tables vs legacy": check_chroma_bitmap,
+          "InclusionDAG vs brute force": check_inclusion_dag}
+
+def main():
+    print(f"{'Check':40} {'Cases':>8} {'Mismatches':>11}")
+    failed = False
+    for name, check in CHECKS.items():
+        cases, mismatches = check()
+        failed |= mismatches > 0
+        print(f"{name:40} {cases:8} {mismatches:11}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+
+import music_tools.scales as scales
+
+REPEAT = 5
+
+# Each statement is timed in a fresh interpreter, after importing numpy which every module needs anyway
+SETUP = "import time, numpy\nstart = time.perf_counter()\n"
+REPORT = "\nprint(time.perf_counter() - start)"
+
+# Former module level loading of music_tools.scales: the csv and the pickles, and every general scale looking up 
+# its name and rotations in the dataframe. The pickles are written by main in a folder given as first argument.
+LEGACY_LOAD = """
+import os
+import sys
+import pickle
+import pandas as pd
+import matplotlib.pyplot as plt
+import matplotlib.patches as patches
+import music_tools.scales as scales
+SCALE_DATA = pd.read_csv(scales.FOLDER + "scale_final_data.csv").set_index("scale_id")
+with open(os.path.join(sys.argv[1], "scale_forest.pkl"), "rb") as file:
+    SCALE_FOREST = pickle.load(file)
+with open(os.path.join(sys.argv[1], "scale_parents.pkl"), "rb") as file:
+    SCALE_PARENTS = pickle.load(file)
+ALL_GENERAL_SCALES = []
+for scale_id in SCALE_DATA.index:
+    name = SCALE_DATA.at[scale_id, "name"]
+    bitmap = scales.ChromaBitmap(bitmap=scale_id)
+    infos = SCALE_DATA.loc[scale_id]
+    rota_mask = (SCALE_DATA.rotation_id == infos.rotation_id)
+    ALL_GENERAL_SCALES.append((name, bitmap, bitmap.note_count(), infos.circular_distance, 
+                               SCALE_DATA.index[rota_mask], SCALE_DATA.circular_distance[rota_mask]))
+"""
+
+STATEMENTS = {"import midi_utils": ("import pandas as pd\nimport matplotlib.pyplot as plt\n"
+                                    "import matplotlib.patches as patches\nimport music_tools.midi_utils",
+                                    "import music_tools.midi_utils"),
+              "import scales": (LEGACY_LOAD,
+                                "import music_tools.scales"),
+              "import scales + ALL_GENERAL_SCALES": (LEGACY_LOAD,
+                                                     "import music_tools.scales as scales\nscales.ALL_GENERAL_SCALES"),
+              "import scales + suggest_scales": (LEGACY_LOAD + "scales.suggest_scales_from_chroma_counts(numpy.ones(12), 12)",
+                                                 "import music_tools.scales as scales\n"
+                                                 "scales.suggest_scales_from_chroma_counts(numpy.ones(12), 12)")}
+
+def best_time(statement, pickle_folder):
+    best = np.inf
+    for _ in range(REPEAT):
+        output = subprocess.run([sys.executable, "-c", SETUP + statement + REPORT, pickle_folder],
+                                capture_output=True, text=True, check=True).stdout
+        best = min(best, float(output.split()[-1]))
+    return best
+
+def write_legacy_pickles(folder):
+    """The former scale_forest.pkl and scale_parents.pkl, pickled from the catalogue links"""
+    for name, links in (("scale_forest.pkl", scales.scale_forest()), ("scale_parents.pkl", scales.scale_parents())):
+        with open(os.path.join(folder, name), "wb") as file:
+            pickle.dump(links, file)
+
+def main():
+    folder = tempfile.mkdtemp()
+    write_legacy_pickles(folder)
+    print(f"{'Statement':40} {'legacy (ms)':>12} {'lazy (ms)':>12} {'Speedup':>8}")
+    for name, (legacy_statement, lazy_statement) in STATEMENTS.items():
+        legacy = best_time(legacy_statement, folder)
+        lazy = best_time(lazy_statement, folder)
+        print(f"{name:40} {legacy*1e3:12.1f} {lazy*1e3:12.1f} {legacy/lazy:7.1f}x")
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    main()
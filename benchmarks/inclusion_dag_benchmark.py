@@ -0,0 +1,74 @@
+import time
+import numpy as np
+import pandas as pd
+
+import music_tools.scales as scales
+
+REPEAT = 3
+
+def legacy_scale_trees(scale_list):
+    """Former scale_researches.create_scale_trees loops: the included scales of every scale, then its parents
+    by comparing the included scales of every pair of scales"""
+    scale_list = scale_list.sort_index(ascending=False)
+    contained = {}
+    for n_notes in scale_list.note_count.unique():
+        ids = np.array(scale_list.loc[scale_list.note_count == n_notes].scale_id.astype(int))
+        sub_ids = np.array(scale_list.loc[scale_list.note_count < n_notes].scale_id.astype(int))
+        for id in ids:
+            id = int(id)
+            contained[id] = sub_ids[id & sub_ids == sub_ids].astype(int).tolist()
+
+    parents = {}
+    for id in contained:
+        valid = {}
+        invalid = []
+        for cid in contained.keys():
+            if id in contained[cid]:
+                new_invalid = [vid for vid, sids in valid.items() if cid in sids]
+                invalid.extend(new_invalid)
+                for i in new_invalid:
+                    del valid[i]
+                i = len(contained[cid]) - 1
+                while i >= 0 and contained[cid][i] not in valid.keys():
+                    i -= 1
+                if i >= 0:
+                    invalid.append(cid)
+                else:
+                    valid[cid] = list(contained[cid]).copy()
+                    if id in valid[cid]:
+                        valid[cid].remove(id)
+        parents[id] = list(valid.keys())
+    return contained, parents
+
+def dag_scale_trees(scale_list):
+    dag = scales.InclusionDAG(scale_list.scale_id.to_numpy())
+    scale_ids = dag.scale_ids.tolist()
+    return {id: dag.descendants(id).tolist() for id in scale_ids}, {id: dag.parents(id).tolist() for id in scale_ids}
+
+def user_scale_queries(dag):
+    """Parents and children of every chroma set, most of them not being in the catalogue"""
+    for mask in range(scales.BITMAP_COUNT):
+        dag.parents(mask)
+        dag.children(mask)
+
+def best_time(function, *args):
+    best = np.inf
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    scale_list = pd.read_csv(scales.FOLDER + "scale_final_data.csv")
+    legacy = best_time(legacy_scale_trees, scale_list)
+    dag = best_time(dag_scale_trees, scale_list)
+    print(f"{len(scale_list)} scales")
+    print(f"{'Operation':45} {'legacy (ms)':>12} {'DAG (ms)':>10} {'Speedup':>8}")
+    print(f"{'included scales and parents of every scale':45} {legacy*1e3:12.2f} {dag*1e3:10.2f} {legacy/dag:7.1f}x")
+
+    queries = best_time(user_scale_queries, scales.SCALE_CATALOGUE.inclusion_dag()) / scales.BITMAP_COUNT
+    print(f"{'parents and children of any chroma set':45} {'-':>12} {queries*1e3:10.3f}")
+
+if __name__ == "__main__":
+    main()
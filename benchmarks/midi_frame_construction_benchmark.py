@@ -0,0 +1,124 @@
+import os
+import time
+import mido
+import numpy as np
+
+import music_tools.midi_utils as mu
+from music_tools.midi_frame import MidiFrame, MidiTrackFrame
+
+MIDI_PATH = "MIDI_Files"
+REPEAT = 3
+
+def legacy_construction(midofile):
+    """Former dispatched MidiFrame construction: merging the tracks twice (three times with midofile.length), 
+    copying every message twice and sweeping all tracks again for the related track names"""
+    length = midofile.length
+    ticks = 0
+    tempos = []
+    timesigs = []
+    last_tempo_ticks = 0
+    last_timesig_ticks = 0
+    for message in mido.merge_tracks(midofile.tracks):
+        ticks += message.time
+        if message.is_meta:
+            if message.type == "set_tempo" \
+                and (len(tempos) == 0 or tempos[-1].tempo != message.tempo):
+                new_msg = message.copy()
+                if len(tempos) > 0 and last_tempo_ticks == ticks:
+                    new_msg.time = tempos[-1].time
+                    tempos[-1] = new_msg
+                else:
+                    new_msg.time = ticks - last_tempo_ticks
+                    tempos.append(new_msg)
+                last_tempo_ticks = ticks
+            elif message.type == "time_signature" \
+                and (len(timesigs) == 0 \
+                    or not (timesigs[-1].numerator == message.numerator and timesigs[-1].denominator == message.denominator)):
+                new_msg = message.copy()
+                if len(timesigs) > 0 and last_timesig_ticks == ticks:
+                    new_msg.time = timesigs[-1].time
+                    timesigs[-1] = new_msg
+                else:
+                    new_msg.time = ticks - last_timesig_ticks
+                    timesigs.append(new_msg)
+                last_timesig_ticks = ticks
+    converters = {"time": mu.TicksTimeConverter(tempos_with_ticks=tempos, ticks_per_beat=midofile.ticks_per_beat),
+                  "bartime": mu.TicksBartimeConverter(timesigs_with_ticks=timesigs, ticks_per_beat=midofile.ticks_per_beat)}
+    
+    time = 0
+    channel_set = set()
+    sorted_track = mido.MidiTrack()
+    for message in mido.merge_tracks(midofile.tracks):
+        timed_message = message.copy()
+        time += message.time
+        timed_message.time = time
+        sorted_track.append(timed_message)
+        if "channel" in message.__dict__:
+            channel_set.add(message.channel)
+    
+    channel_tracks = dict((channel, mido.MidiTrack()) for channel in channel_set)
+    meta_track = mido.MidiTrack()
+    
+    for message in sorted_track:
+        if message.is_meta and "track_name" not in message.__dict__ :
+            meta_track.append(message.copy())
+        elif "channel" in message.__dict__:
+            channel_tracks[message.channel].append(message.copy())
+    
+    track_frames = []
+    if len(meta_track) > 0:
+        previous_time = 0
+        for message in meta_track:
+            tmp_time = message.time
+            message.time = tmp_time - previous_time
+            previous_time = tmp_time
+        track_frames.append(MidiTrackFrame(meta_track, converters=converters, compute_dataframe=False, track_name="Meta"))
+    
+    related_track_names = [[] for _ in range(16)]
+    for track in midofile.tracks:
+        channels = set()
+        for m in track:
+            try:
+                channels.add(m.channel)
+            except:
+                pass
+        for channel in channels:
+            related_track_names[channel].append(track.name.strip())
+    
+    for channel, channel_track in channel_tracks.items():
+        if len(channel_track) > 0:
+            previous_time = 0
+            for message in channel_track:
+                tmp_time = message.time
+                message.time = tmp_time - previous_time
+                previous_time = tmp_time
+            track_frames.append(MidiTrackFrame(channel_track, converters=converters, track_name=f"Channel {channel:02}",
+                                               compute_dataframe=False, related_track_names=related_track_names[channel]))
+    return track_frames, length
+
+def best_time(function, *args):
+    best = np.inf
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    total_legacy = 0
+    total_single_pass = 0
+    print(f"{'File':50} {'Messages':>8} {'Legacy (ms)':>12} {'Single pass (ms)':>17} {'Speedup':>8}")
+    for file_name in sorted(os.listdir(MIDI_PATH)):
+        midofile = mido.MidiFile(os.path.join(MIDI_PATH, file_name))
+        
+        legacy = best_time(legacy_construction, midofile)
+        single_pass = best_time(MidiFrame, midofile)
+        total_legacy += legacy
+        total_single_pass += single_pass
+        message_count = sum(len(track) for track in midofile.tracks)
+        print(f"{file_name[:50]:50} {message_count:8} {legacy*1e3:12.2f} {single_pass*1e3:17.2f} {legacy/single_pass:7.1f}x")
+    
+    print(f"{'Total':50} {'':8} {total_legacy*1e3:12.2f} {total_single_pass*1e3:17.2f} {total_legacy/total_single_pass:7.1f}x")
+
+if __name__ == "__main__":
+    main()
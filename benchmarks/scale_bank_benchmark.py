@@ -0,0 +1,51 @@
+import time
+import numpy as np
+
+import music_tools.midi_utils as mu
+import music_tools.scales as scales
+
+REPEAT = 200
+
+def legacy_compute_accuracy(general_scale_subset, music_chroma_counts, music_chroma_counts_sum,
+                            tonic_chromas=mu.CHROMA_IDS, normalize_accuracy=True):
+    """Former compute_accuracy, building the rotated scale matrix on every call"""
+    scales_matrix = np.array([gs.scale_bitmap.as_array() for gs in general_scale_subset])
+    scales_matrix = np.vstack([np.roll(scales_matrix, tonic, axis=1) for tonic in tonic_chromas])
+    
+    scales_note_count = np.array([gs.note_count for gs in general_scale_subset]).T
+    scales_note_count = np.tile(scales_note_count, len(tonic_chromas))
+    
+    scores = (scales_matrix @ music_chroma_counts / music_chroma_counts_sum - 0.5) * 2
+    over_max_match_diff = 1.0/(6 + np.abs(6 - scales_note_count))
+    matching = 1 - np.einsum("ij,i->i" ,np.abs(music_chroma_counts / music_chroma_counts.max() - scales_matrix), over_max_match_diff)
+    
+    accuracy = scores * matching
+    if normalize_accuracy:
+        accuracy_min = accuracy.min()
+        accuracy = (accuracy - accuracy_min) / (accuracy.max() - accuracy.min())
+    return accuracy.reshape(len(general_scale_subset), -1, order="F")
+
+def time_per_call(function, general_scale_subset, chroma_counts):
+    start = time.perf_counter()
+    for counts in chroma_counts:
+        function(general_scale_subset, counts, counts.sum())
+    return (time.perf_counter() - start) / len(chroma_counts)
+
+def main():
+    rng = np.random.default_rng(0)
+    chroma_counts = rng.integers(1, 10, size=(REPEAT, 12)).astype(np.float64)
+    subsets = {"rotation zero scales": scales.ALL_GENERAL_ROTZERO_SCALES, 
+               "all scales": scales.ALL_GENERAL_SCALES,
+               "heptatonic scales": scales.create_general_scale_subset(7)}
+    
+    print(f"{'Subset':22} {'Scales':>6} {'legacy (us)':>12} {'bank (us)':>10} {'Speedup':>8}")
+    for name, subset in subsets.items():
+        for legacy, bank in zip(legacy_compute_accuracy(subset, chroma_counts[0], chroma_counts[0].sum()), 
+                                scales.compute_accuracy(subset, chroma_counts[0], chroma_counts[0].sum())):
+            assert np.array_equal(legacy, bank)
+        legacy = time_per_call(legacy_compute_accuracy, subset, chroma_counts)
+        bank = time_per_call(scales.compute_accuracy, subset, chroma_counts)
+        print(f"{name:22} {len(subset):6} {legacy*1e6:12.1f} {bank*1e6:10.1f} {legacy/bank:7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import time
+import numpy as np
+
+import music_tools.scales as scales
+
+REPEAT = 5
+
+class LegacyGeneralScale(scales.GeneralScale):
+    """Former GeneralScale, looking its rotations up in the SCALE_DATA dataframe"""
+
+    def __init__(self, semitones, name="Untitled"):
+        self.semitones = np.array(semitones)
+        if len(self.semitones) != 0:
+            self.semitone_intervals = scales.compute_semitone_intervals(self.semitones)
+
+        self.name = name
+        self.names = name.split(",")
+        self.scale_bitmap = scales.ChromaBitmap.from_chromas(self.semitone_intervals)
+        self.note_count = self.scale_bitmap.note_count()
+        self.scale_id = self.scale_bitmap.bitmap
+
+        self.rotation_id = None
+        self.rotations = []
+        self.circular_distance = None
+        if self.scale_id in scales.SCALE_DATA.index:
+            infos = scales.SCALE_DATA.loc[self.scale_id]
+            self.rotation_id = infos.rotation_id
+            self.circular_distance = infos.circular_distance
+            rota_mask = (scales.SCALE_DATA.rotation_id == self.rotation_id)
+            self.rotations = scales.SCALE_DATA.index[rota_mask]
+            self.rotations_circular_distance = scales.SCALE_DATA.circular_distance[rota_mask]
+
+def legacy_general_scale(scale_id):
+    name = "Untitled"
+    if scale_id in scales.SCALE_DATA.index:
+        name = scales.SCALE_DATA.at[scale_id, "name"]
+    return LegacyGeneralScale(semitones=scales.ChromaBitmap(scale_id).semitones(), name=name)
+
+def legacy_navigation(general_scale):
+    """Scale ids of the rotations, children and parents of a scale as formerly: from the pickled dictionaries"""
+    return (list(general_scale.rotations),
+            [scale_id for scale_id in scales.SCALE_FOREST[general_scale.scale_id] if scale_id != "self"],
+            list(scales.SCALE_PARENTS[general_scale.scale_id]))
+
+def catalogue_navigation(general_scale):
+    catalogue = scales.SCALE_CATALOGUE
+    return (catalogue.rotations(general_scale.scale_id),
+            catalogue.children(general_scale.scale_id),
+            catalogue.parents(general_scale.scale_id))
+
+def best_time(function, *args):
+    best = np.inf
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    scale_ids = scales.SCALE_CATALOGUE.scale_ids.tolist()
+    general_scales = [scales.general_scale(scale_id) for scale_id in scale_ids]
+
+    rows = {"build every general scale": (lambda: [legacy_general_scale(scale_id) for scale_id in scale_ids],
+                                          lambda: [scales.build_scale(scale_id, None, scales.SCALE_CATALOGUE.name(scale_id)) for scale_id in scale_ids]),
+            "navigate every general scale": (lambda: [legacy_navigation(gs) for gs in general_scales],
+                                             lambda: [catalogue_navigation(gs) for gs in general_scales])}
+    print(f"{len(scale_ids)} scales")
+    print(f"{'Operation':40} {'legacy (ms)':>12} {'catalogue (ms)':>15} {'Speedup':>8}")
+    for name, (legacy_function, catalogue_function) in rows.items():
+        legacy = best_time(legacy_function)
+        catalogue = best_time(catalogue_function)
+        print(f"{name:40} {legacy*1e3:12.2f} {catalogue*1e3:15.2f} {legacy/catalogue:7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+import music_tools.scales as scales
+import scale_researches.scale_researches as scale_researches
+from benchmarks.inclusion_dag_benchmark import legacy_scale_trees
+
+SHEETS = scale_researches.NAME_SHEETS + ["scale_researches/past_research/scale_coding_filtered.csv",
+                                         "scale_researches/past_research/scale_coding_cleaned.csv"]
+
+def legacy_rotations(sheet):
+    """Former treat_scale_coding_jan_2011 loop: the rotation id and circular distance of every scale of a sheet"""
+    rotation_ids = []
+    circular_distance = []
+    history = {}
+    for id in sheet.scale_id:
+        id = int(id)
+        n = scales.ChromaBitmap(id).note_count()
+        if n not in history:
+            history[n] = {}
+        if id not in history[n]:
+            rotation_id = n << 12 | id
+            for i in range(12):
+                history[n][scales.ChromaBitmap(id).roll(i)] = rotation_id
+        rotation_ids.append(history[n][id])
+        circular_distance.append(scales.ChromaBitmap(id).circular_distance(history[n][id]))
+    return rotation_ids, circular_distance
+
+def legacy_build():
+    """Serial pandas build: reading every sheet, the rotations of the scales and the scale trees"""
+    names = pd.concat([pd.read_csv(sheet)[["scale_id", "name"]] for sheet in SHEETS]).drop_duplicates("scale_id")
+    legacy_rotations(names)
+    legacy_scale_trees(pd.read_csv(SHEETS[0]))
+
+def main():
+    folder = tempfile.mkdtemp()
+    scale_researches.BUILD_CACHE_FOLDER = os.path.join(folder, "build_cache/")
+    path = os.path.join(folder, "scale_data.npz")
+    sheets = [shutil.copy(sheet, folder) for sheet in SHEETS]
+
+    start = time.perf_counter()
+    legacy_build()
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scale_researches.build_scale_catalogue(sheets, path=path)
+    full = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scale_researches.build_scale_catalogue(sheets, path=path)
+    up_to_date = time.perf_counter() - start
+
+    # Adding a name to a scale of the catalogue
+    with open(sheets[-1], "a") as file:
+        file.write('2773,101011010101,31445,0,7,"Added Major"\n')
+    start = time.perf_counter()
+    scale_researches.build_scale_catalogue(sheets, path=path)
+    added_name = time.perf_counter() - start
+
+    print(f"{len(SHEETS)} sheets, {os.cpu_count()} cores")
+    print(f"{'Build':40} {'Time (ms)':>10}")
+    print(f"{'legacy serial build':40} {legacy*1e3:10.1f}")
+    print(f"{'full build':40} {full*1e3:10.1f}")
+    print(f"{'build with unchanged sheets':40} {up_to_date*1e3:10.1f}")
+    print(f"{'build after adding a name':40} {added_name*1e3:10.1f}")
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    main()
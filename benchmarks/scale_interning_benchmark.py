@@ -0,0 +1,61 @@
+import time
+import numpy as np
+
+import music_tools.midi_utils as mu
+import music_tools.scales as scales
+
+REPEAT = 5
+
+def legacy_scale(scale_id, tonic_chroma=None):
+    """Former scales.scale, building a new scale on every call"""
+    name = scales.SCALE_CATALOGUE.name(scale_id)
+    if tonic_chroma is None:
+        return scales.GeneralScale.from_scale_id(scale_id=scale_id, name=name)
+    return scales.Scale.from_scale_id(scale_id=scale_id, tonic_chroma=tonic_chroma, name=name)
+
+def legacy_select_scale(scale_id, tonic_chroma):
+    """Former update_selected_scale: the selected scale, its rotations, parents and children, all built again"""
+    catalogue = scales.SCALE_CATALOGUE
+    general_scale = legacy_scale(scale_id)
+    selected_scale = scales.Scale(general_scale.semitones, tonic_chroma, name=general_scale.name)
+    rotations = [legacy_scale(rotation_id,
+                              tonic_chroma=mu.to_chroma(selected_scale.tonic_chroma + selected_scale.circular_distance - circular_distance))
+                 for rotation_id, circular_distance in zip(selected_scale.rotations, selected_scale.rotations_circular_distance)]
+    parents = [legacy_scale(parent_id, tonic_chroma=tonic_chroma) for parent_id in catalogue.parents(scale_id).tolist()]
+    children = [legacy_scale(child_id, tonic_chroma=tonic_chroma) for child_id in catalogue.children(scale_id).tolist()]
+    return selected_scale, rotations, parents, children
+
+def select_scale(scale_id, tonic_chroma):
+    selected_scale = scales.scale(scale_id).scale_in(tonic_chroma)
+    return selected_scale, selected_scale.rotated_scales(), selected_scale.parent_scales(), selected_scale.child_scales()
+
+def select_every_scale(function, scale_ids):
+    for scale_id in scale_ids:
+        for tonic_chroma in range(12):
+            function(scale_id, tonic_chroma)
+
+def best_time(function, *args):
+    best = np.inf
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    scale_ids = scales.SCALE_CATALOGUE.scale_ids.tolist()
+    selection_count = 12 * len(scale_ids)
+    # Warm up of the interned scales, as after the first selections of a session
+    select_every_scale(select_scale, scale_ids)
+
+    legacy = best_time(select_every_scale, legacy_select_scale, scale_ids) / selection_count
+    interned = best_time(select_every_scale, select_scale, scale_ids) / selection_count
+    print(f"{'Operation':40} {'legacy (us)':>12} {'interned (us)':>14} {'Speedup':>8}")
+    print(f"{'select a scale and its related scales':40} {legacy*1e6:12.1f} {interned*1e6:14.1f} {legacy/interned:7.1f}x")
+
+    legacy = best_time(lambda: [legacy_scale(scale_id, tonic) for scale_id in scale_ids for tonic in range(12)]) / selection_count
+    interned = best_time(lambda: [scales.scale(scale_id, tonic) for scale_id in scale_ids for tonic in range(12)]) / selection_count
+    print(f"{'scale(scale_id, tonic)':40} {legacy*1e6:12.1f} {interned*1e6:14.1f} {legacy/interned:7.1f}x")
+
+if __name__ == "__main__":
+    main()
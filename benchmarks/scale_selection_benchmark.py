@@ -0,0 +1,45 @@
+import time
+import numpy as np
+
+import music_tools.midi_utils as mu
+import music_tools.scales as scales
+
+REPEAT = 50
+TOP_K = 20
+
+def legacy_select(accuracies, general_scale_subset, tonic_chromas, threshold):
+    """Former suggest_scales selection: a tuple per passing (scale, tonic) pair, then a full sort"""
+    suggestions = []
+    for scale_index, general_scale in enumerate(general_scale_subset):
+        for tonic_index, tonic_chroma in enumerate(tonic_chromas):
+            accuracy = accuracies[scale_index, tonic_index]
+            if accuracies[scale_index, tonic_index] >= threshold:
+                suggestions.append((general_scale, tonic_chroma, accuracy))
+    return sorted(suggestions, key=lambda kv: (-kv[2], general_scale))
+
+def time_per_call(function, *args, **kwargs):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        result = function(*args, **kwargs)
+    return (time.perf_counter() - start) / REPEAT, result
+
+def main():
+    chroma_counts = np.array([3, 0, 2, 0, 2, 1, 0, 3, 0, 1, 0, 1], dtype=np.float64)
+    subset = scales.ALL_GENERAL_SCALES
+    accuracies = scales.compute_accuracy(subset, chroma_counts, chroma_counts.sum())
+    
+    print(f"Selection among {accuracies.size} (scale, tonic) pairs of all general scales")
+    print(f"{'Threshold':>9} {'Rows':>5} {'legacy (us)':>12} {'vectorized (us)':>16} {f'top {TOP_K} (us)':>12} "
+          f"{f'+ {TOP_K} tuples (us)':>18}")
+    for threshold in (0.99, 0.9, 0.5, 0.0):
+        legacy, suggestions = time_per_call(legacy_select, accuracies, subset, mu.CHROMA_IDS, threshold)
+        vectorized, selection = time_per_call(scales.select_scales, accuracies, threshold)
+        assert [(scale, tonic) for scale, tonic, _ in suggestions] == \
+            [(scale, tonic) for scale, tonic, _ in scales.materialize_suggestions(selection, subset)]
+        top, selection = time_per_call(scales.select_scales, accuracies, threshold, top_k=TOP_K)
+        materialized, _ = time_per_call(scales.materialize_suggestions, selection, subset)
+        print(f"{threshold:9} {len(suggestions):5} {legacy*1e6:12.1f} {vectorized*1e6:16.1f} {top*1e6:12.1f} "
+              f"{(top + materialized)*1e6:18.1f}")
+
+if __name__ == "__main__":
+    main()
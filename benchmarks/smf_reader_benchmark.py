@@ -0,0 +1,77 @@
+import os
+import tempfile
+import time
+import tracemalloc
+import mido
+import numpy as np
+
+from music_tools.smf_reader import SmfFile, open_smf
+from music_tools.midi_frame import MidiFrame
+
+MIDI_PATH = "MIDI_Files"
+REPEAT = 3
+LARGE_FILE_NOTES = 400000
+
+def make_large_file(path, note_count=LARGE_FILE_NOTES, track_count=8):
+    """Write a synthetic multi-megabyte file of random notes over several tracks"""
+    rng = np.random.default_rng(0)
+    midofile = mido.MidiFile(type=1, ticks_per_beat=480)
+    for t in range(track_count):
+        track = mido.MidiTrack()
+        track.append(mido.MetaMessage("track_name", name=f"Track {t}"))
+        for note, gap, duration in zip(rng.integers(21, 109, note_count // track_count),
+                                       rng.integers(0, 120, note_count // track_count),
+                                       rng.integers(1, 480, note_count // track_count)):
+            track.append(mido.Message("note_on", channel=t, note=int(note), velocity=64, time=int(gap)))
+            track.append(mido.Message("note_off", channel=t, note=int(note), velocity=0, time=int(duration)))
+        midofile.tracks.append(track)
+    midofile.save(path)
+
+def measure(function, *args):
+    best = np.inf
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    result = function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return best, peak
+
+def report(name, path):
+    mido_time, mido_memory = measure(mido.MidiFile, path)
+    smf_time, smf_memory = measure(SmfFile, path)
+    print(f"{name[:40]:40} {os.path.getsize(path)/1e6:6.2f} {mido_time*1e3:10.1f} {smf_time*1e3:10.1f} {mido_time/smf_time:7.1f}x "
+          f"{mido_memory/1e6:10.2f} {smf_memory/1e6:10.2f} {mido_memory/smf_memory:7.1f}x")
+    return mido_time, smf_time
+
+def list_tracks(open_function, path):
+    """Open a file and list the names of its tracks"""
+    midiframe = MidiFrame(open_function(path), info_type="all")
+    return [track_frame.name for track_frame in midiframe.track_frames]
+
+def report_lazy(path):
+    eager_time, _ = measure(list_tracks, SmfFile, path)
+    lazy_time, _ = measure(list_tracks, open_smf, path)
+    print(f"Listing the tracks: eager {eager_time*1e3:.1f} ms, memory-mapped lazy {lazy_time*1e3:.2f} ms ({eager_time/lazy_time:.0f}x)")
+
+def main():
+    print(f"{'File':40} {'MB':>6} {'mido (ms)':>10} {'smf (ms)':>10} {'Speedup':>8} {'mido (MB)':>10} {'smf (MB)':>10} {'Ratio':>8}")
+    total_mido = 0
+    total_smf = 0
+    for file_name in sorted(os.listdir(MIDI_PATH)):
+        mido_time, smf_time = report(file_name, os.path.join(MIDI_PATH, file_name))
+        total_mido += mido_time
+        total_smf += smf_time
+    print(f"{'Total':40} {'':6} {total_mido*1e3:10.1f} {total_smf*1e3:10.1f} {total_mido/total_smf:7.1f}x")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "large.mid")
+        make_large_file(path)
+        report(f"Synthetic ({LARGE_FILE_NOTES} notes)", path)
+        report_lazy(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import os
+import time
+import mido
+import numpy as np
+import pandas as pd
+
+import music_tools.midi_utils as mu
+from music_tools.midi_frame import MidiFrame
+
+MIDI_PATH = "MIDI_Files"
+REPEAT = 5
+
+def legacy_track_to_dataframe(track, time_conv, bartime_conv):
+    """Former implementation, copying the __dict__ of every message"""
+    records = []
+    current_ticks = 0
+    
+    pressed_notes = {}
+    id = 0
+    
+    for x in track:
+        new_dict = x.__dict__.copy()
+        new_dict["ticks"] = new_dict["time"]
+        del new_dict["time"]
+        
+        current_ticks += new_dict["ticks"]
+        
+        if new_dict["type"] == "note_off" or new_dict["type"] == "note_on" and new_dict["velocity"] == 0:
+            former_pressed_note = pressed_notes.get(new_dict["note"])
+            if former_pressed_note is not None:
+                pressed_record = records[former_pressed_note["id"]]
+                pressed_record["ticks_release"] = current_ticks
+                pressed_record["velocity_release"] = new_dict["velocity"]
+                pressed_notes[new_dict["note"]] = None
+        elif new_dict["type"] == "note_on":
+            new_dict["ticks"] = current_ticks
+            new_dict["ticks_release"] = None
+            new_dict["velocity_release"] = None
+            pressed_notes[new_dict["note"]] = {"id": id}
+            del new_dict["type"]
+            records.append(new_dict)
+            id += 1
+    
+    df = pd.DataFrame(records)
+    if len(df) > 0:
+        df = df.dropna(subset=["ticks_release"]).reset_index()
+        
+        df["time"] = time_conv.to_time(df["ticks"])
+        df["time_release"] = df["time"]
+        df["bartime"] = bartime_conv.to_bartime(df["ticks"])
+        df["bartime_release"] = df["bartime"]
+        mapping = np.argsort(df["ticks_release"])
+        
+        df["time_release"].iloc[mapping] =  time_conv.to_time(df["ticks_release"][mapping])
+        df["bartime_release"].iloc[mapping] = bartime_conv.to_bartime(df["ticks_release"][mapping])
+        df["onset"] = df["bartime"] - np.floor(df["bartime"])
+        
+        weights = []
+        last_timesig = bartime_conv.events[0][0]
+        updown_beats = mu.get_updown_beats(last_timesig[0])
+        for row in df[["ticks", "onset"]].itertuples():
+            timesig = bartime_conv.to_timesig(row.ticks)
+            if timesig != last_timesig:
+                updown_beats = mu.get_updown_beats(timesig[0])
+                last_timesig = timesig
+            
+            weights.append(updown_beats[int(row.onset * len(updown_beats))])
+        
+        df["weight"] = weights
+    
+    return df
+
+def best_time(function, *args):
+    best = np.inf
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    total_legacy = 0
+    total_columnar = 0
+    print(f"{'File':50} {'Notes':>7} {'Legacy (ms)':>12} {'Columnar (ms)':>14} {'Speedup':>8}")
+    for file_name in sorted(os.listdir(MIDI_PATH)):
+        midiframe = MidiFrame(mido.MidiFile(os.path.join(MIDI_PATH, file_name)))
+        track = mido.merge_tracks([track_frame.track for track_frame in midiframe.track_frames])
+        args = (track, midiframe.converters["time"], midiframe.converters["bartime"])
+        
+        legacy = best_time(legacy_track_to_dataframe, *args)
+        columnar = best_time(mu.track_to_dataframe, *args)
+        total_legacy += legacy
+        total_columnar += columnar
+        print(f"{file_name[:50]:50} {len(mu.track_to_dataframe(*args)):7} {legacy*1e3:12.2f} {columnar*1e3:14.2f} {legacy/columnar:7.1f}x")
+    
+    print(f"{'Total':50} {'':7} {total_legacy*1e3:12.2f} {total_columnar*1e3:14.2f} {total_legacy/total_columnar:7.1f}x")
+
+if __name__ == "__main__":
+    main()
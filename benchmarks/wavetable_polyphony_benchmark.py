@@ -0,0 +1,42 @@
+import time
+import numpy as np
+
+from music_tools.wavetable_synthesizer import WavetableSynthesizer
+
+SAMPLE_FREQUENCY = 44100
+BLOCK_SIZE = 512
+BLOCK_COUNT = 200
+POLYPHONIES = [1, 8, 16, 32, 64, 128, 256, 512, 1024]
+
+def block_render_time(polyphony, block_size=BLOCK_SIZE, Fs=SAMPLE_FREQUENCY):
+    """Mean time to render a block with polyphony voices playing, on a single core"""
+    synthesizer = WavetableSynthesizer(Fs=Fs, max_polyphony=polyphony, budget=None)
+    # Distinct (channel, note) for every voice, otherwise notes would be retriggered on the same voice
+    for i in range(polyphony):
+        synthesizer.note_on(i % 16, (i // 16) % 128, 100)
+    assert synthesizer.active_voice_count == polyphony
+    # Warm up, voices reaching their sustain
+    for _ in range(10):
+        synthesizer.render(block_size)
+    start = time.perf_counter()
+    for _ in range(BLOCK_COUNT):
+        synthesizer.render(block_size)
+    return (time.perf_counter() - start) / BLOCK_COUNT
+
+def main():
+    block_duration = BLOCK_SIZE / SAMPLE_FREQUENCY
+    print(f"Block of {BLOCK_SIZE} samples at {SAMPLE_FREQUENCY} Hz: {block_duration*1e3:.2f} ms")
+    print(f"{'Voices':>8} {'Render (ms)':>12} {'Load':>8} {'Per voice (us)':>15}")
+    render_times = []
+    for polyphony in POLYPHONIES:
+        render_time = block_render_time(polyphony)
+        render_times.append(render_time)
+        print(f"{polyphony:8} {render_time*1e3:12.3f} {render_time/block_duration:7.1%} {render_time/polyphony*1e6:15.2f}")
+    
+    # Linear fit of the render time against the polyphony
+    slope, intercept = np.polyfit(POLYPHONIES, render_times, 1)
+    for load in (1.0, 0.5):
+        print(f"Maximum sustainable polyphony per core at {load:.0%} load: {int((load*block_duration - intercept) / slope)}")
+
+if __name__ == "__main__":
+    main()
@@ -13,7 +13,7 @@ def load_midi(midi_file, path, name):
     print("Filename: ", midi_file)
     
     if gc.MIDIPLAYER is not None:
-        gc.MIDIPLAYER.stop()
+        gc.MIDIPLAYER.close()
 
     gc.MIDIPLAYER = MidiPlayer(midi_file, 
                            path,
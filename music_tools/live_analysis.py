@@ -0,0 +1,177 @@
+import threading
+import time
+import mido
+import numpy as np
+
+import music_tools.midi_utils as mu
+import music_tools.scales as scales
+
+# Live scale suggestion from a midi input port: incoming notes are kept in a fixed size ring buffer note table,
+# and the scales of the notes played within the last seconds are suggested at a regular interval (e.g. every bar).
+
+LIVE_NOTE_DTYPE = np.dtype([("channel", np.int64),
+                            ("note", np.int64),
+                            ("velocity", np.int64),
+                            ("time", np.float64),
+                            ("time_release", np.float64)])
+
+
+class LoopbackPort(mido.ports.BaseIOPort):
+    """Port receiving the messages sent to it, to test the live mode without midi device or backend"""
+
+    def _send(self, message):
+        self._messages.append(message)
+
+
+class LiveNoteTable:
+    """Ring buffer note table of the last capacity notes played, time_release being inf while a note is held"""
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.notes = np.zeros(capacity, dtype=LIVE_NOTE_DTYPE)
+        self.count = 0
+        # Ring buffer index of the held notes, by (channel, note)
+        self.held = {}
+
+    def note_on(self, channel, note, velocity, time):
+        i = self.count % self.capacity
+        if self.count >= self.capacity:
+            overwritten = (int(self.notes["channel"][i]), int(self.notes["note"][i]))
+            if self.held.get(overwritten) == i:
+                del self.held[overwritten]
+        # A note pressed again before its release is released by the new press
+        self.note_off(channel, note, time)
+        self.notes[i] = (channel, note, velocity, time, np.inf)
+        self.held[(channel, note)] = i
+        self.count += 1
+
+    def note_off(self, channel, note, time):
+        i = self.held.pop((channel, note), None)
+        if i is not None:
+            self.notes["time_release"][i] = time
+
+    def window(self, start, end):
+        """The notes pressed before end and not released before start (held notes included)"""
+        notes = self.notes[:min(self.count, self.capacity)]
+        return notes[(notes["time"] < end) & (notes["time_release"] > start)]
+
+    def chroma_counts(self, start, end, weighted=False):
+        """12 chroma histogram of the notes of the window, counting notes, or their duration within the window
+        if weighted"""
+        notes = self.window(start, end)
+        weights = None
+        if weighted:
+            weights = np.minimum(notes["time_release"], end) - np.maximum(notes["time"], start)
+        chroma_counts = np.bincount(mu.to_chroma(notes["note"]), weights=weights, minlength=12).astype(np.float64)
+        return chroma_counts, chroma_counts.sum()
+
+
+class LiveScaleSuggester:
+    """Suggests the scales of the notes received from a mido input port while they are played.
+
+    Notes are read from the port by a polling thread, the scales of the notes of the last window_duration
+    seconds being suggested every analysis_interval seconds, or every bar if a tempo is given.
+    The time taken by the last analysis is kept in latency.
+    """
+
+    def __init__(self,
+                 port=None,
+                 window_duration=4.0,
+                 analysis_interval=0.1,
+                 bpm=None,
+                 beats_per_bar=4,
+                 capacity=1024,
+                 on_suggestion_callback=lambda suggester: None,
+                 **analysis_parameters):
+        """
+        Args:
+            port (mido.ports.BaseInput, optional): The input port, a LoopbackPort if None. Defaults to None.
+            window_duration (float, optional): Duration in seconds of the analysed window. Defaults to 4.0.
+            analysis_interval (float, optional): Seconds between analyses. Defaults to 0.1.
+            bpm (float, optional): If given, the analysis happens every bar instead. Defaults to None.
+            beats_per_bar (int, optional): Beats per bar, with bpm. Defaults to 4.
+            capacity (int, optional): Number of notes kept in the note table. Defaults to 1024.
+            on_suggestion_callback (function, optional): Called with the suggester after every analysis.
+        Kwargs:
+            weighted (bool): If notes are weighted by their duration in the window. Default to False.
+            And the arguments of scales.suggest_scales_from_chroma_counts: threshold, general_scale_subset,
+            tonic_chromas, normalize_accuracy.
+        """
+        self.port = LoopbackPort() if port is None else port
+        self.window_duration = window_duration
+        self.analysis_interval = analysis_interval if bpm is None else beats_per_bar * 60 / bpm
+        self.note_table = LiveNoteTable(capacity)
+        self.on_suggestion_callback = on_suggestion_callback
+        self.analysis_parameters = {"weighted": False,
+                                    "threshold": 0.9,
+                                    "general_scale_subset": scales.ALL_GENERAL_ROTZERO_SCALES,
+                                    "tonic_chromas": mu.CHROMA_IDS,
+                                    "normalize_accuracy": True}
+        self.analysis_parameters.update(analysis_parameters)
+
+        self.suggestions = []
+        self.latency = 0.0
+        self.start_time = time.perf_counter()
+        self.last_analysis_time = -np.inf
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def now(self):
+        return time.perf_counter() - self.start_time
+
+    def receive(self, message, at=None):
+        """Add a note message to the note table, at being its time in seconds since the start (now if None)"""
+        at = self.now() if at is None else at
+        with self.lock:
+            if message.type == "note_on" and message.velocity > 0:
+                self.note_table.note_on(message.channel, message.note, message.velocity, at)
+            elif message.type == "note_off" or message.type == "note_on":
+                self.note_table.note_off(message.channel, message.note, at)
+
+    def analyse(self, at=None):
+        """Suggest the scales of the notes of the window ending at the time at (now if None)"""
+        start = time.perf_counter()
+        at = self.now() if at is None else at
+        parameters = dict(self.analysis_parameters)
+        weighted = parameters.pop("weighted")
+        with self.lock:
+            chroma_counts, chroma_counts_sum = self.note_table.chroma_counts(at - self.window_duration, at, weighted)
+        if chroma_counts_sum > 0:
+            self.suggestions = scales.suggest_scales_from_chroma_counts(chroma_counts, chroma_counts_sum, **parameters)
+        else:
+            self.suggestions = []
+        self.last_analysis_time = at
+        self.latency = time.perf_counter() - start
+        self.on_suggestion_callback(self)
+        return self.suggestions
+
+    def poll(self):
+        """Receive the pending messages of the port, and analyse if the analysis interval has elapsed"""
+        for message in self.port.iter_pending():
+            self.receive(message)
+        if self.now() - self.last_analysis_time >= self.analysis_interval:
+            self.analyse()
+
+    def start(self, poll_interval=0.001):
+        """Poll the port in a thread"""
+        def run():
+            while self.running:
+                self.poll()
+                time.sleep(poll_interval)
+        self.running = True
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def open_live_suggester(input_name=None, **kwargs):
+    """LiveScaleSuggester reading the midi input input_name (the default input if None), started"""
+    suggester = LiveScaleSuggester(port=mido.open_input(input_name), **kwargs)
+    suggester.start()
+    return suggester
@@ -2,32 +2,101 @@ import mido
 import numpy as np
 import pandas as pd
 import os
+import threading
+from pretty_midi import PrettyMIDI, Instrument, Note, PitchBend
+from operator import itemgetter
+from collections import OrderedDict
 
 import music_tools.midi_utils as mu
 import music_tools.scales as scales
+import music_tools.smf_reader as smf_reader
+from music_tools.temporal_converters import MidiTimeline
 from music_tools.chords import ChordSuggester
 
+DRUM_CHANNEL = 9
+
 class MidiTrackFrame:
+    # Statistics only counted when first accessed for the tracks of a lazy smf_reader.SmfFile 
+    LAZY_STATISTICS = ("meta_only", "channel_count", "unique_channel", "meta_count", "typeset")
 
     def __init__(self, 
                  track: mido.MidiTrack, 
                  converters,
                  track_name=None, 
                  compute_dataframe=True,
-                 related_track_names=[]):
+                 related_track_names=[],
+                 messages_ticks=None,
+                 events=None,
+                 smf=None,
+                 track_index=None):
+        """Track Frame
+
+        Args:
+            track (mido.MidiTrack): The track, or if messages_ticks is given, a list of messages whose time attribute is ignored.
+            converters (dict): The "time" and "bartime" converters of the midi file.
+            track_name (str, optional): Name of the frame. Defaults to the name of the track.
+            compute_dataframe (bool, optional): If the note dataframe should be computed right away, instead of when
+                first accessed. Defaults to True.
+            related_track_names (list(str), optional): Names of the tracks the messages come from. Defaults to [].
+            messages_ticks (list(int), optional): Absolute ticks of each message of track. The mido.MidiTrack with 
+                delta times is then only built when the track attribute is accessed. Defaults to None.
+            events (np.ndarray, optional): Events array of music_tools.smf_reader in playback order, used instead of track
+                (which can then be None). The mido.MidiTrack is then only built when the track attribute is accessed. 
+                Defaults to None.
+            smf (smf_reader.SmfFile, optional): The file the events come from. Defaults to None.
+            track_index (int, optional): Index of the track of smf, used instead of events. The track is then only decoded, 
+                and its statistics counted, when first accessed. Defaults to None.
+        """
         self.name = track.name.strip() if track_name is None else track_name
         
+        self.messages = track
+        self.messages_ticks = messages_ticks
+        self._events = events
+        self.smf = smf
+        self.track_index = track_index
+        self._track = track if messages_ticks is None and events is None and track_index is None else None
+        self.related_track_names = related_track_names
+        self.converters = converters
+        
+        self._dataframe : pd.DataFrame = None #type:ignore
+        self.chroma_windows = {}
+        self.scale_timeline = None
+        
+        if track_index is None:
+            self.count_statistics()
+            
+        if compute_dataframe:
+            self.build_dataframe()
+    
+    def __getattr__(self, name):
+        # Only called for missing attributes, i.e. the statistics of a track not counted yet
+        if name in MidiTrackFrame.LAZY_STATISTICS and self.__dict__.get("track_index") is not None:
+            self.count_statistics()
+            return self.__dict__[name]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+    
+    @property
+    def events(self):
+        if self._events is None and self.track_index is not None:
+            self._events = self.smf.track_events(self.track_index)
+        return self._events
+    
+    def count_statistics(self):
         self.meta_only =  True
         self.channel_count = {}
         self.unique_channel = None
         # self.cc_count = {}
         self.meta_count = 0
         self.typeset = set()
-        self.track = track
-        self.related_track_names = related_track_names
-        
-        self.dataframe : pd.DataFrame = None #type:ignore
         
+        if self.events is not None:
+            self.count_events(self.events)
+        else:
+            self.count_messages(self.messages)
+        if len(self.channel_count.keys()) == 1:
+            self.unique_channel = list(self.channel_count.keys())[0]
+    
+    def count_messages(self, track):
         for message in track:    
             self.typeset.add(message.type)
             if message.is_meta:
@@ -43,13 +112,92 @@ class MidiTrackFrame:
                     #     if message.channel not in self.cc_count:
                     #         self.cc_count[message.channel] = 0
                     #     self.cc_count[message.channel] += 1
-        if len(self.channel_count.keys()) == 1:
-            self.unique_channel = list(self.channel_count.keys())[0]
-            
-        if compute_dataframe:
-            self.dataframe = mu.track_to_dataframe(track, 
-                                                   converters["time"],
-                                                   converters["bartime"])
+    
+    def count_events(self, events):
+        channel_events = smf_reader.channel_mask(events)
+        meta_events = smf_reader.meta_mask(events)
+        self.meta_count = int(np.count_nonzero(meta_events))
+        self.meta_only = not np.any(channel_events)
+        
+        counts = np.bincount(events["status"][channel_events] & 0x0F, minlength=16)
+        self.channel_count = {int(channel): int(counts[channel]) for channel in np.flatnonzero(counts)}
+        
+        kinds = np.unique(np.where(channel_events, events["status"] & 0xF0, events["status"]).astype(np.int64) << 8 
+                          | np.where(meta_events, events["data1"], 0))
+        self.typeset = set(smf_reader.event_type_name(kind >> 8, kind & 0xFF) for kind in kinds)
+    
+    @property
+    def dataframe(self) -> pd.DataFrame:
+        """Note dataframe of the track (see mu.track_to_dataframe), built on first access"""
+        if self._dataframe is None:
+            self.build_dataframe()
+        return self._dataframe
+    
+    @dataframe.setter
+    def dataframe(self, dataframe):
+        self._dataframe = dataframe
+        self.drop_analysis_caches()
+    
+    def drop_analysis_caches(self):
+        self.chroma_windows = {}
+        if self.scale_timeline is not None:
+            self.scale_timeline.close()
+            self.scale_timeline = None
+    
+    def chroma_window(self, metric="bartime"):
+        """Cached SlidingChromaWindow of the dataframe for the metric"""
+        if metric not in self.chroma_windows:
+            self.chroma_windows[metric] = SlidingChromaWindow(self.dataframe, metric)
+        return self.chroma_windows[metric]
+    
+    def build_dataframe(self):
+        if self.events is not None:
+            self._dataframe = mu.track_to_dataframe(self.events, 
+                                                    self.converters["time"], 
+                                                    self.converters["bartime"])
+        else:
+            self._dataframe = mu.track_to_dataframe(self.messages, 
+                                                    self.converters["time"], 
+                                                    self.converters["bartime"],
+                                                    messages_ticks=self.messages_ticks)
+    
+    def ticks_and_messages(self):
+        """The messages of the track as (absolute ticks, message) pairs, without building the mido.MidiTrack"""
+        if self.messages_ticks is not None:
+            return list(zip(self.messages_ticks, self.messages))
+        ticks = 0
+        stream = []
+        for message in self.track:
+            ticks += message.time
+            stream.append((ticks, message))
+        return stream
+    
+    def invalidate(self):
+        """To call when the messages of the track change, so that statistics and dataframe are recomputed"""
+        self._dataframe = None
+        self.drop_analysis_caches()
+        self.count_statistics()
+    
+    @property
+    def track(self) -> mido.MidiTrack:
+        if self._track is None and self.events is not None:
+            self._track = self.smf.to_track(self.events)
+        elif self._track is None:
+            self._track = mido.MidiTrack()
+            previous_ticks = 0
+            for message, ticks in zip(self.messages, self.messages_ticks):
+                self._track.append(message.copy(time=ticks - previous_ticks))
+                previous_ticks = ticks
+        return self._track
+    
+    @track.setter
+    def track(self, track: mido.MidiTrack):
+        self.messages = track
+        self.messages_ticks = None
+        self._events = None
+        self.track_index = None
+        self._track = track
+        self.invalidate()
 
     def __repr__(self):
         rep = self.name
@@ -77,6 +225,53 @@ class MidiTrackFrame:
             rep = rep[:-2]
         return rep + "\n"
     
+    def program_and_pitchwheel_events(self):
+        """The program_change and pitchwheel messages of the track as (ticks, channel, type, program or pitch) tuples"""
+        if self.events is not None:
+            events = self.events
+            status_type = events["status"] & 0xF0
+            events = events[(status_type == 0xC0) | (status_type == 0xE0)]
+            pitches = (events["data2"].astype(np.int64) << 7 | events["data1"]) - 8192
+            return [(ticks, status & 0x0F, "program_change" if status & 0xF0 == 0xC0 else "pitchwheel", 
+                     program if status & 0xF0 == 0xC0 else pitch)
+                    for ticks, status, program, pitch in zip(events["ticks"].tolist(), events["status"].tolist(), 
+                                                            events["data1"].tolist(), pitches.tolist())]
+        return [(ticks, message.channel, message.type, message.program if message.type == "program_change" else message.pitch)
+                for ticks, message in self.ticks_and_messages() if message.type in ("program_change", "pitchwheel")]
+    
+    def to_pretty_midi(self) -> PrettyMIDI:
+        """PrettyMIDI object of the notes of the dataframe, built in memory (see to_instruments)"""
+        music = PrettyMIDI()
+        music.instruments = list(self.to_instruments().values())
+        return music
+    
+    def to_instruments(self):
+        """PrettyMIDI instrument of each channel with the notes of the dataframe, channel 9 being drums 
+        and the program being the first program change of the channel"""
+        programs = {}
+        pitch_bends = {}
+        controls = self.program_and_pitchwheel_events()
+        if len(controls) > 0:
+            times = self.converters["time"].to_time(np.array([control[0] for control in controls]))
+            for time, (_, channel, message_type, value) in zip(times.tolist(), controls):
+                if message_type == "program_change":
+                    programs.setdefault(channel, value)
+                else:
+                    pitch_bends.setdefault(channel, []).append(PitchBend(pitch=value, time=time))
+        
+        df = self.dataframe
+        channels = set(pitch_bends) | (set(df.channel.unique().tolist()) if len(df) > 0 else set())
+        instruments = {channel: Instrument(program=programs.get(channel, 0), 
+                                           is_drum=channel == DRUM_CHANNEL, 
+                                           name=f"Channel {channel:02}")
+                       for channel in sorted(channels)}
+        for channel, bends in pitch_bends.items():
+            instruments[channel].pitch_bends = bends
+        if len(df) > 0:
+            for channel, note, velocity, start, end in zip(df.channel.tolist(), df.note.tolist(), df.velocity.tolist(),
+                                                           df.time.tolist(), df.time_release.tolist()):
+                instruments[channel].notes.append(Note(velocity=velocity, pitch=note, start=start, end=end))
+        return instruments
     
     def get_sub_dataframe(self,
                           start,
@@ -124,22 +319,42 @@ class MidiTrackFrame:
             raise ValueError(f"Argument start should be below end, current start={start}, end={end}")
         if metric not in ("ticks", "bartime", "time"):
             raise ValueError("Argument metric should be in (ticks, bartime, time)")
-        weights = None
         
-        mask = (self.dataframe[metric] >= start) & (self.dataframe[metric+"_release"] < end)
+        # The histogram of the window is updated from the previous window, only with the notes entering and leaving it
+        chroma_counts, chroma_counts_sum = self.chroma_window(metric).chroma_counts(start, end, weighted)
         found_scales = []
         
-        if np.any(mask):
-            
-            if weighted:
-                weights = self.dataframe.weight[mask].to_numpy()
-            
-            found_scales = scales.suggest_scales(mu.to_chroma(self.dataframe.note[mask].to_numpy()), 
-                                                weights=weights, 
-                                                **kwargs)
+        if chroma_counts is not None:
+            found_scales = scales.suggest_scales_from_chroma_counts(chroma_counts, chroma_counts_sum, **kwargs)
             
         return found_scales
     
+    def suggest_scale_windows(self,
+                              starts,
+                              ends,
+                              metric="bartime",
+                              weighted=False,
+                              **kwargs):
+        """suggest_scale of many windows at once (e.g. every bar of the song), their histograms being computed
+        by sliding a window over them and scored in a single scales.suggest_scales_batch call.
+
+        Args:
+            starts (list(float)): The beginnings of the windows in the metric.
+            ends (list(float)): The ends of the windows in the metric.
+            metric (str, optional): The metric for starts and ends. Defaults to "bartime".
+            weighted (bool, optional): If the weight should be applied in the analysis. Defaults to False.
+        Kwargs:
+            The arguments of scales.suggest_scales_batch (threshold, normalize_accuracy, tonic_chromas, general_scale_subset).
+
+        Returns:
+            list(list(tuple)): The suggestions of every window, as suggest_scale.
+        """
+        if metric not in ("ticks", "bartime", "time"):
+            raise ValueError("Argument metric should be in (ticks, bartime, time)")
+        
+        # A window of its own, not to move the one of suggest_scale
+        chroma_counts = SlidingChromaWindow(self.dataframe, metric).batch_chroma_counts(starts, ends, weighted)
+        return scales.suggest_scales_batch(chroma_counts, **kwargs)
     
     def suggest_chord(self, 
                       start,
@@ -167,9 +382,247 @@ class MidiTrackFrame:
         return found_chords
 
 
+class SlidingChromaWindow:
+    """12 chroma histogram of the notes of a note dataframe within a window of a metric (e.g. bartime), 
+    i.e. the notes starting at or after its start and released before its end (as MidiTrackFrame.suggest_scale).
+    
+    The notes in the window are the ones released before its end, minus the ones started before its start. 
+    Both sets are prefixes of the notes sorted by release and by start, so moving the window only moves the two 
+    prefix boundaries, the histograms being updated with the notes crossing them (forward or backward), 
+    in O(notes changed) instead of O(notes of the song).
+    """
+    
+    def __init__(self, dataframe: pd.DataFrame, metric="bartime"):
+        starts = dataframe[metric].to_numpy()
+        releases = dataframe[metric+"_release"].to_numpy()
+        self.chromas = mu.to_chroma(dataframe.note.to_numpy()).astype(np.int64)
+        weights = dataframe.weight.to_numpy().astype(np.float64) if "weight" in dataframe else np.ones(len(dataframe))
+        # Notes are counted by chroma and weight, so that the weighted histogram doesn't accumulate rounding errors
+        # and only depends on the notes of the window, not on the previous windows: it is the one of 
+        # scales.music_chroma_counts on the notes of the window, bit for bit
+        self.weight_values, weight_ids = np.unique(weights, return_inverse=True)
+        self.bins = self.chromas * len(self.weight_values) + weight_ids.reshape(-1)
+        
+        self.start_order = np.argsort(starts, kind="stable")
+        self.sorted_starts = starts[self.start_order]
+        self.release_order = np.argsort(releases, kind="stable")
+        self.sorted_releases = releases[self.release_order]
+        
+        # Notes started before the start, and released before the end of the window 
+        self.started = np.zeros(len(dataframe), dtype=bool)
+        self.released = np.zeros(len(dataframe), dtype=bool)
+        self.started_count = 0
+        self.released_count = 0
+        
+        self.note_count = 0
+        self.counts = np.zeros((12, len(self.weight_values)), dtype=np.int64)
+        self.lock = threading.Lock()
+    
+    def update(self, notes, sign):
+        self.note_count += sign * len(notes)
+        if len(notes) > 0:
+            self.counts += sign * np.bincount(self.bins[notes], minlength=self.counts.size).reshape(self.counts.shape)
+    
+    def move(self, start, end):
+        released_count = int(np.searchsorted(self.sorted_releases, end, side="left"))
+        if released_count > self.released_count:
+            notes = self.release_order[self.released_count:released_count]
+            self.released[notes] = True
+            self.update(notes[~self.started[notes]], 1)
+        elif released_count < self.released_count:
+            notes = self.release_order[released_count:self.released_count]
+            self.released[notes] = False
+            self.update(notes[~self.started[notes]], -1)
+        self.released_count = released_count
+        
+        started_count = int(np.searchsorted(self.sorted_starts, start, side="left"))
+        if started_count > self.started_count:
+            notes = self.start_order[self.started_count:started_count]
+            self.started[notes] = True
+            self.update(notes[self.released[notes]], -1)
+        elif started_count < self.started_count:
+            notes = self.start_order[started_count:self.started_count]
+            self.started[notes] = False
+            self.update(notes[self.released[notes]], 1)
+        self.started_count = started_count
+    
+    def current_chroma_counts(self, weighted):
+        if weighted:
+            return scales.weighted_chroma_counts(self.counts, self.weight_values)
+        return self.counts.sum(axis=1).astype(np.float64)
+    
+    def chroma_counts(self, start, end, weighted=False):
+        """Chroma histogram of the window [start, end) and its sum (as scales.music_chroma_counts),
+        (None, 0) if there is no note in the window"""
+        with self.lock:
+            self.move(start, end)
+            if self.note_count == 0:
+                return None, 0
+            chroma_counts = self.current_chroma_counts(weighted)
+        return chroma_counts, chroma_counts.sum()
+    
+    def batch_chroma_counts(self, starts, ends, weighted=False):
+        """N x 12 chroma histograms of the windows [starts[i], ends[i]), null for windows without notes"""
+        chroma_counts = np.zeros((len(starts), 12))
+        with self.lock:
+            for i, (start, end) in enumerate(zip(starts, ends)):
+                if start >= end:
+                    raise ValueError(f"Argument start should be below end, current start={start}, end={end}")
+                self.move(start, end)
+                if self.note_count > 0:
+                    chroma_counts[i] = self.current_chroma_counts(weighted)
+        return chroma_counts
+    
+
+class ScaleTimeline:
+    """Scale suggestions of every bar of a track frame, the analysis window of a bar starting window_extent[0] bars 
+    before it and ending window_extent[1] bars after it (as MidiPlayer.update_window).
+    
+    Bars are computed by regions of REGION_SIZE bars with scales.suggest_scales_batch, by a background thread 
+    going on from the region of the last requested bar, a region requested before the thread reaches it being 
+    computed right away. When the window extent or the analysis parameters change, the computed regions are 
+    dropped and computed again lazily.
+    """
+    REGION_SIZE = 16
+    
+    def __init__(self, track_frame: MidiTrackFrame, window_extent=(1, 1), analysis_parameters={}, background=True):
+        """
+        Args:
+            track_frame (MidiTrackFrame): The analysed track frame.
+            window_extent (tuple(int), optional): Bars before and after each bar in its window. Defaults to (1, 1).
+            analysis_parameters (dict, optional): weighted, and the arguments of scales.suggest_scales_batch. 
+                Defaults to {}.
+            background (bool, optional): If the regions are computed by a background thread, instead of only 
+                when requested. Defaults to True.
+        """
+        dataframe = track_frame.dataframe
+        self.bar_count = int(np.ceil(np.nanmax(dataframe.bartime_release.to_numpy()))) + 1 if len(dataframe) > 0 else 0
+        self.region_count = -(-self.bar_count // ScaleTimeline.REGION_SIZE)
+        self.chroma_window = SlidingChromaWindow(dataframe, "bartime")
+        
+        self.key = None
+        self.regions = {}
+        self.generation = 0
+        self.next_region = 0
+        self.condition = threading.Condition()
+        self.set_parameters(window_extent, analysis_parameters)
+        
+        self.running = background
+        self.worker = None
+        if background:
+            self.worker = threading.Thread(target=self.run, daemon=True)
+            self.worker.start()
+    
+    @staticmethod
+    def parameters_key(window_extent, analysis_parameters):
+        key = [tuple(int(extent) for extent in window_extent)]
+        for name, value in sorted(analysis_parameters.items()):
+            if name == "general_scale_subset":
+                value = tuple(int(general_scale.scale_id) for general_scale in value)
+            elif name == "tonic_chromas":
+                value = tuple(int(tonic) for tonic in value)
+            key.append((name, value))
+        return tuple(key)
+    
+    def set_parameters(self, window_extent, analysis_parameters):
+        """Window extent and analysis parameters of the timeline, the computed regions being dropped if they changed"""
+        key = ScaleTimeline.parameters_key(window_extent, analysis_parameters)
+        with self.condition:
+            if key != self.key:
+                self.key = key
+                self.window_extent = tuple(window_extent)
+                self.analysis_parameters = dict(analysis_parameters)
+                self.regions = {}
+                self.generation += 1
+                self.condition.notify_all()
+    
+    @property
+    def is_complete(self):
+        return len(self.regions) == self.region_count
+    
+    def compute_bars(self, bars, window_extent, analysis_parameters):
+        parameters = dict(analysis_parameters)
+        weighted = parameters.pop("weighted", False)
+        chroma_counts = self.chroma_window.batch_chroma_counts(bars - window_extent[0], bars + window_extent[1], weighted)
+        return scales.suggest_scales_batch(chroma_counts, **parameters)
+    
+    def region_bars(self, region):
+        return np.arange(region * ScaleTimeline.REGION_SIZE, min((region + 1) * ScaleTimeline.REGION_SIZE, self.bar_count))
+    
+    def suggestions(self, bar):
+        """Suggestions of the window of a bar, as MidiTrackFrame.suggest_scale"""
+        bar = int(bar)
+        with self.condition:
+            generation = self.generation
+            window_extent = self.window_extent
+            analysis_parameters = self.analysis_parameters
+            if bar < 0 or bar >= self.bar_count:
+                region = None
+            else:
+                region = bar // ScaleTimeline.REGION_SIZE
+                self.next_region = region
+                if region in self.regions:
+                    return self.regions[region][bar % ScaleTimeline.REGION_SIZE]
+        
+        if region is None:
+            # Around the song, only computed for this bar
+            return self.compute_bars(np.array([bar]), window_extent, analysis_parameters)[0]
+        
+        region_suggestions = self.compute_bars(self.region_bars(region), window_extent, analysis_parameters)
+        with self.condition:
+            if generation == self.generation:
+                self.regions[region] = region_suggestions
+        return region_suggestions[bar % ScaleTimeline.REGION_SIZE]
+    
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.is_complete:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                region = next(region % self.region_count 
+                              for region in range(self.next_region, self.next_region + self.region_count) 
+                              if region % self.region_count not in self.regions)
+                generation = self.generation
+                window_extent = self.window_extent
+                analysis_parameters = self.analysis_parameters
+            
+            region_suggestions = self.compute_bars(self.region_bars(region), window_extent, analysis_parameters)
+            
+            with self.condition:
+                if generation == self.generation:
+                    self.regions[region] = region_suggestions
+    
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+
+class LazyConverters(dict):
+    """The "time" and "bartime" converters of a midi file, only built by load_function on first access"""
+    
+    def __init__(self, load_function):
+        super().__init__()
+        self.load_function = load_function
+    
+    def __missing__(self, key):
+        if len(self) == 0:
+            self.load_function()
+            if key in self:
+                return self[key]
+        raise KeyError(key)
+
+
 class MidiFrame:
     EXPORT_DEFAULT_DIRPATH = "TMP_Files"
     EXPORT_DEFAULT_FILEPATH = "TMP_Files/tmp.mid"
+    # Number of playing track frames kept for the last selections of channels
+    PLAYING_TRACK_FRAME_CACHE_SIZE = 8
     
     def __init__(self, 
                  midofile: mido.MidiFile, 
@@ -184,64 +637,177 @@ class MidiFrame:
         self.midi_charset = midofile.charset
         self.info_type = info_type
         self.filename = midofile.filename
-        self.track_count = len(midofile.tracks)
-        self.converters = {}
-        self.music_track_count = 0
+        self.smf = midofile if isinstance(midofile, smf_reader.SmfFile) else None
+        self.track_count = len(midofile.tracks) if self.smf is None else self.smf.track_count
+        self.converters = LazyConverters(self.load_tempo_map)
         self.ticks_per_beat = midofile.ticks_per_beat
-        self.length = midofile.length
         self.track_frames = []
         self.playing_track_frame: MidiTrackFrame = None #type:ignore
+        self.playing_track_frames = OrderedDict()
+        self._timeline = None
+        self._length = None
         # self.playing_midi_file = tempfile.TemporaryFile()
         
         
-        ticks = 0
-        tempos = []
-        timesigs = []
-        last_tempo_ticks = 0
-        last_timesig_ticks = 0
-        for message in mido.merge_tracks(midofile.tracks):
-            ticks += message.time
-            if message.is_meta:
-                if message.type == "set_tempo" \
-                    and (len(tempos) == 0 or tempos[-1].tempo != message.tempo):
-                    new_msg = message.copy()
-                    if len(tempos) > 0 and last_tempo_ticks == ticks:
-                        new_msg.time = tempos[-1].time
-                        tempos[-1] = new_msg
-                    else:
-                        new_msg.time = ticks - last_tempo_ticks
-                        tempos.append(new_msg)
-                    last_tempo_ticks = ticks
-                elif message.type == "time_signature" \
-                    and (len(timesigs) == 0 \
-                        or not (timesigs[-1].numerator == message.numerator and timesigs[-1].denominator == message.denominator)):
-                    new_msg = message.copy()
-                    if len(timesigs) > 0 and last_timesig_ticks == ticks:
-                        new_msg.time = tempos[-1].time
-                        timesigs[-1] = new_msg
-                    else:
-                        new_msg.time = ticks - last_timesig_ticks
-                        timesigs.append(new_msg)
-                    last_timesig_ticks = ticks
-        self.converters["time"] = mu.TicksTimeConverter(tempos_with_ticks=tempos, 
-                                                        ticks_per_beat=self.ticks_per_beat)
-        self.converters["bartime"] = mu.TicksBartimeConverter(timesigs_with_ticks=timesigs, 
-                                                              ticks_per_beat=self.ticks_per_beat)
+        if self.smf is None:
+            ingested = self.ingest(midofile, dispatch=info_type == "dispatched")
+            self.load_tempo_map(ingested)
+        elif info_type == "dispatched" or not self.smf.lazy:
+            ingested = self.ingest_events(self.smf, dispatch=info_type == "dispatched")
+            self.load_tempo_map(ingested)
+        # Otherwise the tempo map of a lazy smf is only loaded when first needed, see LazyConverters
         
         if info_type in ("all", "filtered"):
-            for t in midofile.tracks:
-                mtf = MidiTrackFrame(t, 
-                                     converters=self.converters,
-                                     compute_dataframe=False)
+            for i in range(self.track_count):
+                if self.smf is None:
+                    mtf = MidiTrackFrame(midofile.tracks[i], 
+                                         converters=self.converters,
+                                         compute_dataframe=False)
+                else:
+                    mtf = MidiTrackFrame(None,
+                                         converters=self.converters,
+                                         track_name=self.smf.track_name(i).strip(),
+                                         compute_dataframe=False,
+                                         smf=self.smf,
+                                         track_index=i)
                 self.track_frames.append(mtf)
-                if not mtf.meta_only:
-                    self.music_track_count += 1
             if info_type == "filtered":
                 self.filter_track_frames(**kwargs)
         else:
-            self.dispatch_tracks_by_channel(midofile, **kwargs)
+            self.dispatch_tracks_by_channel(ingested, **kwargs)
         
         self.track_frames = sorted(self.track_frames, key=lambda a: a.name)
+    
+    @property
+    def music_track_count(self):
+        return sum(1 for track_frame in self.track_frames if not track_frame.meta_only)
+    
+    def load_tempo_map(self, ingested=None):
+        """Build the converters, timeline and length from the tempo events and end ticks of ingested, 
+        ingesting the tempo events of the smf file if not given"""
+        if ingested is None:
+            ingested = self.ingest_events(self.smf, dispatch=False)
+        tempos, timesigs = self.extract_tempos_and_timesigs(ingested["tempo_events"])
+        self.converters["time"] = mu.TicksTimeConverter(tempos_with_ticks=tempos, 
+                                                        ticks_per_beat=self.ticks_per_beat)
+        self.converters["bartime"] = mu.TicksBartimeConverter(timesigs_with_ticks=timesigs, 
+                                                              ticks_per_beat=self.ticks_per_beat)
+        self._timeline = MidiTimeline(self.converters["time"], self.converters["bartime"])
+        self._length = self.converters["time"].to_time(ingested["end_ticks"])
+    
+    @property
+    def timeline(self) -> MidiTimeline:
+        if self._timeline is None:
+            self.load_tempo_map()
+        return self._timeline
+    
+    @property
+    def length(self):
+        if self._length is None:
+            self.load_tempo_map()
+        return self._length
+        
+    def ingest(self, midofile, dispatch=True):
+        """Single sweep over the messages of every track, without copying any of them.
+
+        Messages are paired with their absolute ticks, and gathered in playback order as mido.merge_tracks would do:
+        the tempo and time signature events, the meta messages (end_of_track being merged into a single last one),
+        the messages of each channel and the names of the tracks related to each channel.
+        Only the tempo and time signature events are gathered if dispatch is False.
+        """
+        tempo_events = []
+        meta_stream = []
+        channel_streams = {}
+        related_track_names = [[] for _ in range(16)]
+        end_ticks = 0
+        
+        for track in midofile.tracks:
+            ticks = 0
+            channels = set()
+            for message in track:
+                ticks += message.time
+                if message.is_meta:
+                    if message.type == "set_tempo" or message.type == "time_signature":
+                        tempo_events.append((ticks, message))
+                    if dispatch and message.type != "end_of_track":
+                        meta_stream.append((ticks, message))
+                elif dispatch and "channel" in message.__dict__:
+                    if message.channel not in channel_streams:
+                        channel_streams[message.channel] = []
+                    channel_streams[message.channel].append((ticks, message))
+                    channels.add(message.channel)
+            end_ticks = max(end_ticks, ticks)
+            for channel in channels:
+                related_track_names[channel].append(track.name.strip())
+        
+        # Stable sorts, so that messages at the same ticks stay in track order
+        tempo_events.sort(key=itemgetter(0))
+        meta_stream.sort(key=itemgetter(0))
+        for channel in sorted(channel_streams):
+            channel_streams[channel].sort(key=itemgetter(0))
+        if dispatch:
+            meta_stream.append((end_ticks, mido.MetaMessage("end_of_track")))
+        
+        return {"tempo_events": tempo_events,
+                "meta_stream": meta_stream,
+                "channel_streams": channel_streams,
+                "related_track_names": related_track_names,
+                "end_ticks": end_ticks}
+    
+    def ingest_events(self, smf, dispatch=True):
+        """Same as ingest, from the events arrays of a smf_reader.SmfFile, the streams being events arrays"""
+        tracks_events = [smf.track_events(i) for i in range(smf.track_count)]
+        events = smf_reader.merge_events(tracks_events)
+        end_ticks = max([int(track_events["ticks"][-1]) for track_events in tracks_events if len(track_events) > 0], default=0)
+        
+        ingested = {"tempo_events": smf.tempo_messages(events),
+                    "meta_stream": None,
+                    "channel_streams": {},
+                    "related_track_names": [[] for _ in range(16)],
+                    "end_ticks": end_ticks}
+        if dispatch:
+            meta_events = smf_reader.meta_mask(events)
+            end_of_track = np.zeros(1, dtype=smf_reader.EVENT_DTYPE)
+            end_of_track[["track", "ticks", "status", "data1"]] = (smf.track_count, end_ticks, smf_reader.META, smf_reader.META_END_OF_TRACK)
+            ingested["meta_stream"] = np.concatenate([events[meta_events & (events["data1"] != smf_reader.META_END_OF_TRACK)], 
+                                                      end_of_track])
+            
+            channel_events = smf_reader.channel_mask(events)
+            channels = events["status"] & 0x0F
+            for channel in np.unique(channels[channel_events]):
+                ingested["channel_streams"][int(channel)] = events[channel_events & (channels == channel)]
+            
+            for i, track_events in enumerate(tracks_events):
+                track_channels = np.unique(track_events["status"][smf_reader.channel_mask(track_events)] & 0x0F)
+                for channel in track_channels:
+                    ingested["related_track_names"][channel].append(smf.track_name(i).strip())
+        return ingested
+    
+    @staticmethod
+    def extract_tempos_and_timesigs(tempo_events):
+        """From the (ticks, message) tempo and time signature events in playback order, returns the tempo changes
+        and time signature changes with delta times, only the last change being kept when several happen at the same ticks"""
+        tempos = []
+        timesigs = []
+        last_tempo_ticks = 0
+        last_timesig_ticks = 0
+        for ticks, message in tempo_events:
+            if message.type == "set_tempo" \
+                and (len(tempos) == 0 or tempos[-1].tempo != message.tempo):
+                if len(tempos) > 0 and last_tempo_ticks == ticks:
+                    tempos[-1] = message.copy(time=tempos[-1].time)
+                else:
+                    tempos.append(message.copy(time=ticks - last_tempo_ticks))
+                last_tempo_ticks = ticks
+            elif message.type == "time_signature" \
+                and (len(timesigs) == 0 \
+                    or not (timesigs[-1].numerator == message.numerator and timesigs[-1].denominator == message.denominator)):
+                if len(timesigs) > 0 and last_timesig_ticks == ticks:
+                    timesigs[-1] = message.copy(time=timesigs[-1].time)
+                else:
+                    timesigs.append(message.copy(time=ticks - last_timesig_ticks))
+                last_timesig_ticks = ticks
+        return tempos, timesigs
         
         
 
@@ -249,7 +815,7 @@ class MidiFrame:
         rep = ""
         for k in ("info_type", "filename", "midi_type", "track_count", "music_track_count", "ticks_per_beat", "length"):
             key_name = k.replace("_", " ").capitalize()
-            rep += f"{key_name}: {self.__dict__[k]}\n"
+            rep += f"{key_name}: {getattr(self, k)}\n"
         for track_frame in self.track_frames:
             rep += track_frame.__repr__()
         if self.converters["bartime"].event_count > 0:
@@ -267,16 +833,58 @@ class MidiFrame:
         return rep + "\n"
         
     def make_playing_track_frame(self, channels, only_unique_channel=False):
-        tracks = []
+        """Set the playing track frame to the merge of the track frames with the given channels. 
+        Playing track frames of the last PLAYING_TRACK_FRAME_CACHE_SIZE selections of track frames are kept, 
+        so that toggling back to a previous selection of channels reuses its already built dataframe. 
+        The scale timeline of the former playing track frame is stopped, and evicted frames are dropped with 
+        their analysis caches."""
+        selection = []
         channels = set(channels)
-        for track_frame in self.track_frames:
+        for i, track_frame in enumerate(self.track_frames):
             if (only_unique_channel and track_frame.unique_channel in channels) \
                     or (not only_unique_channel and not set(track_frame.channel_count.keys()).isdisjoint(channels)):
-                tracks.append(track_frame.track)
+                selection.append(i)
+        selection = tuple(selection)
+        
+        if selection in self.playing_track_frames:
+            self.playing_track_frames.move_to_end(selection)
+        else:
+            self.playing_track_frames[selection] = self.mix_track_frames([self.track_frames[i] for i in selection], 
+                                                                         track_name="Playing Track")
+            while len(self.playing_track_frames) > self.PLAYING_TRACK_FRAME_CACHE_SIZE:
+                _, evicted = self.playing_track_frames.popitem(last=False)
+                evicted.drop_analysis_caches()
         
-        self.playing_track_frame = MidiTrackFrame(mido.merge_tracks(tracks), 
-                                                  converters=self.converters,
-                                                  track_name="Playing Track")
+        if self.playing_track_frame is not None and self.playing_track_frame is not self.playing_track_frames[selection]:
+            self.playing_track_frame.drop_analysis_caches()
+        self.playing_track_frame = self.playing_track_frames[selection]
+
+    def scale_timeline(self, window_extent=(1, 1), analysis_parameters={}, background=True) -> ScaleTimeline:
+        """ScaleTimeline of the playing track frame, kept by the track frame and computed in the background
+        from its creation on, its parameters being updated (see ScaleTimeline.set_parameters)"""
+        track_frame = self.playing_track_frame
+        if track_frame.scale_timeline is None:
+            track_frame.scale_timeline = ScaleTimeline(track_frame, window_extent, analysis_parameters, background)
+        else:
+            track_frame.scale_timeline.set_parameters(window_extent, analysis_parameters)
+        return track_frame.scale_timeline
+
+    def mix_track_frames(self, track_frames, track_name):
+        """Track frame merging the messages of track_frames as mido.merge_tracks would, its dataframe 
+        being the merge of their cached dataframes instead of being extracted again from the merged messages"""
+        if self.smf is not None:
+            stream = smf_reader.merge_events([track_frame.events for track_frame in track_frames])
+            stream = stream[~smf_reader.meta_mask(stream, smf_reader.META_END_OF_TRACK)]
+        else:
+            stream = []
+            for track_frame in track_frames:
+                stream.extend(track_frame.ticks_and_messages())
+            stream.sort(key=itemgetter(0))
+            stream = [(ticks, message) for ticks, message in stream if message.type != "end_of_track"]
+        
+        mixed_track_frame = self.stream_to_track_frame(stream, track_name=track_name)
+        mixed_track_frame.dataframe = mu.mix_note_dataframes([track_frame.dataframe for track_frame in track_frames])
+        return mixed_track_frame
 
     def export_playing_track(self):
         if not os.path.exists(self.EXPORT_DEFAULT_DIRPATH):
@@ -296,6 +904,23 @@ class MidiFrame:
                                      tracks=tracks)
         playing_midi.save(self.EXPORT_DEFAULT_FILEPATH)
 
+    def stream_to_track_frame(self, stream, track_name, related_track_names=[]):
+        """Track frame of a stream of ingest (list of (ticks, message)) or ingest_events (events array)"""
+        if self.smf is not None:
+            return MidiTrackFrame(None,
+                                  converters=self.converters,
+                                  track_name=track_name,
+                                  compute_dataframe=False,
+                                  related_track_names=related_track_names,
+                                  events=stream,
+                                  smf=self.smf)
+        return MidiTrackFrame([message for _, message in stream],
+                              converters=self.converters,
+                              track_name=track_name,
+                              compute_dataframe=False,
+                              related_track_names=related_track_names,
+                              messages_ticks=[ticks for ticks, _ in stream])
+
     def filter_track_frames(self,
                             only=False,
                             filter_irrelevant_meta_tracks=True):
@@ -312,70 +937,19 @@ class MidiFrame:
             elif only == "music":
                 del self.track_frames[ti]
                 self.track_count -= 1
-                self.music_track_count -= 1
                 
 
-    def dispatch_tracks_by_channel(self, midofile, **kwargs):
-        time = 0
-        channel_set = set()
-        sorted_track = mido.MidiTrack()
-        for message in mido.merge_tracks(midofile.tracks):
-            timed_message = message.copy()
-            time += message.time
-            timed_message.time = time
-            sorted_track.append(timed_message)
-            if "channel" in message.__dict__:
-                channel_set.add(message.channel)
-        
-        channel_tracks = dict((channel, mido.MidiTrack()) for channel in channel_set)
-        meta_track = mido.MidiTrack()
-        
-        for message in sorted_track:
-            if message.is_meta and "track_name" not in message.__dict__ :
-                meta_track.append(message.copy())
-            elif "channel" in message.__dict__:
-                channel_tracks[message.channel].append(message.copy())
-        
-        if len(meta_track) > 0:
-            previous_time = 0
-            for message in meta_track:
-                tmp_time = message.time
-                message.time = tmp_time - previous_time
-                previous_time = tmp_time
-            
-            self.track_frames.append(MidiTrackFrame(meta_track,
-                                                    converters=self.converters,
-                                                    compute_dataframe=False,
-                                                    track_name="Meta"))
+    def dispatch_tracks_by_channel(self, ingested, **kwargs):
+        meta_stream = ingested["meta_stream"]
+        if len(meta_stream) > 0:
+            self.track_frames.append(self.stream_to_track_frame(meta_stream, track_name="Meta"))
         
-        related_track_names = [[] for _ in range(16)]
-        for track in midofile.tracks:
-            channels = set()
-            for m in track:
-                try:
-                    channels.add(m.channel)
-                except:
-                    pass
-            for channel in channels:
-                related_track_names[channel].append(track.name.strip())
+        related_track_names = ingested["related_track_names"]
+        for channel, channel_stream in sorted(ingested["channel_streams"].items()):
+            self.track_frames.append(self.stream_to_track_frame(channel_stream,
+                                                                track_name=f"Channel {channel:02}",
+                                                                related_track_names=related_track_names[channel]))
         
-        for channel, channel_track in channel_tracks.items():
-            if len(channel_track) > 0:
-                previous_time = 0
-                for message in channel_track:
-                    tmp_time = message.time
-                    message.time = tmp_time - previous_time
-                    previous_time = tmp_time
-                
-                self.track_frames.append(MidiTrackFrame(channel_track,
-                                                        converters=self.converters,
-                                                        track_name=f"Channel {channel:02}",
-                                                        compute_dataframe=False,
-                                                        related_track_names=related_track_names[channel]))
-                
-        for track_frame in self.track_frames:
-            if not track_frame.meta_only:
-                self.music_track_count += 1
         self.track_count = self.music_track_count + 1
 
             
\ No newline at end of file
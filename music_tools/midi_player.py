@@ -1,10 +1,11 @@
-import mido
-from pretty_midi import PrettyMIDI
 import sounddevice as sd
+import numpy as np
 from math import ceil
 
 from music_tools.midi_frame import MidiFrame
+from music_tools.synthesis import ChannelMixer, StreamingSynthesizer
 import music_tools.midi_utils as mu
+import music_tools.smf_reader as smf_reader
 import music_tools.scales as scales
 from music_tools.utils import stereo_sound
 
@@ -14,9 +15,15 @@ class MidiPlayer:
                  path,
                  volume=0.5,
                  sample_frequency=22050,
+                 memmap_dirpath=None,
+                 streaming=False,
+                 synthesizer=None,
+                 precompute_analysis=False,
                  on_cursor_change_callback=lambda midiplayer: print("No on cursor change callback"),
                  on_window_change_callback=lambda midiplayer: print("No on window change callback"),
                  on_analysis_change_callback=lambda midiplayer: print("No on analysis change callback")):
+        if synthesizer is not None and synthesizer.Fs != sample_frequency:
+            raise ValueError(f"The synthesizer sample frequency ({synthesizer.Fs}) differs from the player's ({sample_frequency})")
         self.file_name = file_name 
         self.path = path
         self.playing = False
@@ -46,13 +53,27 @@ class MidiPlayer:
         self.on_window_change_callback = on_window_change_callback
         self.on_analysis_change_callback = on_analysis_change_callback
         self.general_scale_subset = scales.ALL_GENERAL_ROTZERO_SCALES
+        # If the suggestions of every bar are computed in the background, playback only looking them up
+        self.precompute_analysis = precompute_analysis
+        self.scale_timeline = None
         
         self.channels = [i for i in range(16)]
-        self.as_mido = mido.MidiFile(filename=self.file_name)
+        # Read at once rather than memory-mapped (smf_reader.open_smf): the tracks are dispatched by channel 
+        # and every channel is played, so every track is decoded when the file is opened anyway
+        self.smf = smf_reader.SmfFile(self.file_name)
         
-        self.midiframe = MidiFrame(self.as_mido)
+        self.midiframe = MidiFrame(self.smf)
 
         self.Fs = sample_frequency
+        # Either the channels are pre-rendered and mixed, or the playing notes are synthesized block by block,
+        # by a StreamingSynthesizer or a given synthesizer of the same interface (e.g. WavetableSynthesizer)
+        self.streaming = streaming or synthesizer is not None
+        if synthesizer is not None:
+            self.synthesizer = synthesizer
+        elif self.streaming:
+            self.synthesizer = StreamingSynthesizer(self.Fs)
+        else:
+            self.mixer = ChannelMixer(self.midiframe, self.Fs, memmap_dirpath=memmap_dirpath)
         
         self.mute = False
         self.volume = volume
@@ -66,8 +87,11 @@ class MidiPlayer:
             # self.ctx.callback_enter(status, outdata)
 
             if self.playing:
-                if not self.mute:
+                if self.streaming:
+                    sound = self.volume * self.synthesizer.read(frame_count)
+                else:
                     sound = self.volume * self.audio_data[self.cursor["idx"]:self.cursor["idx"]+frame_count]
+                if not self.mute:
                     outdata[:len(sound)] = stereo_sound(sound, sound, min(1-self.balance, 1.0), min(1+self.balance, 1.0))
             
                 self.update_cursor(self.cursor["idx"] + frame_count)
@@ -80,6 +104,8 @@ class MidiPlayer:
     def refresh_dataframe(self):
         self.midiframe.make_playing_track_frame(self.channels)
         self.df = self.midiframe.playing_track_frame.dataframe
+        if self.precompute_analysis:
+            self.scale_timeline = self.midiframe.scale_timeline(self.analysis_window_extent, self.analysis_parameters)
         
         #self.displayable = True if ('note' in self.df and self.df["time_duration"].iloc[1] is not None) else False
         # self.displayable = True if 'note' in self.df else False
@@ -90,49 +116,37 @@ class MidiPlayer:
             self.max_note = self.df['note'].max()
             self.length = self.df["time"].iloc[-1]
             print("midi length: " + str(self.length) + " seconds")
-        self.midiframe.export_playing_track()
-        
-        # music = PrettyMIDI(midi_file=file_name)
-        music = PrettyMIDI(midi_file=MidiFrame.EXPORT_DEFAULT_FILEPATH)
-        was_playing = self.playing
-        self.pause()
-        self.audio_data = music.synthesize(fs=self.Fs)
-        self.ctx.frames = self.ctx.check_data(self.audio_data, None, sd.default.device)   # type: ignore
-        if was_playing:
-            self.play()
+        
+        if self.streaming:
+            self.synthesizer.set_notes(self.df)
+            self.audio_length = self.synthesizer.sample_count
+            # Only sets up the output dtype of the stream, samples being read from the synthesizer
+            self.ctx.frames = self.ctx.check_data(np.zeros(1, dtype=np.float32), None, sd.default.device)   # type: ignore
+        else:
+            # Each channel is only synthesized once, toggling channels just mixes their cached audio, 
+            # the new audio being swapped in without stopping the stream
+            self.audio_data = self.mixer.set_channels(self.channels)
+            self.audio_length = len(self.audio_data)
+            self.ctx.frames = self.ctx.check_data(self.audio_data, None, sd.default.device)   # type: ignore
             
     def update_cursor(self, 
                       cursor, 
                       metric="idx", 
                       on_cursor_callback=True, 
                       on_window_call_back=True):
-        if cursor <= 0 or cursor > len(self.audio_data)*1.02:
+        if cursor <= 0 or cursor > self.audio_length*1.02:
             for k in self.cursor:
                 self.cursor[k] = 0
-        elif metric == "idx" and cursor != self.cursor["idx"]:
-            self.cursor["idx"] = cursor
-            
-            self.cursor["time"] = self.cursor["idx"]/self.Fs
-            self.cursor["ticks"] = self.midiframe.converters["time"].to_ticks(self.cursor["time"])
-            self.cursor["bartime"] = self.midiframe.converters["bartime"].to_bartime(self.cursor["ticks"])
-        elif metric == "ticks" and cursor != self.cursor["ticks"]:
-            self.cursor["ticks"] = cursor
-            
-            self.cursor["bartime"] = self.midiframe.converters["bartime"].to_bartime(self.cursor["ticks"])
-            self.cursor["time"] = self.midiframe.converters["time"].to_time(self.cursor["ticks"])
-            self.cursor["idx"] = int(self.cursor["time"] * self.Fs)
-        elif metric == "time" and cursor != self.cursor["time"]:
-            self.cursor["time"] = cursor
-
-            self.cursor["idx"] = int(self.cursor["time"] * self.Fs)
-            self.cursor["ticks"] = self.midiframe.converters["time"].to_ticks(self.cursor["time"])
-            self.cursor["bartime"] = self.midiframe.converters["bartime"].to_bartime(self.cursor["ticks"])
-        elif metric == "bartime" and cursor != self.cursor["bartime"]:
-            self.cursor["bartime"] = cursor
-            
-            self.cursor["ticks"] = self.midiframe.converters["bartime"].to_ticks(self.cursor["bartime"])
-            self.cursor["time"] = self.midiframe.converters["time"].to_time(self.cursor["ticks"])
-            self.cursor["idx"] = int(self.cursor["time"] * self.Fs)
+        elif metric in self.cursor and cursor != self.cursor[metric]:
+            ticks, time, bartime, idx = self.midiframe.timeline.locate(cursor, metric, self.Fs)
+            self.cursor["ticks"] = ticks
+            self.cursor["time"] = time
+            self.cursor["bartime"] = bartime
+            self.cursor["idx"] = idx
+        
+        if self.streaming:
+            # Only seeks if the cursor was not moved by the playback itself
+            self.synthesizer.seek(self.cursor["idx"])
         
         
         if int(self.cursor["bartime"]) != self.analysis_last_bar:
@@ -175,6 +189,10 @@ class MidiPlayer:
                     .suggest_scale(self.analysis_window[0],
                                 self.analysis_window[1],
                                 **self.analysis_parameters)        
+            elif self.scale_timeline is not None and self.analysis_window[1] - self.analysis_window[0] == sum(self.analysis_window_extent):
+                # Parameters are only compared, the timeline being computed again if they changed
+                self.scale_timeline.set_parameters(self.analysis_window_extent, self.analysis_parameters)
+                self.analysis_suggestions = self.scale_timeline.suggestions(self.analysis_window[0] + self.analysis_window_extent[0])
             else:
                 
                 self.analysis_suggestions = self.midiframe.playing_track_frame\
@@ -184,34 +202,7 @@ class MidiPlayer:
             self.on_analysis_change_callback(self)
     
     def convert_unit(self, value, from_metric, to_metric):
-        if from_metric == to_metric:
-            return value
-        if from_metric == "bartime":
-            ticks = self.midiframe.converters["bartime"].to_ticks(value)
-            if to_metric == "ticks":
-                return ticks
-            else:
-                time = self.midiframe.converters["time"].to_time(ticks)
-                return time if to_metric == "time" else int(time * self.Fs)
-        elif from_metric == "ticks":
-            if to_metric == "bartime":
-                return self.midiframe.converters["bartime"].to_bartime(value)
-            else:
-                time = self.midiframe.converters["time"].to_time(value)
-                return time if to_metric == "time" else int(time * self.Fs)
-        elif from_metric == "time":
-            if to_metric in ("ticks", "bartime"):
-                ticks = self.midiframe.converters["time"].to_ticks(value)
-                return ticks if to_metric == "ticks" else self.midiframe.converters["bartime"].to_bartime(ticks)
-            else:
-                return int(value * self.Fs)
-        elif from_metric == "idx":
-            time = value / self.Fs
-            if to_metric == "time":
-                return time
-            else:
-                ticks = self.midiframe.converters["time"].to_ticks(time)
-                return ticks if to_metric == "ticks" else self.midiframe.converters["bartime"].to_bartime(ticks)
+        return self.midiframe.timeline.convert(value, from_metric, to_metric, self.Fs)
             
     def add_channel(self, channel):
         if channel not in self.channels: 
@@ -244,6 +235,19 @@ class MidiPlayer:
         self.playing = False
         sd.stop()
 
+    def close(self):
+        """Stop the playback and release the synthesizer or the channel buffers, the scale timelines and the midi file"""
+        self.stop()
+        if self.streaming:
+            if hasattr(self.synthesizer, "close"):
+                self.synthesizer.close()
+        else:
+            self.mixer.close()
+        for track_frame in self.midiframe.playing_track_frames.values():
+            track_frame.drop_analysis_caches()
+        self.scale_timeline = None
+        self.smf.close()
+
     def get_suggestions(self):
         return self.analysis_suggestions
         
@@ -1,11 +1,11 @@
 
+from functools import lru_cache
 import numpy as np
 import mido
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 
 from music_tools.temporal_converters import TicksBartimeConverter, TicksTimeConverter
+from music_tools.smf_reader import note_on_mask, note_off_mask
 pd.options.mode.chained_assignment = None  # default='warn'
 
 MIDI_IDS = np.arange(128)
@@ -57,10 +57,10 @@ CHROMA_NAMES = np.array([(sharp_name + "/" + flat_name) if sharp_name != flat_na
 
 CHROMA_ALT_NAMES = np.array(name_to_alt_name(CHROMA_NAMES))
 
-MIDI_SHARP_NAMES = np.array([CHROMA_SHARP_NAMES[to_chroma(midi_id)] + np.str_(to_octave(midi_id)) if midi_id >= 12 else "" 
-                                for midi_id in MIDI_IDS])
-MIDI_FLAT_NAMES = np.array([CHROMA_FLAT_NAMES[to_chroma(midi_id)] + np.str_(to_octave(midi_id)) if midi_id >= 12 else "" 
-                                for midi_id in MIDI_IDS])
+MIDI_SHARP_NAMES = np.array([CHROMA_SHARP_NAMES[to_chroma(midi_id)] + str(to_octave(midi_id)) if midi_id >= 12 else "" 
+                                for midi_id in MIDI_IDS.tolist()])
+MIDI_FLAT_NAMES = np.array([CHROMA_FLAT_NAMES[to_chroma(midi_id)] + str(to_octave(midi_id)) if midi_id >= 12 else "" 
+                                for midi_id in MIDI_IDS.tolist()])
 MIDI_NAMES = np.array([(sharp_name + "/" + flat_name) if sharp_name != flat_name else sharp_name 
                             for sharp_name, flat_name in zip(MIDI_SHARP_NAMES, MIDI_FLAT_NAMES)])
 
@@ -129,71 +129,159 @@ def harmonics_from_midi_id(midi_id, k=8, include_id=False):
 
 
 
+NOTE_COLUMNS = ("channel", "note", "velocity", "ticks", "ticks_release", "velocity_release")
+
 def track_to_dataframe(track: mido.MidiTrack, 
                        time_conv: TicksTimeConverter,
-                       bartime_conv: TicksBartimeConverter):
-    records = []
-    current_ticks = 0
+                       bartime_conv: TicksBartimeConverter,
+                       messages_ticks=None):
+    """Build the note DataFrame of a track in a single pass over its messages.
+
+    Note columns are filled in preallocated arrays (a track can't hold more notes than messages),
+    a note being released by the next note_off (or note_on with velocity 0) on the same note and channel.
+    Notes that are never released are dropped.
+    If messages_ticks is given, it holds the absolute ticks of each message, their time attribute being ignored.
+    The track can also be an events array of music_tools.smf_reader, see events_to_dataframe.
+    """
+    if isinstance(track, np.ndarray):
+        return events_to_dataframe(track, time_conv, bartime_conv)
+    
+    capacity = len(track)
+    channel = np.empty(capacity, dtype=np.int64)
+    note = np.empty(capacity, dtype=np.int64)
+    velocity = np.empty(capacity, dtype=np.int64)
+    ticks = np.empty(capacity, dtype=np.int64)
+    ticks_release = np.full(capacity, -1, dtype=np.int64)
+    velocity_release = np.zeros(capacity, dtype=np.int64)
     
     pressed_notes = {}
-    id = 0
+    count = 0
+    current_ticks = 0
+    for i, message in enumerate(track):
+        if messages_ticks is None:
+            current_ticks += message.time
+        else:
+            current_ticks = messages_ticks[i]
+        message_type = message.type
+        if message_type == "note_on" and message.velocity > 0:
+            channel[count] = message.channel
+            note[count] = message.note
+            velocity[count] = message.velocity
+            ticks[count] = current_ticks
+            pressed_notes[(message.channel, message.note)] = count
+            count += 1
+        elif message_type == "note_off" or message_type == "note_on":
+            # A release without a former press is simply ignored
+            pressed = pressed_notes.pop((message.channel, message.note), None)
+            if pressed is not None:
+                ticks_release[pressed] = current_ticks
+                velocity_release[pressed] = message.velocity
     
-    for x in track:
-        new_dict = x.__dict__.copy()
-        new_dict["ticks"] = new_dict["time"]
-        del new_dict["time"]
-        
-        current_ticks += new_dict["ticks"]
-        
-        if new_dict["type"] == "note_off" or new_dict["type"] == "note_on" and new_dict["velocity"] == 0:
-            former_pressed_note = pressed_notes[new_dict["note"]]
-            if former_pressed_note is None:
-                # raise ValueError("The given track has a released note that was never pressed in the first place")
-                # print("\rThe given track has a released note that was never pressed in the first place")
-                pass
-            else:
-                pressed_record = records[former_pressed_note["id"]]
-                pressed_record["ticks_release"] = current_ticks
-                pressed_record["velocity_release"] = new_dict["velocity"]
-                pressed_notes[new_dict["note"]] = None
-        elif new_dict["type"] == "note_on":
-            new_dict["ticks"] = current_ticks
-            new_dict["ticks_release"] = None
-            new_dict["velocity_release"] = None
-            pressed_notes[new_dict["note"]] = {"id": id}
-            del new_dict["type"]
-            records.append(new_dict)
-            id += 1
+    return notes_to_dataframe({"channel": channel[:count],
+                               "note": note[:count],
+                               "velocity": velocity[:count],
+                               "ticks": ticks[:count],
+                               "ticks_release": ticks_release[:count],
+                               "velocity_release": velocity_release[:count]},
+                              time_conv,
+                              bartime_conv)
+
+def events_to_dataframe(events: np.ndarray,
+                        time_conv: TicksTimeConverter,
+                        bartime_conv: TicksBartimeConverter):
+    """Vectorized track_to_dataframe over an events array of music_tools.smf_reader, in playback order.
     
-    df = pd.DataFrame(records)
-    if len(df) > 0:
-        df = df.dropna(subset=["ticks_release"]).reset_index()
-        
-        df["time"] = time_conv.to_time(df["ticks"])
-        df["time_release"] = df["time"]
-        df["bartime"] = bartime_conv.to_bartime(df["ticks"])
-        df["bartime_release"] = df["bartime"]
-        mapping = np.argsort(df["ticks_release"])
-        
-        df["time_release"].iloc[mapping] =  time_conv.to_time(df["ticks_release"][mapping])
-        df["bartime_release"].iloc[mapping] = bartime_conv.to_bartime(df["ticks_release"][mapping])
-        df["onset"] = df["bartime"] - np.floor(df["bartime"])
-        
-        weights = []
-        last_timesig = bartime_conv.events[0][0]
-        updown_beats = get_updown_beats(last_timesig[0])
-        for row in df[["ticks", "onset"]].itertuples():
-            timesig = bartime_conv.to_timesig(row.ticks)
-            if timesig != last_timesig:
-                updown_beats = get_updown_beats(timesig[0])
-                last_timesig = timesig
-            
-            weights.append(updown_beats[int(row.onset * len(updown_beats))])
-        
-        df["weight"] = weights
+    Grouping the note events by channel and note (keeping the playback order), a press is released 
+    by the event following it in its group if that one is a release.
+    """
+    presses = note_on_mask(events)
+    releases = note_off_mask(events)
+    note_events = np.flatnonzero(presses | releases)
+    keys = (events["status"] & 0x0F).astype(np.int64) << 7 | events["data1"]
+    grouped = note_events[np.argsort(keys[note_events], kind="stable")]
+    paired = presses[grouped[:-1]] & releases[grouped[1:]] & (keys[grouped[:-1]] == keys[grouped[1:]])
+    
+    press_count = np.count_nonzero(presses)
+    press_ranks = np.cumsum(presses) - 1
+    ticks_release = np.full(press_count, -1, dtype=np.int64)
+    velocity_release = np.zeros(press_count, dtype=np.int64)
+    ticks_release[press_ranks[grouped[:-1][paired]]] = events["ticks"][grouped[1:][paired]]
+    velocity_release[press_ranks[grouped[:-1][paired]]] = events["data2"][grouped[1:][paired]]
+    
+    pressed = events[presses]
+    return notes_to_dataframe({"channel": (pressed["status"] & 0x0F).astype(np.int64),
+                               "note": pressed["data1"].astype(np.int64),
+                               "velocity": pressed["data2"].astype(np.int64),
+                               "ticks": pressed["ticks"].astype(np.int64),
+                               "ticks_release": ticks_release,
+                               "velocity_release": velocity_release},
+                              time_conv,
+                              bartime_conv)
+
+def notes_to_dataframe(note_columns: dict,
+                       time_conv: TicksTimeConverter,
+                       bartime_conv: TicksBartimeConverter):
+    """Build the note DataFrame from the NOTE_COLUMNS arrays, sorted by ticks (stable, notes pressed at the same 
+    ticks keeping their order). Unreleased notes (ticks_release < 0) are dropped, "index" keeps their original position.
+    """
+    if len(note_columns["ticks"]) == 0:
+        return pd.DataFrame()
+    
+    released = np.flatnonzero(note_columns["ticks_release"] >= 0)
+    # Notes come in playback order from the tracks, so this is usually already sorted
+    released = released[np.argsort(note_columns["ticks"][released], kind="stable")]
+    columns = {"index": released}
+    for column in NOTE_COLUMNS:
+        columns[column] = note_columns[column][released]
+    
+    ticks = columns["ticks"]
+    ticks_release = columns["ticks_release"]
+    columns["time"] = time_conv.to_time(ticks)
+    columns["time_release"] = time_conv.to_time(ticks_release)
+    columns["bartime"] = bartime_conv.to_bartime(ticks)
+    columns["bartime_release"] = bartime_conv.to_bartime(ticks_release)
+    columns["onset"] = columns["bartime"] - np.floor(columns["bartime"])
+    
+    columns["weight"] = compute_beat_weights(ticks, columns["onset"], bartime_conv)
+    
+    df = pd.DataFrame(columns)
     
     return df
 
+def mix_note_dataframes(dataframes):
+    """Merge note DataFrames of notes_to_dataframe into one sorted by ticks, ties keeping the order of dataframes
+    (as mido.merge_tracks does), "index" being the position in the mix."""
+    dataframes = [df for df in dataframes if len(df) > 0]
+    if len(dataframes) == 0:
+        return pd.DataFrame()
+    
+    columns = {column: np.concatenate([df[column].to_numpy() for df in dataframes]) for column in dataframes[0].columns}
+    order = np.argsort(columns["ticks"], kind="stable")
+    for column in columns:
+        columns[column] = columns[column][order]
+    columns["index"] = np.arange(len(order))
+    return pd.DataFrame(columns)
+
+def compute_beat_weights(ticks, onsets, bartime_conv: TicksBartimeConverter):
+    """Beat importance of every note (see get_updown_beats), all notes of a same time signature
+    numerator being looked up at once in its cached updown beats table.
+    """
+    numerators = np.array([timesig[0] for timesig in bartime_conv.segment_objects()], dtype=np.int64)
+    numerators = numerators[bartime_conv.segment_index(ticks)]
+    beats = (onsets * numerators).astype(np.int64)
+    
+    weights = np.empty(len(ticks))
+    for num in np.unique(numerators):
+        mask = numerators == num
+        weights[mask] = updown_beats_table(num)[beats[mask]]
+    return weights
+
+@lru_cache(maxsize=None)
+def updown_beats_table(num):
+    table = np.array(get_updown_beats(int(num)), dtype=np.float64)
+    table.setflags(write=False)
+    return table
+
 def get_updown_beats(num, normalized=True):
     """Borrowed from Matthieu's Semester Project
     
@@ -245,7 +333,12 @@ def plot_music(track_df: pd.DataFrame,
                chroma_plot=False,
                metric="ticks",
                ax=None, 
-               cmap=plt.get_cmap("gist_rainbow")):
+               cmap=None):
+    # matplotlib is only imported to plot, as it is much longer to import than the rest of the module
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
+    if cmap is None:
+        cmap = plt.get_cmap("gist_rainbow")
     if ax is None:
         _, ax = plt.subplots()
     
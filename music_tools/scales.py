@@ -1,20 +1,277 @@
+from functools import lru_cache
+import os
+import zipfile
 import numpy as np
 import pandas as pd
-import pickle
 
 import music_tools.midi_utils as mu
 
-FOLDER = "scale_researches/"
-SCALE_DATA = pd.read_csv(FOLDER + "scale_final_data.csv")
-SCALE_DATA = SCALE_DATA.set_index("scale_id")
+# scale_researches folder of the repository, wherever the working directory is
+FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scale_researches", "")
+# Scale data, forest and parents compiled from the scale names of FOLDER (see compile_scale_data, and 
+# scale_researches.build_scale_catalogue for the full build), in a versioned .npz file committed with the code
+SCALE_DATA_PATH = FOLDER + "scale_data.npz"
+SCALE_DATA_VERSION = 2
+SCALE_DATA_COLUMNS = ("scale_id", "scale_bits", "rotation_id", "circular_distance", "note_count", "name")
 
-SCALE_FOREST = {}
-with open(FOLDER + "scale_forest.pkl", "rb") as file:
-    SCALE_FOREST = pickle.load(file)
+# SCALE_CATALOGUE, SCALE_DATA, SCALE_FOREST, SCALE_PARENTS, ALL_GENERAL_SCALES and ALL_GENERAL_ROTZERO_SCALES are only loaded
+# when first accessed (see __getattr__ at the end of the module), so that importing the module stays fast.
+
+def compile_scale_data(folder=FOLDER, path=None):
+    """Compile the scale data csv of folder into the scale data file (SCALE_DATA_PATH by default)"""
+    data = pd.read_csv(folder + "scale_final_data.csv")
+    arrays = scale_catalogue_columns(data.scale_id.to_numpy(), data.name.astype(str).tolist())
+    arrays.update(scale_catalogue_links(arrays["scale_id"]))
+    save_scale_data(SCALE_DATA_PATH if path is None else path, arrays)
+
+def scale_catalogue_columns(scale_ids, names):
+    """The SCALE_DATA_COLUMNS arrays of the catalogue of the named scales, in the order of scale_ids.
     
-SCALE_PARENTS = {}
-with open(FOLDER + "scale_parents.pkl", "rb") as file:
-    SCALE_PARENTS = pickle.load(file)
+    Rotation classes and circular distances are computed for the 4096 chroma sets at once with the bitmap tables: 
+    the rotation id of a chroma set is its note count << 12 | the first named scale (in the order of scale_ids) of its 
+    rotations, or its smallest rotation if none is named, and its circular distance is the roll from it to this scale.
+    """
+    scale_ids = np.asarray(scale_ids, dtype=np.int64)
+    named_rotations = CANONICAL_ROTATION_TABLE[scale_ids]
+    canonical_rotations, first_named = np.unique(named_rotations, return_index=True)
+    representatives = CANONICAL_ROTATION_TABLE.copy()
+    representatives[canonical_rotations] = scale_ids[first_named]
+    representatives = representatives[CANONICAL_ROTATION_TABLE]
+    
+    rotation_ids = POPCOUNT_TABLE << 12 | representatives
+    circular_distances = (CANONICAL_SHIFT_TABLE[representatives] - CANONICAL_SHIFT_TABLE) % ROTATION_PERIOD_TABLE
+    # The 12 binary digits of the bitmap read as a decimal number, as in the research sheets
+    scale_bits = CHROMA_ARRAY_TABLE.astype(np.int64) @ 10**(11 - mu.CHROMA_IDS)
+    
+    return {"scale_id": scale_ids,
+            "scale_bits": scale_bits[scale_ids],
+            "rotation_id": rotation_ids[scale_ids],
+            "circular_distance": circular_distances[scale_ids],
+            "note_count": POPCOUNT_TABLE[scale_ids],
+            "name": np.array(names, dtype=str)}
+
+def scale_catalogue_links(scale_ids):
+    """The children (forest) and parents of every scale in the inclusion DAG of the scales (see InclusionDAG), 
+    as flattened lists with offsets"""
+    dag = InclusionDAG(scale_ids)
+    arrays = {}
+    for name, links in (("forest", dag.children), ("parents", dag.parents)):
+        linked = [links(scale_id) for scale_id in dag.scale_ids.tolist()]
+        arrays[name + "_ids"] = dag.scale_ids.copy()
+        arrays[name + "_offsets"] = np.cumsum([0] + [len(scale_ids) for scale_ids in linked], dtype=np.int64)
+        arrays[name] = np.concatenate(linked).astype(np.int64)
+    return arrays
+
+def save_scale_data(path, arrays):
+    """Write the scale data arrays to a .npz file with the SCALE_DATA_VERSION, byte for byte the same for the same 
+    arrays (fixed entry order and timestamps), and replacing the former file at once"""
+    arrays = dict(arrays, version=np.array(SCALE_DATA_VERSION))
+    temporary_path = path + ".tmp"
+    with zipfile.ZipFile(temporary_path, "w", compression=zipfile.ZIP_DEFLATED) as file:
+        for name in sorted(arrays):
+            info = zipfile.ZipInfo(name + ".npy", date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with file.open(info, "w") as entry:
+                np.lib.format.write_array(entry, np.asarray(arrays[name]), allow_pickle=False)
+    os.replace(temporary_path, path)
+
+def load_scale_data(path=None):
+    """The arrays of a scale data file (SCALE_DATA_PATH by default), None if it is missing or of another 
+    SCALE_DATA_VERSION"""
+    path = SCALE_DATA_PATH if path is None else path
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as file:
+        if "version" not in file.files or int(file["version"]) != SCALE_DATA_VERSION:
+            return None
+        return {name: file[name] for name in file.files}
+
+@lru_cache(maxsize=None)
+def scale_tables():
+    """The arrays of the scale data file, with "rows" the row of every scale_id. The file is never written here, 
+    it has to be rebuilt with scale_researches.build_scale_catalogue if missing or outdated."""
+    tables = load_scale_data()
+    if tables is None:
+        raise FileNotFoundError(f"The scale data file {SCALE_DATA_PATH} is missing or not of version {SCALE_DATA_VERSION}, "
+                                "rebuild it with: python -m scale_researches.scale_researches")
+    tables["rows"] = {scale_id: i for i, scale_id in enumerate(tables["scale_id"].tolist())}
+    return tables
+
+def scale_links(name):
+    tables = scale_tables()
+    offsets = tables[name + "_offsets"].tolist()
+    linked = tables[name].tolist()
+    return {scale_id: linked[offsets[i]:offsets[i+1]] for i, scale_id in enumerate(tables[name + "_ids"].tolist())}
+
+class ScaleCatalogue:
+    """Read-only arrays of the compiled scale data indexed by 12-bit scale id, so that every query on a scale is 
+    an array access: its row in the scale data (-1 if it is not in the catalogue), name, rotation id, circular 
+    distance, and its rotations, parents and children as scale id arrays (slices of flat arrays, in the order of 
+    the scale data, their bounds being Python lists for fast single scale lookups)."""
+    
+    __slots__ = ("scale_ids", "rows", "names", "rotation_ids", "circular_distances", "rotation_members", 
+                 "rotation_bounds", "parent_ids", "parent_bounds", "child_ids", "child_bounds", "inclusion")
+    
+    def __init__(self, tables):
+        self.scale_ids = tables["scale_id"].astype(np.int64)
+        self.rows = np.full(BITMAP_COUNT, -1, dtype=np.int64)
+        self.rows[self.scale_ids] = np.arange(len(self.scale_ids))
+        self.names = tuple(tables["name"].tolist())
+        self.rotation_ids = np.full(BITMAP_COUNT, -1, dtype=np.int64)
+        self.rotation_ids[self.scale_ids] = tables["rotation_id"]
+        self.circular_distances = np.full(BITMAP_COUNT, -1, dtype=np.int64)
+        self.circular_distances[self.scale_ids] = tables["circular_distance"]
+        
+        # Scales sorted by rotation id (in the scale data order within a rotation), a rotation being a slice of it
+        order = np.argsort(tables["rotation_id"], kind="stable")
+        self.rotation_members = self.scale_ids[order]
+        sorted_rotation_ids = tables["rotation_id"][order]
+        rotation_bounds = np.zeros((BITMAP_COUNT, 2), dtype=np.int64)
+        rotation_bounds[self.scale_ids, 0] = np.searchsorted(sorted_rotation_ids, tables["rotation_id"], side="left")
+        rotation_bounds[self.scale_ids, 1] = np.searchsorted(sorted_rotation_ids, tables["rotation_id"], side="right")
+        self.rotation_bounds = rotation_bounds.tolist()
+        
+        self.parent_ids, self.parent_bounds = ScaleCatalogue.link_arrays(tables, "parents")
+        self.child_ids, self.child_bounds = ScaleCatalogue.link_arrays(tables, "forest")
+        # InclusionDAG of the catalogue, for the chroma sets that are not in it
+        self.inclusion = None
+        
+        for array in (self.scale_ids, self.rows, self.rotation_ids, self.circular_distances, self.rotation_members, 
+                      self.parent_ids, self.child_ids):
+            array.setflags(write=False)
+    
+    @staticmethod
+    def link_arrays(tables, name):
+        """The flat linked scale ids of compile_scale_data, with the (start, end) of the links of every scale id"""
+        bounds = np.zeros((BITMAP_COUNT, 2), dtype=np.int64)
+        bounds[tables[name + "_ids"], 0] = tables[name + "_offsets"][:-1]
+        bounds[tables[name + "_ids"], 1] = tables[name + "_offsets"][1:]
+        return tables[name].astype(np.int64), bounds.tolist()
+    
+    def __len__(self):
+        return len(self.scale_ids)
+    
+    def __contains__(self, scale_id):
+        return 0 <= scale_id < BITMAP_COUNT and self.rows[scale_id] >= 0
+    
+    def name(self, scale_id, default="Untitled"):
+        return self.names[self.rows[scale_id]] if scale_id in self else default
+    
+    def rotations(self, scale_id):
+        """Scale ids of the rotations of a scale (itself included)"""
+        start, end = self.rotation_bounds[scale_id]
+        return self.rotation_members[start:end]
+    
+    def rotations_circular_distance(self, scale_id):
+        return self.circular_distances[self.rotations(scale_id)]
+    
+    def inclusion_dag(self):
+        if self.inclusion is None:
+            self.inclusion = InclusionDAG(self.scale_ids)
+        return self.inclusion
+    
+    def parents(self, scale_id):
+        """Nearest scales of the catalogue containing a chroma set (see InclusionDAG.parents)"""
+        if scale_id not in self:
+            return self.inclusion_dag().parents(scale_id)
+        start, end = self.parent_bounds[scale_id]
+        return self.parent_ids[start:end]
+    
+    def children(self, scale_id):
+        """Largest scales of the catalogue contained in a chroma set (see InclusionDAG.children)"""
+        if scale_id not in self:
+            return self.inclusion_dag().children(scale_id)
+        start, end = self.child_bounds[scale_id]
+        return self.child_ids[start:end]
+
+
+class InclusionDAG:
+    """Inclusion relations between any of the 4096 chroma sets and the scales of a catalogue, each relation being 
+    a table of 4096 bitsets over the scales (bit i being scale_ids[i], packed in bytes), so that queries on a chroma set,
+    whether it is in the catalogue or not, are bitwise operations on rows of bytes. Scales are returned in the 
+    scale_ids order."""
+    
+    __slots__ = ("scale_ids", "subset_bits", "superset_bits", "strict_subset_bits", "strict_superset_bits")
+    
+    def __init__(self, scale_ids):
+        self.scale_ids = np.asarray(scale_ids, dtype=np.int64)
+        masks = BITMAPS[:, None]
+        included = (self.scale_ids & masks) == self.scale_ids
+        including = (self.scale_ids & masks) == masks
+        different = self.scale_ids != masks
+        self.subset_bits = np.packbits(included, axis=1)
+        self.superset_bits = np.packbits(including, axis=1)
+        self.strict_subset_bits = np.packbits(included & different, axis=1)
+        self.strict_superset_bits = np.packbits(including & different, axis=1)
+        for array in (self.scale_ids, self.subset_bits, self.superset_bits, self.strict_subset_bits, self.strict_superset_bits):
+            array.setflags(write=False)
+    
+    def scales_of(self, bits):
+        """Scale ids of a bitset"""
+        return self.scale_ids[np.unpackbits(bits, count=len(self.scale_ids)).view(bool)]
+    
+    def subsets(self, mask):
+        """Scales included in the chroma set mask (itself included)"""
+        return self.scales_of(self.subset_bits[mask & ChromaBitmap.BIT_FILTER])
+    
+    def supersets(self, mask):
+        """Scales including the chroma set mask (itself included)"""
+        return self.scales_of(self.superset_bits[mask & ChromaBitmap.BIT_FILTER])
+    
+    def descendants(self, mask):
+        return self.scales_of(self.strict_subset_bits[mask & ChromaBitmap.BIT_FILTER])
+    
+    def ancestors(self, mask):
+        return self.scales_of(self.strict_superset_bits[mask & ChromaBitmap.BIT_FILTER])
+    
+    def parents(self, mask):
+        """Nearest ancestors: the ancestors that are not ancestors of another ancestor"""
+        ancestors = self.strict_superset_bits[mask & ChromaBitmap.BIT_FILTER]
+        above = np.bitwise_or.reduce(self.strict_superset_bits[self.scales_of(ancestors)], axis=0)
+        return self.scales_of(ancestors & ~above)
+    
+    def children(self, mask):
+        """Largest descendants: the descendants that are not descendants of another descendant"""
+        descendants = self.strict_subset_bits[mask & ChromaBitmap.BIT_FILTER]
+        below = np.bitwise_or.reduce(self.strict_subset_bits[self.scales_of(descendants)], axis=0)
+        return self.scales_of(descendants & ~below)
+
+@lru_cache(maxsize=None)
+def scale_catalogue() -> ScaleCatalogue:
+    """SCALE_CATALOGUE"""
+    return ScaleCatalogue(scale_tables())
+
+@lru_cache(maxsize=None)
+def scale_data() -> pd.DataFrame:
+    """SCALE_DATA: the scale data csv as a dataframe indexed by scale_id"""
+    tables = scale_tables()
+    data = pd.DataFrame({column: tables[column] for column in SCALE_DATA_COLUMNS})
+    data["name"] = data.name.astype(object)
+    return data.set_index("scale_id")
+
+@lru_cache(maxsize=None)
+def scale_forest() -> dict:
+    """SCALE_FOREST: the subtree of every scale, {"self": scale_id, child_id: subtree of the child, ...}"""
+    forest = {scale_id: {"self": scale_id} for scale_id in scale_tables()["forest_ids"].tolist()}
+    for scale_id, children in scale_links("forest").items():
+        for child in children:
+            forest[scale_id][child] = forest[child]
+    return forest
+
+@lru_cache(maxsize=None)
+def scale_parents() -> dict:
+    """SCALE_PARENTS: the direct parents of every scale"""
+    return scale_links("parents")
+
+@lru_cache(maxsize=None)
+def all_general_scales() -> list:
+    """ALL_GENERAL_SCALES"""
+    return [general_scale(scale_id) for scale_id in scale_tables()["scale_id"].tolist()]
+
+@lru_cache(maxsize=None)
+def all_general_rotzero_scales() -> list:
+    """ALL_GENERAL_ROTZERO_SCALES"""
+    return [general_scale for general_scale in all_general_scales() if general_scale.circular_distance == 0]
     
 
 def music_to_tonic_chroma(midi_ids):
@@ -54,41 +311,146 @@ def compute_semitones(semitone_intervals):
 
 
 def music_chroma_counts(music_chromas: np.ndarray, weights=None):
-    unique_music_chromas, counts = np.unique(music_chromas, return_counts=True)
     if weights is not None:
-        counts = np.array([weights[music_chromas == chroma].sum() for chroma in unique_music_chromas])
+        weight_values, weight_ids = np.unique(weights, return_inverse=True)
+        weight_counts = np.bincount(np.asarray(music_chromas) * len(weight_values) + weight_ids.reshape(-1), 
+                                    minlength=12*len(weight_values)).reshape(12, len(weight_values))
+        chroma_counts = weighted_chroma_counts(weight_counts, weight_values)
+        return chroma_counts, chroma_counts.sum()
+    unique_music_chromas, counts = np.unique(music_chromas, return_counts=True)
     chroma_counts = np.zeros(12)
     chroma_counts[unique_music_chromas] = counts
     return chroma_counts, chroma_counts.sum()
 
+def weighted_chroma_counts(weight_counts: np.ndarray, weight_values: np.ndarray):
+    """Weighted chroma histogram of the note counts by chroma and weight value (12 x sorted weight values).
+    The weights of a chroma are added in the order of the weight values, so that the histogram only depends 
+    on the notes and not on their order, nor on the other weight values (see SlidingChromaWindow)."""
+    if len(weight_values) == 0:
+        return np.zeros(12)
+    return np.cumsum(weight_counts * weight_values, axis=1)[:, -1]
+
 def compute_accuracy(general_scale_subset: list,
                     music_chroma_counts: np.ndarray, 
                     music_chroma_counts_sum: float,
                     tonic_chromas=mu.CHROMA_IDS,
                     normalize_accuracy=True):
+    bank = scale_bank(general_scale_subset, tonic_chromas)
+    return bank.accuracy(music_chroma_counts, music_chroma_counts_sum, normalize_accuracy=normalize_accuracy)
+
+def scale_bank(general_scale_subset: list, tonic_chromas=mu.CHROMA_IDS):
+    """Cached ScaleBank of a scale subset and tonics, a new subset (e.g. from create_general_scale_subset) 
+    being compiled the first time it is used"""
+    return compile_scale_bank(tuple(int(gs.scale_id) for gs in general_scale_subset), 
+                              tuple(int(tonic) for tonic in tonic_chromas))
+
+@lru_cache(maxsize=32)
+def compile_scale_bank(scale_ids: tuple, tonic_chromas: tuple):
+    return ScaleBank(scale_ids, tonic_chromas)
+
+
+class ScaleBank:
+    """Everything compute_accuracy needs of a scale subset and tonics, compiled once: the 0/1 chroma matrix of 
+    every scale rotated to every tonic (one row per (tonic, scale)), the note counts and the matching penalties.
+    Suggesting scales is then a matmul and an elementwise pass over the matrix.
+    """
     
-    scales_matrix = np.array([gs.scale_bitmap.as_array() for gs in general_scale_subset])
-    scales_matrix = np.vstack([np.roll(scales_matrix, tonic, axis=1) for tonic in tonic_chromas])
-    
-    scales_note_count = np.array([gs.note_count for gs in general_scale_subset]).T
-    scales_note_count = np.tile(scales_note_count, len(tonic_chromas))
-    
-    scores = (scales_matrix @ music_chroma_counts / music_chroma_counts_sum - 0.5) * 2
-    # Equivalent:
-    # scores = (np.sum(scales_matrix * music_chroma_counts, axis=1) / music_chroma_counts_sum - 0.5) * 2  
-    
-    over_max_match_diff = 1.0/(6 + np.abs(6 - scales_note_count))
-    
-    matching = 1 - np.einsum("ij,i->i" ,np.abs(music_chroma_counts / music_chroma_counts.max() - scales_matrix), over_max_match_diff)
-    # Equivalent:
-    # matching = 1 - np.sum(np.abs(music_chroma_counts / music_chroma_counts.max() - scales_matrix), axis=1) * over_max_match_diff
-    
-    accuracy = scores * matching
-    if normalize_accuracy:
-        accuracy_min = accuracy.min()
-        accuracy = (accuracy - accuracy_min) / (accuracy.max() - accuracy.min())
-    
-    return accuracy.reshape(len(general_scale_subset), -1, order="F")
+    def __init__(self, scale_ids, tonic_chromas):
+        self.scale_ids = tuple(scale_ids)
+        self.tonic_chromas = tuple(tonic_chromas)
+        
+        scale_ids = np.array(self.scale_ids, dtype=np.int64)
+        # Rolling a chroma array by the tonic is rolling its bitmap the other way
+        self.scales_matrix = np.vstack([CHROMA_ARRAY_TABLE[ROTATION_TABLE[scale_ids, -tonic % 12]] for tonic in self.tonic_chromas]) \
+                                if len(self.tonic_chromas) > 0 else np.zeros((0, 12))
+        
+        scales_note_count = POPCOUNT_TABLE[scale_ids]
+        self.scales_note_count = np.tile(scales_note_count, len(self.tonic_chromas))
+        self.over_max_match_diff = 1.0/(6 + np.abs(6 - self.scales_note_count))
+        
+        for array in (self.scales_matrix, self.scales_note_count, self.over_max_match_diff):
+            array.setflags(write=False)
+    
+    def accuracy(self, music_chroma_counts, music_chroma_counts_sum, normalize_accuracy=True):
+        """Accuracy of every scale (rows) for every tonic (columns)"""
+        scores = (self.scales_matrix @ music_chroma_counts / music_chroma_counts_sum - 0.5) * 2
+        # Equivalent:
+        # scores = (np.sum(scales_matrix * music_chroma_counts, axis=1) / music_chroma_counts_sum - 0.5) * 2  
+        
+        matching = 1 - np.einsum("ij,i->i" ,np.abs(music_chroma_counts / music_chroma_counts.max() - self.scales_matrix), 
+                                 self.over_max_match_diff)
+        # Equivalent:
+        # matching = 1 - np.sum(np.abs(music_chroma_counts / music_chroma_counts.max() - scales_matrix), axis=1) * over_max_match_diff
+        
+        accuracy = scores * matching
+        if normalize_accuracy:
+            accuracy_min = accuracy.min()
+            accuracy = (accuracy - accuracy_min) / (accuracy.max() - accuracy.min())
+        
+        return accuracy.reshape(len(self.scale_ids), -1, order="F")
+    
+    def batch_accuracy(self, music_chroma_counts, normalize_accuracy=True):
+        """Accuracy of every scale for every tonic of N chroma histograms (N x 12) at once, as an N x scales x tonics 
+        array, equal to accuracy up to rounding errors. Windows without notes have a NaN accuracy."""
+        counts = np.asarray(music_chroma_counts, dtype=np.float64).reshape(-1, 12)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = (counts @ self.scales_matrix.T / counts.sum(axis=1)[:, None] - 0.5) * 2
+            
+            normalized_counts = counts / counts.max(axis=1)[:, None]
+            # The scale matrix being 0/1, sum(|c - m|) = sum(c) + (1 - 2c) @ m, so the matching is a matmul too
+            mismatch = normalized_counts.sum(axis=1)[:, None] + (1 - 2*normalized_counts) @ self.scales_matrix.T
+            matching = 1 - mismatch * self.over_max_match_diff
+            
+            accuracy = scores * matching
+            if normalize_accuracy:
+                accuracy_min = accuracy.min(axis=1, keepdims=True)
+                accuracy = (accuracy - accuracy_min) / (accuracy.max(axis=1, keepdims=True) - accuracy_min)
+        
+        # Rows are ordered by tonic then scale
+        return accuracy.reshape(len(counts), len(self.tonic_chromas), len(self.scale_ids)).transpose(0, 2, 1)
+
+
+# 12-bit chroma bitmaps (chroma c being the bit 11 - c) are few enough for every query on them to be 
+# precomputed in tables indexed by the bitmap
+BITMAP_COUNT = 1 << 12
+BITMAPS = np.arange(BITMAP_COUNT)
+CHROMA_BITS = 1 << (11 - mu.CHROMA_IDS)
+# 0/1 chroma array of every bitmap (as ChromaBitmap.as_array) and its note count
+CHROMA_ARRAY_TABLE = ((BITMAPS[:, None] & CHROMA_BITS) != 0).astype(np.float64)
+POPCOUNT_TABLE = CHROMA_ARRAY_TABLE.sum(axis=1).astype(np.int64)
+CHROMA_LIST_TABLE = tuple(mu.CHROMA_IDS[row] for row in CHROMA_ARRAY_TABLE.astype(bool))
+# ROTATION_TABLE[bitmap, n] is ChromaBitmap(bitmap).roll(n)
+ROTATION_TABLE = ((BITMAPS[:, None] << mu.CHROMA_IDS) | (BITMAPS[:, None] >> (12 - mu.CHROMA_IDS))) & 0x0FFF
+# Smallest rotation of every bitmap, the roll of it giving the bitmap and the number of distinct rotations
+CANONICAL_ROTATION_TABLE = ROTATION_TABLE.min(axis=1)
+CANONICAL_SHIFT_TABLE = np.argmax(ROTATION_TABLE[CANONICAL_ROTATION_TABLE] == BITMAPS[:, None], axis=1)
+ROTATION_PERIOD_TABLE = np.where(np.any(ROTATION_TABLE[:, 1:] == BITMAPS[:, None], axis=1),
+                                 np.argmax(ROTATION_TABLE[:, 1:] == BITMAPS[:, None], axis=1) + 1, 12)
+
+# Python lists of the tables, for single bitmap lookups (faster than indexing NumPy arrays with ints)
+POPCOUNTS = POPCOUNT_TABLE.tolist()
+ROTATIONS = ROTATION_TABLE.tolist()
+CANONICAL_ROTATIONS = CANONICAL_ROTATION_TABLE.tolist()
+CANONICAL_SHIFTS = CANONICAL_SHIFT_TABLE.tolist()
+ROTATION_PERIODS = ROTATION_PERIOD_TABLE.tolist()
+
+for table in (CHROMA_BITS, CHROMA_ARRAY_TABLE, POPCOUNT_TABLE, ROTATION_TABLE, 
+              CANONICAL_ROTATION_TABLE, CANONICAL_SHIFT_TABLE, ROTATION_PERIOD_TABLE) + CHROMA_LIST_TABLE:
+    table.setflags(write=False)
+
+def bitmap_circular_distance(bitmap, other):
+    """Smallest n such that other is bitmap rolled by n, None if other is not a rotation of bitmap"""
+    bitmap &= ChromaBitmap.BIT_FILTER
+    other &= ChromaBitmap.BIT_FILTER
+    if CANONICAL_ROTATIONS[bitmap] != CANONICAL_ROTATIONS[other]:
+        return None
+    return (CANONICAL_SHIFTS[other] - CANONICAL_SHIFTS[bitmap]) % ROTATION_PERIODS[bitmap]
+
+def chromas_bitmap(index) -> int:
+    """Bitmap of a chroma or of an array of chromas"""
+    if isinstance(index, (int, np.integer)):
+        return 1 << (11 - index % 12)
+    return int(np.bitwise_or.reduce(CHROMA_BITS[np.asarray(index) % 12], initial=0))
 
 
 class ChromaBitmap:
@@ -105,22 +467,26 @@ class ChromaBitmap:
         self.bitmap = bitmap
     
     def set(self, index) -> None:
-        self.bitmap |= (np.sum(1 << ((11 - np.array(index)) % 12)) & ChromaBitmap.BIT_FILTER)
+        self.bitmap |= chromas_bitmap(index)
         
     def set_map(self, other) -> None:
         self.bitmap |= (other & ChromaBitmap.BIT_FILTER)
         
     def unset(self, index) -> None:
-        self.bitmap &= ~np.sum((1 << ((11 - np.array(index)) % 12)))
+        self.bitmap &= ~chromas_bitmap(index)
         
     def unset_map(self, other) -> None:
         self.bitmap &= ~(other & ChromaBitmap.BIT_FILTER)
     
     def on(self, index) -> bool:
-        return (1 << ((11 - np.array(index)) % 12)) & self.bitmap != 0
+        if isinstance(index, (int, np.integer)):
+            return self.bitmap >> (11 - index % 12) & 1 != 0
+        return CHROMA_ARRAY_TABLE[self.bitmap & ChromaBitmap.BIT_FILTER, np.asarray(index) % 12] != 0
     
     def off(self, index) -> bool:
-        return ~(1 << ((11 - np.array(index)) % 12)) & self.bitmap != 0
+        if isinstance(index, (int, np.integer)):
+            return self.bitmap >> (11 - index % 12) & 1 == 0
+        return CHROMA_ARRAY_TABLE[self.bitmap & ChromaBitmap.BIT_FILTER, np.asarray(index) % 12] == 0
     
     def contains(self, other) -> bool:
         return self.bitmap & other & ChromaBitmap.BIT_FILTER== other
@@ -135,39 +501,33 @@ class ChromaBitmap:
         return self.bitmap & other & ChromaBitmap.BIT_FILTER
     
     def chromas(self) -> list:
-        return mu.CHROMA_IDS[self.on(mu.CHROMA_IDS)]
+        return CHROMA_LIST_TABLE[self.bitmap & ChromaBitmap.BIT_FILTER]
 
     def as_array(self) -> np.ndarray:
-        array = np.zeros(12)
-        array[self.on(mu.CHROMA_IDS)] = 1
-        return array
+        return CHROMA_ARRAY_TABLE[self.bitmap & ChromaBitmap.BIT_FILTER].copy()
     
     def semitones(self) -> list:
         return compute_semitones(self.chromas()) #type: ignore
     
     def inverse_chromas(self) -> list:
-        return mu.CHROMA_IDS[self.off(mu.CHROMA_IDS)]
+        return CHROMA_LIST_TABLE[~self.bitmap & ChromaBitmap.BIT_FILTER]
     
     def roll(self, n: int) -> int:
-        n = (n%12)
-        a = self.bitmap << n
-        b = self.bitmap >> (12 - n)
-        return (a | b) & ChromaBitmap.BIT_FILTER
+        return ROTATIONS[self.bitmap & ChromaBitmap.BIT_FILTER][n % 12]
+    
+    def rotations(self) -> np.ndarray:
+        """The 12 rolls of the bitmap"""
+        return ROTATION_TABLE[self.bitmap & ChromaBitmap.BIT_FILTER]
+    
+    def canonical_rotation(self) -> int:
+        """Smallest bitmap among the rotations, the same for all rotations of a bitmap"""
+        return CANONICAL_ROTATIONS[self.bitmap & ChromaBitmap.BIT_FILTER]
 
     def circular_distance(self, other):
-        other &= ChromaBitmap.BIT_FILTER
-        for i in range(12):
-            if self.roll(i) == other:
-                return i
-        return None
+        return bitmap_circular_distance(self.bitmap, other)
     
     def note_count(self) -> int:
-        n = int(self.bitmap)
-        i = 0
-        while(n):
-            i += n % 2
-            n //= 2
-        return i
+        return POPCOUNTS[self.bitmap & ChromaBitmap.BIT_FILTER]
     
     @staticmethod
     def from_semitones(semitones):
@@ -194,6 +554,9 @@ class ChromaBitmap:
     
 
 class GeneralScale:
+    __slots__ = ("semitones", "semitone_intervals", "name", "names", "scale_bitmap", "note_count", "scale_id",
+                 "rotation_id", "rotations", "circular_distance", "rotations_circular_distance")
+    
     def __init__(self, semitones, name="Untitled"):
         self.semitones = np.array(semitones)
         if len(self.semitones) != 0:
@@ -208,13 +571,12 @@ class GeneralScale:
         self.rotation_id = None
         self.rotations = []
         self.circular_distance = None
-        if self.scale_id in SCALE_DATA.index:
-            infos = SCALE_DATA.loc[self.scale_id]
-            self.rotation_id = infos.rotation_id
-            self.circular_distance = infos.circular_distance
-            rota_mask = (SCALE_DATA.rotation_id == self.rotation_id)
-            self.rotations = SCALE_DATA.index[rota_mask]
-            self.rotations_circular_distance = SCALE_DATA.circular_distance[rota_mask]
+        catalogue = scale_catalogue()
+        if self.scale_id in catalogue:
+            self.rotation_id = catalogue.rotation_ids[self.scale_id]
+            self.circular_distance = catalogue.circular_distances[self.scale_id]
+            self.rotations = catalogue.rotations(self.scale_id)
+            self.rotations_circular_distance = catalogue.rotations_circular_distance(self.scale_id)
 
     def __repr__(self):
         return self.names[0] + " Scale"
@@ -223,22 +585,22 @@ class GeneralScale:
         return self.names[max(0, min(i, len(self.names)))] + " General Scale"
     
     def parent_scales_bitmaps(self):
-        return [ChromaBitmap(bitmap=scale_id) for scale_id in SCALE_PARENTS[self.scale_bitmap.bitmap]] 
+        return [ChromaBitmap(bitmap=scale_id) for scale_id in scale_catalogue().parents(self.scale_id).tolist()] 
     
     def parent_scales(self):
-        return [scale(scale_id) for scale_id in SCALE_PARENTS[self.scale_bitmap.bitmap]]
+        return linked_scales(self.scale_id, None, "parents")
     
     def child_scales_bitmaps(self):
-        return [ChromaBitmap(bitmap=scale_id) for scale_id in SCALE_FOREST[self.scale_bitmap.bitmap] if scale_id != "self"] 
+        return [ChromaBitmap(bitmap=scale_id) for scale_id in scale_catalogue().children(self.scale_id).tolist()] 
     
     def child_scales(self):
-        return [scale(scale_id) for scale_id in SCALE_FOREST[self.scale_bitmap.bitmap] if scale_id != "self"]
+        return linked_scales(self.scale_id, None, "children")
     
     def rotated_scales(self):
-        return [scale(scale_id) for scale_id in self.rotations]
+        return linked_scales(self.scale_id, None, "rotations")
     
     def scale_in(self, tonic_chroma):
-        return Scale(self.semitones, tonic_chroma, name=self.name)
+        return scale(self.scale_id, tonic_chroma=tonic_chroma, name=self.name)
     
     @staticmethod
     def from_scale_id(scale_id, name="Untitled"):
@@ -268,6 +630,8 @@ class GeneralScale:
     
     
 class Scale(GeneralScale):
+    __slots__ = ("tonic_chroma", "chromas", "chromas_name", "chroma_bitmap", "identifier")
+    
     def __init__(self, semitones, tonic_chroma, name="Untitled"):
         super().__init__(semitones, name)
         self.tonic_chroma = mu.to_chroma(tonic_chroma)
@@ -288,20 +652,19 @@ class Scale(GeneralScale):
         return self.names[max(0, min(i, len(self.names)))] + " Scale in " + mu.CHROMA_NAMES[self.tonic_chroma]
     
     def parent_scales_bitmaps(self):
-        return [ChromaBitmap(bitmap=scale_id) for scale_id in SCALE_PARENTS[self.scale_bitmap.bitmap]] 
+        return [ChromaBitmap(bitmap=scale_id) for scale_id in scale_catalogue().parents(self.scale_id).tolist()] 
     
     def parent_scales(self):
-        return [scale(scale_id, tonic_chroma=self.tonic_chroma) for scale_id in SCALE_PARENTS[self.scale_bitmap.bitmap]]
+        return linked_scales(self.scale_id, self.tonic_chroma, "parents")
     
     def child_scales_bitmaps(self):
-        return [ChromaBitmap(bitmap=scale_id) for scale_id in SCALE_FOREST[self.scale_bitmap.bitmap] if scale_id != "self"] 
+        return [ChromaBitmap(bitmap=scale_id) for scale_id in scale_catalogue().children(self.scale_id).tolist()] 
     
     def child_scales(self):
-        return [scale(scale_id, tonic_chroma=self.tonic_chroma) for scale_id in SCALE_FOREST[self.scale_bitmap.bitmap] if scale_id != "self"]
+        return linked_scales(self.scale_id, self.tonic_chroma, "children")
 
     def rotated_scales(self):
-        return [scale(scale_id, tonic_chroma=mu.to_chroma(self.tonic_chroma + self.circular_distance - circular_distance)) 
-                    for scale_id, circular_distance in zip(self.rotations, self.rotations_circular_distance)]
+        return linked_scales(self.scale_id, self.tonic_chroma, "rotations")
 
     def compute_accuracy(self, midi_ids: np.ndarray, weights=None):
         chroma_counts, chroma_counts_sum = music_chroma_counts(mu.to_chroma(midi_ids), weights)
@@ -312,7 +675,7 @@ class Scale(GeneralScale):
                                 normalize_accuracy=False)
 
     def general_scale(self):
-        return GeneralScale(self.semitones, self.name)
+        return general_scale(self.scale_id, name=self.name)
     
     def __eq__(self, other):
         return self.identifier == other.identifier
@@ -331,23 +694,60 @@ class Scale(GeneralScale):
 # SELECTION OF SCALES
 # See scale_final_data.csv
 
+# Scales are shared and must not be modified: scale() returns the same instance for the same scale id and tonic 
+# (at most 4096 x 13 of them, interned for good), scales with a name of their own being kept in a bounded LRU cache
+
+NAMED_SCALE_CACHE_SIZE = 256
+
 def scale(scale_id, tonic_chroma=None, name=None):
-    if name is None:
-        name = "Untitled"
-        if scale_id in SCALE_DATA.index:
-            name = SCALE_DATA.at[scale_id, "name"]
-    if tonic_chroma is None:
-        return GeneralScale.from_scale_id(scale_id=scale_id, name=name)
-    else:
-        return Scale.from_scale_id(scale_id=scale_id, tonic_chroma=tonic_chroma, name=name)
+    scale_id = int(scale_id)
+    if tonic_chroma is not None:
+        tonic_chroma = int(mu.to_chroma(tonic_chroma))
+    if not 0 <= scale_id < BITMAP_COUNT:
+        return build_scale(scale_id, tonic_chroma, scale_catalogue().name(scale_id) if name is None else name)
+    if name is None or name == scale_catalogue().name(scale_id):
+        return interned_scale(scale_id, tonic_chroma)
+    return named_scale(scale_id, tonic_chroma, name)
     
 # Alias for typing and efficiency
 def general_scale(scale_id, name=None):
-    if name is None:
-        name = "Untitled"
-        if scale_id in SCALE_DATA.index:
-            name = SCALE_DATA.at[scale_id, "name"]
-    return GeneralScale.from_scale_id(scale_id=scale_id, name=name)
+    return scale(scale_id, name=name)
+
+@lru_cache(maxsize=None)
+def interned_scale(scale_id, tonic_chroma):
+    return build_scale(scale_id, tonic_chroma, scale_catalogue().name(scale_id))
+
+@lru_cache(maxsize=NAMED_SCALE_CACHE_SIZE)
+def named_scale(scale_id, tonic_chroma, name):
+    return build_scale(scale_id, tonic_chroma, name)
+
+def build_scale(scale_id, tonic_chroma, name):
+    """New scale of a scale id, its arrays being read-only as it is shared"""
+    if tonic_chroma is None:
+        built_scale = GeneralScale.from_scale_id(scale_id=scale_id, name=name)
+    else:
+        built_scale = Scale.from_scale_id(scale_id=scale_id, tonic_chroma=tonic_chroma, name=name)
+    for slot in ("semitones", "semitone_intervals", "chromas", "chromas_name"):
+        array = getattr(built_scale, slot, None)
+        if isinstance(array, np.ndarray):
+            array.setflags(write=False)
+    return built_scale
+
+@lru_cache(maxsize=None)
+def linked_scales(scale_id, tonic_chroma, link):
+    """Shared tuple of the "rotations", "parents" or "children" (link) scales of a scale id, in the tonic if given 
+    (the rotations being in the tonics keeping their chromas)"""
+    catalogue = scale_catalogue()
+    if link == "rotations":
+        scale_ids = catalogue.rotations(scale_id).tolist()
+        if tonic_chroma is None:
+            return tuple(scale(rotation_id) for rotation_id in scale_ids)
+        circular_distance = int(catalogue.circular_distances[scale_id])
+        return tuple(scale(rotation_id, tonic_chroma=tonic_chroma + circular_distance - rotation_circular_distance)
+                     for rotation_id, rotation_circular_distance in zip(scale_ids, catalogue.rotations_circular_distance(scale_id).tolist()))
+    
+    scale_ids = catalogue.parents(scale_id) if link == "parents" else catalogue.children(scale_id)
+    return tuple(scale(linked_id, tonic_chroma=tonic_chroma) for linked_id in scale_ids.tolist())
 
 # DODECATONIC SCALES
 
@@ -450,15 +850,12 @@ def altered_scale(tonic_chroma=None):
 # https://plucknplay.github.io/en/scale-list.html
 
 
-ALL_GENERAL_SCALES = [general_scale(scale_id) for scale_id in SCALE_DATA.index]
-ALL_GENERAL_ROTZERO_SCALES = [general_scale(scale_id) for scale_id in SCALE_DATA.index[SCALE_DATA.circular_distance == 0]]
-
 def create_general_scale_subset(note_counts=None, 
                                 scale_ids=None,
                                 not_only_rotation_zero=False):
-    general_scale_subset = ALL_GENERAL_ROTZERO_SCALES
+    general_scale_subset = all_general_rotzero_scales()
     if not_only_rotation_zero:
-        general_scale_subset = ALL_GENERAL_SCALES
+        general_scale_subset = all_general_scales()
     if scale_ids is not None:
         if type(scale_ids) is int:
             scale_ids = [scale_ids]
@@ -476,24 +873,109 @@ def create_general_scale_subset(note_counts=None,
 def suggest_scales(music_chromas, 
                    threshold=0.99,
                    weights=None,
-                   general_scale_subset=ALL_GENERAL_ROTZERO_SCALES,
+                   general_scale_subset=None,
                    tonic_chromas=mu.CHROMA_IDS,
-                   normalize_accuracy=True):
+                   normalize_accuracy=True,
+                   top_k=None,
+                   compact=False):
     chroma_counts, chroma_counts_sum = music_chroma_counts(music_chromas=music_chromas, weights=weights)
-    
+    return suggest_scales_from_chroma_counts(chroma_counts, 
+                                             chroma_counts_sum, 
+                                             threshold=threshold,
+                                             general_scale_subset=general_scale_subset,
+                                             tonic_chromas=tonic_chromas,
+                                             normalize_accuracy=normalize_accuracy,
+                                             top_k=top_k,
+                                             compact=compact)
+
+def suggest_scales_from_chroma_counts(chroma_counts,
+                                      chroma_counts_sum,
+                                      threshold=0.99,
+                                      general_scale_subset=None,
+                                      tonic_chromas=mu.CHROMA_IDS,
+                                      normalize_accuracy=True,
+                                      top_k=None,
+                                      compact=False):
+    """suggest_scales from an already computed 12 chroma histogram (see music_chroma_counts).
+    Only the top_k most accurate suggestions are kept if given, and if compact, they are returned as 
+    a SCALE_SUGGESTION_DTYPE array (see select_scales and materialize_suggestions) instead of tuples."""
+    general_scale_subset = all_general_rotzero_scales() if general_scale_subset is None else general_scale_subset
     accuracies = compute_accuracy(general_scale_subset=general_scale_subset,
                                 music_chroma_counts=chroma_counts, 
                                 music_chroma_counts_sum=chroma_counts_sum,
                                 tonic_chromas=tonic_chromas,
                                 normalize_accuracy=normalize_accuracy)
     
-    suggestions = []
-    for scale_index, general_scale in enumerate(general_scale_subset):
-        for tonic_index, tonic_chroma in enumerate(tonic_chromas):
-            accuracy = accuracies[scale_index, tonic_index]
-            if accuracies[scale_index, tonic_index] >= threshold:
-                suggestions.append((general_scale, tonic_chroma, accuracy))
-    return sorted(suggestions, key=lambda kv: (-kv[2], general_scale))
+    selection = select_scales(accuracies, threshold=threshold, top_k=top_k, tonic_chromas=tonic_chromas)
+    if compact:
+        return selection
+    return materialize_suggestions(selection, general_scale_subset)
+
+# Suggestions as (index of the scale in the subset, tonic chroma, accuracy) rows
+SCALE_SUGGESTION_DTYPE = np.dtype([("scale_index", np.int64),
+                                   ("tonic", np.int64),
+                                   ("accuracy", np.float64)])
+
+def select_scales(accuracies, threshold=0.99, top_k=None, tonic_chromas=mu.CHROMA_IDS):
+    """The suggestions of an accuracy array (scales x tonics, see compute_accuracy) at or above the threshold, 
+    only the top_k most accurate if given, by decreasing accuracy, ties in the scale then tonic order.
+
+    Returns:
+        np.ndarray: SCALE_SUGGESTION_DTYPE array.
+    """
+    flat_accuracies = accuracies.ravel()
+    candidates = np.flatnonzero(flat_accuracies >= threshold)
+    if top_k is not None and top_k < len(candidates):
+        candidate_accuracies = flat_accuracies[candidates]
+        kth_accuracy = -np.partition(-candidate_accuracies, top_k - 1)[top_k - 1]
+        above = candidates[candidate_accuracies > kth_accuracy]
+        ties = candidates[candidate_accuracies == kth_accuracy][:top_k - len(above)]
+        candidates = np.concatenate([above, ties])
+    candidates = candidates[np.lexsort((candidates, -flat_accuracies[candidates]))]
+    
+    selection = np.empty(len(candidates), dtype=SCALE_SUGGESTION_DTYPE)
+    selection["scale_index"] = candidates // accuracies.shape[1]
+    selection["tonic"] = np.asarray(tonic_chromas)[candidates % accuracies.shape[1]]
+    selection["accuracy"] = flat_accuracies[candidates]
+    return selection
+
+def materialize_suggestions(selection, general_scale_subset, count=None):
+    """The first count rows (all if None) of a SCALE_SUGGESTION_DTYPE array as (general scale, tonic chroma, accuracy) 
+    tuples (as suggest_scales), e.g. only the displayed rows"""
+    selection = selection[:count]
+    return [(general_scale_subset[scale_index], tonic, accuracy)
+            for scale_index, tonic, accuracy in zip(selection["scale_index"].tolist(), selection["tonic"], selection["accuracy"])]
+
+def suggest_scales_batch(chroma_counts,
+                         threshold=0.99,
+                         general_scale_subset=None,
+                         tonic_chromas=mu.CHROMA_IDS,
+                         normalize_accuracy=True,
+                         top_k=None):
+    """suggest_scales of N chroma histograms (N x 12, e.g. one per bar) in a single call: the accuracies of all 
+    windows are computed by ScaleBank.batch_accuracy and thresholded at once (keeping the top_k of each window if given).
+    
+    Returns:
+        list(list(tuple)): For every window, the suggestions as in suggest_scales (empty for windows without notes).
+    """
+    general_scale_subset = all_general_rotzero_scales() if general_scale_subset is None else general_scale_subset
+    bank = scale_bank(general_scale_subset, tonic_chromas)
+    accuracies = bank.batch_accuracy(chroma_counts, normalize_accuracy=normalize_accuracy)
+    
+    windows, scale_indexes, tonic_indexes = np.nonzero(accuracies >= threshold)
+    found_accuracies = accuracies[windows, scale_indexes, tonic_indexes]
+    # Sorted by window, then by decreasing accuracy, ties in the scale then tonic order as suggest_scales
+    order = np.lexsort((tonic_indexes, scale_indexes, -found_accuracies, windows))
+    if top_k is not None:
+        sorted_windows = windows[order]
+        ranks = np.arange(len(order)) - np.searchsorted(sorted_windows, sorted_windows, side="left")
+        order = order[ranks < top_k]
+    
+    suggestions = [[] for _ in range(len(accuracies))]
+    for window, scale_index, tonic_index, accuracy in zip(windows[order].tolist(), scale_indexes[order].tolist(),
+                                                          tonic_indexes[order].tolist(), found_accuracies[order].tolist()):
+        suggestions[window].append((general_scale_subset[scale_index], tonic_chromas[tonic_index], accuracy))
+    return suggestions
 
 # def windowed_suggest_scales(music_dataframe, 
 #                             threshold=0.9, 
@@ -537,4 +1019,20 @@ def suggest_scales(music_chromas,
 #         return filtered_results
 #     else:
 #         return {}
-    
\ No newline at end of file
+    
+
+
+LAZY_ATTRIBUTES = {"SCALE_CATALOGUE": scale_catalogue,
+                   "SCALE_DATA": scale_data,
+                   "SCALE_FOREST": scale_forest,
+                   "SCALE_PARENTS": scale_parents,
+                   "ALL_GENERAL_SCALES": all_general_scales,
+                   "ALL_GENERAL_ROTZERO_SCALES": all_general_rotzero_scales}
+
+def __getattr__(name):
+    # Only called for the attributes not loaded yet
+    if name in LAZY_ATTRIBUTES:
+        value = LAZY_ATTRIBUTES[name]()
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
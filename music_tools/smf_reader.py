@@ -0,0 +1,357 @@
+from array import array
+import mmap
+import mido
+import numpy as np
+
+# Standard MIDI File reader, parsing the chunks straight into NumPy event arrays
+# instead of one mido message object per event.
+#
+# Every event of a track is a row of EVENT_DTYPE:
+#   track: index of the track chunk
+#   ticks: absolute ticks in the track
+#   delta: delta ticks from the previous event of the track
+#   status: status byte (running status resolved), 0xFF for meta events, 0xF0/0xF7 for sysex
+#   data1, data2: data bytes of channel events, data1 being the meta type for meta events
+#   offset, length: position of the payload of meta and sysex events in the file data
+
+EVENT_DTYPE = np.dtype([("track", np.uint16),
+                        ("ticks", np.int64),
+                        ("delta", np.uint32),
+                        ("status", np.uint8),
+                        ("data1", np.uint8),
+                        ("data2", np.uint8),
+                        ("offset", np.uint32),
+                        ("length", np.uint32)])
+
+META = 0xFF
+SYSEX = 0xF0
+SYSEX_ESCAPE = 0xF7
+
+META_TRACK_NAME = 0x03
+META_END_OF_TRACK = 0x2F
+META_SET_TEMPO = 0x51
+META_TIME_SIGNATURE = 0x58
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+
+# Channel event type names (status >> 4) as in mido
+CHANNEL_EVENT_TYPES = {0x8: "note_off", 0x9: "note_on", 0xA: "polytouch", 0xB: "control_change",
+                       0xC: "program_change", 0xD: "aftertouch", 0xE: "pitchwheel"}
+# Data byte count of channel events, by status >> 4
+DATA_BYTE_COUNTS = [0] * 8 + [2, 2, 2, 2, 1, 1, 2, 0]
+
+# Meta event type names, and the attributes of their messages, as in mido
+META_TYPE_NAMES = {0x00: "sequence_number", 0x01: "text", 0x02: "copyright", 0x03: "track_name", 
+                   0x04: "instrument_name", 0x05: "lyrics", 0x06: "marker", 0x07: "cue_marker", 0x09: "device_name", 
+                   0x20: "channel_prefix", 0x21: "midi_port", 0x2F: "end_of_track", 0x51: "set_tempo", 
+                   0x54: "smpte_offset", 0x58: "time_signature", 0x59: "key_signature", 0x7F: "sequencer_specific"}
+META_TEXT_ATTRIBUTES = {0x01: "text", 0x02: "text", 0x03: "name", 0x04: "name", 0x05: "text", 0x06: "text", 
+                        0x07: "text", 0x09: "name"}
+SMPTE_FRAME_RATES = [24, 25, 29.97, 30]
+# Key signature names by (sharps count, negative for flats, minor mode)
+KEY_SIGNATURES = {(sharps, mode): name + "m" * mode
+                  for mode, names in enumerate(["Cb Gb Db Ab Eb Bb F C G D A E B F# C#".split(),
+                                                "Ab Eb Bb F C G D A E B F# C# G# D# A#".split()])
+                  for sharps, name in zip(range(-7, 8), names)}
+
+
+def read_variable_int(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+def read_header(data):
+    """Returns (type, track count, ticks per beat, end of the header chunk)"""
+    if data[:4] != b"MThd":
+        raise ValueError("no MThd header at start of file")
+    size = int.from_bytes(data[4:8], "big")
+    midi_type = int.from_bytes(data[8:10], "big")
+    track_count = int.from_bytes(data[10:12], "big")
+    ticks_per_beat = int.from_bytes(data[12:14], "big")
+    return midi_type, track_count, ticks_per_beat, 8 + size
+
+def index_track_chunks(data, start, track_count=None):
+    """Returns the (start, end) data offsets of the MTrk chunks, skipping unknown chunks"""
+    chunks = []
+    pos = start
+    while pos + 8 <= len(data) and (track_count is None or len(chunks) < track_count):
+        name = data[pos:pos+4]
+        size = int.from_bytes(data[pos+4:pos+8], "big")
+        pos += 8
+        if name == b"MTrk":
+            chunks.append((pos, min(pos + size, len(data))))
+        pos += size
+    return chunks
+
+def decode_track(data, start, end, track_index=0, clip=False, stop_meta=None):
+    """Decode the events of the track chunk data[start:end] into an EVENT_DTYPE array.
+    If stop_meta is given, decoding stops right after the first meta event of this type."""
+    deltas = array("I")
+    statuses = array("B")
+    data1s = array("B")
+    data2s = array("B")
+    offsets = array("I")
+    lengths = array("I")
+
+    pos = start
+    last_status = None
+    while pos < end:
+        delta, pos = read_variable_int(data, pos)
+        status = data[pos]
+        if status < 0x80:
+            if last_status is None:
+                raise ValueError("running status without last status")
+            status = last_status
+        else:
+            pos += 1
+            if status != META:
+                # As in mido, only meta events don't set the running status
+                last_status = status
+
+        offset = 0
+        length = 0
+        data2 = 0
+        if status < 0xF0:
+            data1 = data[pos]
+            if DATA_BYTE_COUNTS[status >> 4] == 2:
+                data2 = data[pos+1]
+                pos += 2
+            else:
+                pos += 1
+        elif status == META:
+            data1 = data[pos]
+            length, offset = read_variable_int(data, pos + 1)
+            pos = offset + length
+            if data1 == stop_meta:
+                end = pos
+        elif status == SYSEX or status == SYSEX_ESCAPE:
+            data1 = 0
+            length, offset = read_variable_int(data, pos)
+            pos = offset + length
+        else:
+            raise ValueError(f"undefined status byte 0x{status:02x}")
+
+        deltas.append(delta)
+        statuses.append(status)
+        data1s.append(data1)
+        data2s.append(data2)
+        offsets.append(offset)
+        lengths.append(length)
+
+    events = np.empty(len(deltas), dtype=EVENT_DTYPE)
+    events["track"] = track_index
+    events["delta"] = np.frombuffer(deltas, dtype=np.dtype(deltas.typecode))
+    events["ticks"] = np.cumsum(events["delta"], dtype=np.int64)
+    events["status"] = np.frombuffer(statuses, dtype=np.uint8)
+    events["data1"] = np.frombuffer(data1s, dtype=np.uint8)
+    events["data2"] = np.frombuffer(data2s, dtype=np.uint8)
+    events["offset"] = np.frombuffer(offsets, dtype=np.dtype(offsets.typecode))
+    events["length"] = np.frombuffer(lengths, dtype=np.dtype(lengths.typecode))
+
+    channel_events = events["status"] < 0xF0
+    out_of_range = channel_events & ((events["data1"] > 127) | (events["data2"] > 127))
+    if np.any(out_of_range):
+        if not clip:
+            raise ValueError("data byte must be in range 0..127")
+        events["data1"][out_of_range] = np.minimum(events["data1"][out_of_range], 127)
+        events["data2"][out_of_range] = np.minimum(events["data2"][out_of_range], 127)
+    return events
+
+
+def channel_mask(events):
+    return events["status"] < 0xF0
+
+def meta_mask(events, meta_type=None):
+    mask = events["status"] == META
+    if meta_type is not None:
+        mask &= events["data1"] == meta_type
+    return mask
+
+def note_on_mask(events):
+    """Pressed notes, note_on with a null velocity being a release"""
+    return (events["status"] & 0xF0 == NOTE_ON) & (events["data2"] > 0)
+
+def note_off_mask(events):
+    status_type = events["status"] & 0xF0
+    return (status_type == NOTE_OFF) | (status_type == NOTE_ON) & (events["data2"] == 0)
+
+def event_type_name(status, data1):
+    if status < 0xF0:
+        return CHANNEL_EVENT_TYPES[status >> 4]
+    if status == META:
+        return META_TYPE_NAMES.get(int(data1), "unknown_meta")
+    return "sysex"
+
+def meta_attributes(meta_type, data, charset="latin1"):
+    """Attributes of the mido.MetaMessage of a known meta event type, decoded from its payload as mido does"""
+    if meta_type in META_TEXT_ATTRIBUTES:
+        return {META_TEXT_ATTRIBUTES[meta_type]: bytes(data).decode(charset)}
+    if meta_type == 0x00:
+        # Sequence numbers and midi ports without data occur in some files
+        return {"number": (data[0] << 8) | data[1] if len(data) > 0 else 0}
+    if meta_type == 0x20:
+        return {"channel": data[0]}
+    if meta_type == 0x21:
+        return {"port": data[0] if len(data) > 0 else 0}
+    if meta_type == META_SET_TEMPO:
+        return {"tempo": (data[0] << 16) | (data[1] << 8) | data[2]}
+    if meta_type == 0x54:
+        return {"frame_rate": SMPTE_FRAME_RATES[data[0] >> 6], "hours": data[0] & 0x3F, "minutes": data[1], 
+                "seconds": data[2], "frames": data[3], "sub_frames": data[4]}
+    if meta_type == META_TIME_SIGNATURE:
+        return {"numerator": data[0], "denominator": 2 ** data[1], "clocks_per_click": data[2], 
+                "notated_32nd_notes_per_beat": data[3]}
+    if meta_type == 0x59:
+        key = (data[0] - 256 if data[0] > 127 else data[0], data[1])
+        if key not in KEY_SIGNATURES:
+            raise mido.KeySignatureError(f"Could not decode key with {abs(key[0])} "
+                                         f"{'sharps' if key[0] > 0 else 'flats'} and mode {key[1]}")
+        return {"key": KEY_SIGNATURES[key]}
+    if meta_type == 0x7F:
+        return {"data": tuple(data)}
+    return {}
+
+def merge_events(events_list):
+    """Concatenate events of several tracks in playback order (stable, as mido.merge_tracks)"""
+    events = np.concatenate(events_list) if len(events_list) > 0 else np.empty(0, dtype=EVENT_DTYPE)
+    return events[np.argsort(events["ticks"], kind="stable")]
+
+
+class SmfFile:
+    """Standard MIDI File read straight into NumPy event arrays (see EVENT_DTYPE).
+
+    Offers the attributes of mido.MidiFile that MidiFrame relies on (type, ticks_per_beat, filename, clip, charset),
+    the tracks being available as event arrays through track_events(i).
+    
+    If lazy, the file is memory-mapped instead of read, the track chunks are only indexed when first needed, 
+    and each track is only decoded when its events are first accessed, so that opening a file costs the same 
+    whatever its size.
+    """
+
+    def __init__(self, filename=None, data=None, clip=False, charset="latin1", lazy=False):
+        self.filename = filename
+        self.clip = clip
+        self.charset = charset
+        self.lazy = lazy
+        self._mmap = None
+
+        if data is None and lazy:
+            with open(filename, "rb") as file:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            data = self._mmap
+        elif data is None:
+            with open(filename, "rb") as file:
+                data = file.read()
+        self.data = data
+
+        self.type, self.declared_track_count, self.ticks_per_beat, self.header_end = read_header(data)
+        self._chunks = None
+        self.tracks_events = None
+        if not lazy:
+            self.tracks_events = [decode_track(data, start, end, track_index=i, clip=clip)
+                                  for i, (start, end) in enumerate(self.chunks)]
+
+    @property
+    def chunks(self):
+        if self._chunks is None:
+            self._chunks = index_track_chunks(self.data, self.header_end, self.declared_track_count)
+        return self._chunks
+
+    @property
+    def track_count(self):
+        return len(self.chunks)
+
+    def is_decoded(self, i):
+        return self.tracks_events is not None and self.tracks_events[i] is not None
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def track_events(self, i):
+        if self.tracks_events is None:
+            self.tracks_events = [None] * self.track_count
+        if self.tracks_events[i] is None:
+            start, end = self.chunks[i]
+            self.tracks_events[i] = decode_track(self.data, start, end, track_index=i, clip=self.clip)
+        return self.tracks_events[i]
+
+    def merged_events(self):
+        return merge_events([self.track_events(i) for i in range(self.track_count)])
+
+    def payload(self, event) -> bytes:
+        return bytes(self.data[event["offset"]:event["offset"] + event["length"]])
+
+    def track_name(self, i):
+        """Name of the first track_name meta event of the track, as mido.MidiTrack.name.
+        A track that is not decoded yet is only decoded up to its name, which usually is its first event."""
+        if self.is_decoded(i):
+            events = self.track_events(i)
+        else:
+            start, end = self.chunks[i]
+            events = decode_track(self.data, start, end, track_index=i, clip=self.clip, stop_meta=META_TRACK_NAME)
+            if len(events) == 0 or events["status"][-1] != META or events["data1"][-1] != META_TRACK_NAME:
+                # No name, the whole track has been decoded
+                if self.tracks_events is None:
+                    self.tracks_events = [None] * self.track_count
+                self.tracks_events[i] = events
+        names = np.flatnonzero(meta_mask(events, META_TRACK_NAME))
+        if len(names) == 0:
+            return ""
+        return self.payload(events[names[0]]).decode(self.charset)
+
+    def tempo_messages(self, events):
+        """set_tempo and time_signature events of an events array as (ticks, mido.MetaMessage) pairs"""
+        messages = []
+        for i in np.flatnonzero(meta_mask(events, META_SET_TEMPO) | meta_mask(events, META_TIME_SIGNATURE)):
+            messages.append((int(events["ticks"][i]), self.to_message(events[i])))
+        return messages
+
+    def to_message(self, event, time=None):
+        """Build the mido message of an event, its time being the delta ticks unless given"""
+        time = int(event["delta"]) if time is None else time
+        status = int(event["status"])
+        if status < 0xF0:
+            if DATA_BYTE_COUNTS[status >> 4] == 2:
+                return mido.Message.from_bytes([status, int(event["data1"]), int(event["data2"])], time=time)
+            return mido.Message.from_bytes([status, int(event["data1"])], time=time)
+
+        payload = self.payload(event)
+        if status == META:
+            meta_type = int(event["data1"])
+            if meta_type not in META_TYPE_NAMES:
+                return mido.UnknownMetaMessage(meta_type, data=tuple(payload), time=time)
+            return mido.MetaMessage(META_TYPE_NAMES[meta_type], time=time, **meta_attributes(meta_type, payload, self.charset))
+        if len(payload) > 0 and payload[-1] == SYSEX_ESCAPE:
+            payload = payload[:-1]
+        return mido.Message("sysex", data=payload, time=time)
+
+    def to_track(self, events):
+        """Build the mido.MidiTrack of an events array in playback order"""
+        track = mido.MidiTrack()
+        previous_ticks = 0
+        for event in events:
+            ticks = int(event["ticks"])
+            track.append(self.to_message(event, time=ticks - previous_ticks))
+            previous_ticks = ticks
+        return track
+
+
+def read_smf(filename, clip=False, charset="latin1"):
+    return SmfFile(filename=filename, clip=clip, charset=charset)
+
+def open_smf(filename, clip=False, charset="latin1"):
+    """Memory-mapped SmfFile, tracks being decoded on demand"""
+    return SmfFile(filename=filename, clip=clip, charset=charset, lazy=True)
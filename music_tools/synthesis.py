@@ -0,0 +1,293 @@
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+from music_tools.midi_frame import MidiFrame, DRUM_CHANNEL
+import music_tools.midi_utils as mu
+
+
+class ChannelMixer:
+    """Synthesized audio of the channels of a midi file, each channel being rendered once into its own float32 buffer,
+    the playing audio being the sum of the buffers of the active channels (normalized to [-1, 1]).
+
+    Toggling channels only adds or subtracts their buffers from the mix, a new audio array being swapped in
+    so that a playback callback reading the former one is never disturbed.
+    """
+
+    def __init__(self, midiframe: MidiFrame, Fs, memmap_dirpath=None):
+        """
+        Args:
+            midiframe (MidiFrame): The midi file.
+            Fs (int): Sample frequency.
+            memmap_dirpath (str, optional): If given, the channel buffers are stored in .npy files of a temporary folder 
+                of this directory and memory-mapped instead of being kept in memory. Defaults to None.
+        """
+        self.Fs = Fs
+        self.memmap_dirpath = memmap_dirpath
+        self.memmap_folder = None
+
+        # Instruments of every channel, the notes of a channel being synthesized the first time it is activated
+        all_track_frames = midiframe.mix_track_frames(midiframe.track_frames, track_name="All Channels")
+        self.instruments = all_track_frames.to_instruments()
+        self.sample_count = max([int(Fs*(instrument.get_end_time() + 1)) for instrument in self.instruments.values()],
+                                default=0)
+
+        self.buffers = {}
+        self.active_channels = set()
+        self.mix = np.zeros(self.sample_count, dtype=np.float32)
+        self.audio = np.zeros(self.sample_count, dtype=np.float32)
+
+    def buffer(self, channel):
+        """Cached synthesized audio of a channel, None for silent channels (drums, or not in the file)"""
+        if channel not in self.buffers:
+            self.buffers[channel] = self.render(channel)
+        return self.buffers[channel]
+
+    def render(self, channel):
+        instrument = self.instruments.get(channel)
+        if instrument is None or instrument.is_drum or len(instrument.notes) == 0:
+            return None
+
+        if self.memmap_dirpath is None:
+            buffer = np.zeros(self.sample_count, dtype=np.float32)
+        else:
+            if self.memmap_folder is None:
+                os.makedirs(self.memmap_dirpath, exist_ok=True)
+                # Own folder of the mixer, so that the buffers of several mixers never share a file name
+                self.memmap_folder = tempfile.mkdtemp(dir=self.memmap_dirpath)
+            buffer = np.lib.format.open_memmap(os.path.join(self.memmap_folder, f"channel_{channel:02}.npy"),
+                                               mode="w+", dtype=np.float32, shape=(self.sample_count,))
+        synthesized = instrument.synthesize(fs=self.Fs)
+        buffer[:len(synthesized)] = synthesized
+        return buffer
+
+    def set_channels(self, channels):
+        """Update the mix to the given active channels, returns the normalized audio"""
+        channels = set(channels)
+        added = [self.buffer(channel) for channel in channels - self.active_channels]
+        removed = [self.buffer(channel) for channel in self.active_channels - channels]
+        added = [buffer for buffer in added if buffer is not None]
+        removed = [buffer for buffer in removed if buffer is not None]
+        self.active_channels = channels
+
+        if len(added) + len(removed) > 0:
+            mix = self.mix.copy()
+            for buffer in added:
+                mix += buffer
+            for buffer in removed:
+                mix -= buffer
+            if len(self.active_channels) == 0 or all(self.buffer(channel) is None for channel in self.active_channels):
+                # Clear the rounding errors of the additions and subtractions
+                mix[:] = 0
+            self.mix = mix
+
+            peak = np.abs(mix).max() if len(mix) > 0 else 0
+            self.audio = mix / peak if peak > 0 else mix.copy()
+        return self.audio
+
+    def close(self):
+        """Remove the memory-mapped buffers files and their folder"""
+        self.buffers = {}
+        if self.memmap_folder is not None:
+            shutil.rmtree(self.memmap_folder, ignore_errors=True)
+            self.memmap_folder = None
+        self.active_channels = set()
+
+
+class StreamingSynthesizer:
+    """Block-wise synthesis of a note dataframe, only rendering the next blocks ahead of the read position 
+    into a small ring buffer, so that memory and time to first sound don't depend on the length of the song.
+
+    Notes are synthesized as PrettyMIDI.synthesize does (sine waves with an exponential decay, a 0.1 s fade out 
+    and an amplitude proportional to the velocity, pitch bends being ignored), the phase of each note only depending 
+    on its start so that blocks are seamless. As in ChannelMixer, the output is normalized to a peak of 1: 
+    the worker finds the peak of the song in the background once the blocks ahead are rendered, the gain 
+    being until then the inverse of the largest sum of the velocities of simultaneous notes, so that the output 
+    never clips, then ramped to the inverse of the peak.
+    A worker thread renders the blocks ahead, read never renders itself and returns silence for the samples 
+    the worker is late on (counted in underrun_count).
+    """
+
+    def __init__(self, Fs, block_size=1024, ahead_block_count=8):
+        self.Fs = Fs
+        self.block_size = block_size
+        self.capacity = block_size * ahead_block_count
+        self.ring = np.zeros(self.capacity, dtype=np.float32)
+        self.fade_out_size = int(.1*Fs)
+        
+        self.notes = self.compile_notes(None)
+        # Absolute sample index of the next sample to read, and up to which the ring buffer is rendered
+        self.read_position = 0
+        self.write_position = 0
+        self.generation = 0
+        self.underrun_count = 0
+        # Gain applied to the samples read, ramped to the gain of the notes over a read when it changes
+        self.gain = self.notes["gain"]
+        
+        self.condition = threading.Condition()
+        self.running = True
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def set_notes(self, dataframe, channels=None):
+        """Notes to synthesize, from a note dataframe (see mu.track_to_dataframe), drums and notes of channels 
+        not in channels being ignored. The samples already rendered ahead are discarded."""
+        notes = self.compile_notes(dataframe, channels)
+        with self.condition:
+            self.notes = notes
+            self.write_position = self.read_position
+            self.generation += 1
+            self.condition.notify_all()
+
+    def compile_notes(self, dataframe, channels=None):
+        """Sample boundaries, angular frequencies and velocities of the notes sorted by start"""
+        start = np.empty(0, dtype=np.int64)
+        end = np.empty(0, dtype=np.int64)
+        note = np.empty(0, dtype=np.int64)
+        velocity = np.empty(0, dtype=np.float64)
+        if dataframe is not None and len(dataframe) > 0:
+            mask = dataframe.channel.to_numpy() != DRUM_CHANNEL
+            if channels is not None:
+                mask &= np.isin(dataframe.channel.to_numpy(), list(channels))
+            start = (self.Fs * dataframe.time.to_numpy()[mask]).astype(np.int64)
+            end = (self.Fs * dataframe.time_release.to_numpy()[mask]).astype(np.int64)
+            note = dataframe.note.to_numpy()[mask]
+            velocity = dataframe.velocity.to_numpy()[mask].astype(np.float64)
+        
+        order = np.argsort(start, kind="stable")
+        notes = {"start": start[order], 
+                 "end": end[order], 
+                 "frequency": mu.to_freq(note[order]) * 2*np.pi / self.Fs, 
+                 "velocity": velocity[order]}
+        notes["max_duration"] = int(np.max(notes["end"] - notes["start"], initial=0))
+        # PrettyMIDI renders one more second after the last note
+        notes["sample_count"] = int(np.max(notes["end"], initial=0)) + self.Fs if len(start) > 0 else 0
+        
+        # Largest sum of velocities of simultaneous notes
+        boundaries = np.concatenate([notes["start"], notes["end"]])
+        steps = np.concatenate([notes["velocity"], -notes["velocity"]])
+        steps = steps[np.lexsort((steps, boundaries))]
+        peak = np.max(np.cumsum(steps), initial=0)
+        notes["gain"] = 1/peak if peak > 0 else 0
+        # Peak of the song so far, up to the scan position
+        notes["peak"] = 0
+        notes["peak_position"] = 0
+        return notes
+
+    @property
+    def sample_count(self):
+        return self.notes["sample_count"]
+
+    def render(self, start, size, notes=None):
+        """Synthesized samples [start, start + size)"""
+        notes = self.notes if notes is None else notes
+        block = np.zeros(size, dtype=np.float64)
+        first = np.searchsorted(notes["start"], start - notes["max_duration"], side="left")
+        last = np.searchsorted(notes["start"], start + size, side="left")
+        active = first + np.flatnonzero(notes["end"][first:last] > start)
+        if len(active) == 0:
+            return block.astype(np.float32)
+        
+        note_start = notes["start"][active][:, None]
+        duration = (notes["end"][active] - notes["start"][active])[:, None]
+        # Position of every sample of the block in each note
+        position = np.arange(start, start + size)[None, :] - note_start
+        playing = (position >= 0) & (position < duration)
+        
+        envelope = np.exp(-position / self.Fs)
+        long_notes = duration > self.fade_out_size
+        fade_position = position - (duration - self.fade_out_size)
+        fade = np.where(long_notes, 
+                        np.where(fade_position >= 0, 1 - fade_position / max(self.fade_out_size - 1, 1), 1),
+                        1 - position / np.maximum(duration - 1, 1))
+        waves = np.sin(notes["frequency"][active][:, None] * position) * envelope * fade \
+                    * notes["velocity"][active][:, None]
+        block = np.sum(np.where(playing, waves, 0), axis=0)
+        return block.astype(np.float32)
+
+    def store(self, start, samples):
+        i = start % self.capacity
+        head = min(len(samples), self.capacity - i)
+        self.ring[i:i+head] = samples[:head]
+        self.ring[:len(samples)-head] = samples[head:]
+
+    def load(self, start, size):
+        i = start % self.capacity
+        head = min(size, self.capacity - i)
+        return np.concatenate([self.ring[i:i+head], self.ring[:size-head]])
+
+    def read(self, frame_count):
+        """Next frame_count samples, from the read position"""
+        with self.condition:
+            if frame_count > self.capacity - self.block_size:
+                # Ring buffer grown to hold the reads of this size, the samples rendered ahead being discarded
+                self.capacity = (frame_count // self.block_size + 2) * self.block_size
+                self.ring = np.zeros(self.capacity, dtype=np.float32)
+                self.write_position = self.read_position
+                self.generation += 1
+            available = min(max(self.write_position - self.read_position, 0), frame_count)
+            if available < frame_count:
+                # The worker is late, it goes on from after this read
+                self.underrun_count += 1
+            samples = np.concatenate([self.load(self.read_position, available), 
+                                      np.zeros(frame_count - available, dtype=np.float32)])
+            self.read_position += frame_count
+            self.write_position = max(self.write_position, self.read_position)
+
+            gain = self.notes["gain"]
+            if gain != self.gain:
+                samples *= np.linspace(self.gain, gain, frame_count, dtype=np.float32)
+                self.gain = gain
+            else:
+                samples *= gain
+            self.condition.notify_all()
+        return samples
+
+    def seek(self, position):
+        """Move the read position to the given sample index, discarding the samples rendered ahead"""
+        with self.condition:
+            if position != self.read_position:
+                self.read_position = position
+                self.write_position = position
+                self.generation += 1
+                self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.write_position + self.block_size - self.read_position > self.capacity \
+                        and self.notes["peak_position"] >= self.sample_count:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                scanning = self.write_position + self.block_size - self.read_position > self.capacity
+                start = self.notes["peak_position"] if scanning else self.write_position
+                generation = self.generation
+                notes = self.notes
+            
+            if scanning:
+                # Blocks ahead all rendered, a block of the song is scanned for its peak instead
+                size = min(self.capacity, notes["sample_count"] - start)
+                peak = np.abs(self.render(start, size, notes)).max()
+                with self.condition:
+                    if notes is self.notes:
+                        notes["peak"] = max(notes["peak"], peak)
+                        notes["peak_position"] = start + size
+                        if notes["peak_position"] >= notes["sample_count"]:
+                            notes["gain"] = 1/notes["peak"] if notes["peak"] > 0 else 0
+                continue
+
+            samples = self.render(start, self.block_size, notes)
+            
+            with self.condition:
+                if generation == self.generation and start == self.write_position:
+                    self.store(start, samples)
+                    self.write_position += self.block_size
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.worker.join()
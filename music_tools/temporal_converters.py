@@ -1,9 +1,19 @@
 import mido
+from bisect import bisect_right
 import numpy as np
 
 from music_tools.utils import is_iterable
+
+SCALAR_TYPES = (int, float, np.integer, np.floating)
           
 class TicksConverter:
+    """Piecewise linear conversion between ticks (input) and another metric (output).
+    
+    Each event starts a segment in which the output grows linearly with the ticks, at a rate
+    given by the event object (tempo, time signature...). The segments are compiled into arrays
+    of start inputs, start outputs and rates, queried by binary search in both directions.
+    Rates are expressed in ticks per output unit, so that whole bars stay exact in bartime.
+    """
     
     class Modes:
         OBJECT = 0
@@ -17,24 +27,11 @@ class TicksConverter:
     NEXT_OUTPUT_ID = 3
     NEXT_INPUT_ID = 4
     
-    # TARGET_INPUT_ID = 0
-    # TARGET_NEXT_INPUT_ID = 1
-    # TARGET_OUTPUT_ID = 2
-    # Target mode to IDS
-    TO_ID = [[2, 4, 1], # To Object
-            [2, 4, 1], # To Output
-            [1, 3, 2]] # To Input
-    
-    
     def __init__(self, 
                  messages_with_ticks, ticks_per_beat,
-                 get_object_function, to_input_function, to_output_function, 
+                 get_object_function, get_rate_function,
                  default_object, default_output=0, default_input=0):
         self.ticks_per_beat = ticks_per_beat
-        # Based on modes
-        self.functions = [lambda x, y, object: object, 
-                          to_output_function,
-                          to_input_function]
         
         self.events = [[get_object_function(message), 
                                 None, 
@@ -58,7 +55,7 @@ class TicksConverter:
         
         last_event = None
         for event in self.events:
-            current_output += self.functions[self.Modes.OUTPUT](event[self.INPUT_ID], ticks_per_beat, current_object)
+            current_output += event[self.INPUT_ID] / get_rate_function(current_object, ticks_per_beat)
             current_input += event[self.INPUT_ID]
             current_object = event[self.OBJECT_ID]
             event[self.OUTPUT_ID] = current_output
@@ -72,49 +69,47 @@ class TicksConverter:
             last_event[self.NEXT_OUTPUT_ID] = np.inf
             
         self.event_count = len(self.events)
-        self.prev_event = self.events[0]
         
+        # Compiled segment index
+        self.objects = [event[self.OBJECT_ID] for event in self.events]
+        self.input_starts = np.array([event[self.INPUT_ID] for event in self.events], dtype=np.float64)
+        self.output_starts = np.array([event[self.OUTPUT_ID] for event in self.events], dtype=np.float64)
+        self.rates = np.array([get_rate_function(obj, ticks_per_beat) for obj in self.objects], dtype=np.float64)
+        # Plain lists are faster to bisect than arrays for scalar queries
+        self._input_starts = self.input_starts.tolist()
+        self._output_starts = self.output_starts.tolist()
+        self._rates = self.rates.tolist()
+    
+    def segment_objects(self):
+        return self.objects
     
+    def segment_index(self, ticks):
+        """Index in self.events of the segment each ticks belongs to, negative ticks belonging to the first one"""
+        return np.maximum(np.searchsorted(self.input_starts, ticks, side="right") - 1, 0)
     
     def convert(self, input, target_mode=Modes.OUTPUT):
-        input_id, next_input_id, output_id = self.TO_ID[target_mode]
-        if not is_iterable(input):
-            if input < 0:
-                return self.functions[target_mode](input, self.ticks_per_beat, self.events[0][self.OBJECT_ID])
+        """Convert ticks to the output (or object), or the output to ticks with target_mode=Modes.INPUT.
+        Scalars are looked up in O(log n), iterables (in any order) are fully vectorized.
+        """
+        if isinstance(input, SCALAR_TYPES) or not is_iterable(input):
+            if target_mode == self.Modes.INPUT:
+                i = max(bisect_right(self._output_starts, input) - 1, 0)
+                return int(self._input_starts[i]) + round((input - self._output_starts[i]) * self._rates[i])
             
-            for event in [self.prev_event] + self.events:
-                diff_input = input - event[input_id]
-                base = event[output_id]
-                if diff_input >= 0 and input < event[next_input_id]:
-                    self.prev_event = event
-                    if target_mode > 0:
-                        return base + self.functions[target_mode](diff_input, self.ticks_per_beat, event[self.OBJECT_ID])
-                    else:
-                        return self.functions[target_mode](diff_input, self.ticks_per_beat, event[self.OBJECT_ID])
-                            
-        else: # Assumes a sorted list 
-            result = []
-            event = self.events[0]
-            base = event[output_id] if target_mode > 0 else 0
-            idx = 1
-            for single_input in input:
-                if single_input < 0:
-                    result.append(self.functions[target_mode](single_input, self.ticks_per_beat, self.events[0][self.OBJECT_ID]))
-                else:
-                    diff_input = single_input - event[input_id]
-                    
-                    while idx < self.event_count and not (diff_input >= 0 and single_input < event[next_input_id]):
-                        event = self.events[idx]
-                        base = event[output_id]
-                        diff_input = single_input - event[input_id]
-                        idx += 1
-                    
-                    if target_mode > 0:
-                        result.append(base + self.functions[target_mode](diff_input, self.ticks_per_beat, event[self.OBJECT_ID]))
-                    else:
-                        result.append(self.functions[target_mode](diff_input, self.ticks_per_beat, event[self.OBJECT_ID]))
-                    
-            return result
+            i = max(bisect_right(self._input_starts, input) - 1, 0)
+            if target_mode == self.Modes.OBJECT:
+                return self.objects[i]
+            return self._output_starts[i] + (input - self._input_starts[i]) / self._rates[i]
+        
+        input = np.asarray(input, dtype=np.float64)
+        if target_mode == self.Modes.INPUT:
+            i = np.maximum(np.searchsorted(self.output_starts, input, side="right") - 1, 0)
+            return (self.input_starts[i] + np.rint((input - self.output_starts[i]) * self.rates[i])).astype(np.int64)
+        
+        i = np.maximum(np.searchsorted(self.input_starts, input, side="right") - 1, 0)
+        if target_mode == self.Modes.OBJECT:
+            return [self.objects[j] for j in i]
+        return self.output_starts[i] + (input - self.input_starts[i]) / self.rates[i]
     
 DEFAULT_TEMPO = 500000    
 
@@ -124,14 +119,17 @@ def tick2time(ticks, ticks_per_beat, tempo):
 def time2tick(bartime, ticks_per_beat, tempo):
     return round(bartime * ticks_per_beat / tempo * 1e6)
 
+def time_rate(tempo, ticks_per_beat):
+    """Ticks per second"""
+    return ticks_per_beat * 1e6 / tempo
+
 class TicksTimeConverter(TicksConverter):
     
     def __init__(self, tempos_with_ticks, ticks_per_beat):
         super().__init__(messages_with_ticks=tempos_with_ticks, 
                          ticks_per_beat=ticks_per_beat,
                          get_object_function=lambda message: message.tempo,
-                         to_input_function=time2tick,
-                         to_output_function=tick2time,
+                         get_rate_function=time_rate,
                          default_object=DEFAULT_TEMPO,
                          default_output=0.0)
         
@@ -151,6 +149,10 @@ def tick2bartime(ticks, ticks_per_beat, timesig):
 def bartime2tick(bartime, ticks_per_beat, timesig):
     return round(bartime * ticks_per_beat * timesig[0] / timesig[1] * 4)
 
+def bartime_rate(timesig, ticks_per_beat):
+    """Ticks per bar"""
+    return ticks_per_beat * timesig[0] / timesig[1] * 4
+
 DEFAULT_TIMESIG = (4,4)
 
 class TicksBartimeConverter(TicksConverter):
@@ -158,8 +160,7 @@ class TicksBartimeConverter(TicksConverter):
         super().__init__(messages_with_ticks=timesigs_with_ticks, 
                          ticks_per_beat=ticks_per_beat,
                          get_object_function=lambda message: (message.numerator,message.denominator),
-                         to_input_function=bartime2tick,
-                         to_output_function=tick2bartime,
+                         get_rate_function=bartime_rate,
                          default_object=DEFAULT_TIMESIG,
                          default_output=0.0)
     
@@ -172,6 +173,94 @@ class TicksBartimeConverter(TicksConverter):
     def to_bartime(self, ticks):
         return self.convert(ticks, self.Modes.OUTPUT)
           
+class MidiTimeline:
+    """Tempo and time signature segments merged into a single table, converting between
+    "ticks", "time" (seconds), "bartime" and "idx" (sample index at a sample frequency Fs)
+    with one lookup, for scalars or arrays.
+    
+    When the source is not "ticks", ticks are rounded as TicksConverter.convert does, 
+    the other metrics being then derived from the rounded ticks.
+    """
+    METRICS = ("ticks", "time", "bartime", "idx")
+    
+    def __init__(self, time_conv: TicksTimeConverter, bartime_conv: TicksBartimeConverter):
+        self.ticks_starts = np.union1d(time_conv.input_starts, bartime_conv.input_starts)
+        self.time_starts = time_conv.to_time(self.ticks_starts)
+        self.bartime_starts = bartime_conv.to_bartime(self.ticks_starts)
+        self.ticks_per_second = time_conv.rates[time_conv.segment_index(self.ticks_starts)]
+        self.ticks_per_bar = bartime_conv.rates[bartime_conv.segment_index(self.ticks_starts)]
+        self.segment_count = len(self.ticks_starts)
+        
+        self._starts = {"ticks": self.ticks_starts.tolist(),
+                        "time": self.time_starts.tolist(),
+                        "bartime": self.bartime_starts.tolist()}
+        self._ticks_starts = self._starts["ticks"]
+        self._time_starts = self._starts["time"]
+        self._bartime_starts = self._starts["bartime"]
+        self._ticks_per_second = self.ticks_per_second.tolist()
+        self._ticks_per_bar = self.ticks_per_bar.tolist()
+    
+    def locate(self, value, metric="ticks", Fs=None):
+        """Returns the (ticks, time, bartime, idx) tuple of value given in metric, idx being None without Fs"""
+        if metric not in self.METRICS:
+            raise ValueError(f"metric should be in {self.METRICS}")
+        if metric == "idx" and Fs is None:
+            raise ValueError("Fs is needed to convert from sample indices")
+        
+        if isinstance(value, SCALAR_TYPES) or not is_iterable(value):
+            return self._locate_scalar(value, metric, Fs)
+        return self._locate_array(np.asarray(value, dtype=np.float64), metric, Fs)
+    
+    def convert(self, value, from_metric, to_metric, Fs=None):
+        if from_metric == to_metric:
+            return value
+        return self.locate(value, from_metric, Fs)[self.METRICS.index(to_metric)]
+    
+    def _locate_scalar(self, value, metric, Fs):
+        time = value / Fs if metric == "idx" else value
+        if metric == "ticks":
+            ticks = value
+            i = max(bisect_right(self._ticks_starts, ticks) - 1, 0)
+        else:
+            source = "time" if metric == "idx" else metric
+            i = max(bisect_right(self._starts[source], time) - 1, 0)
+            if source == "time":
+                ticks = round(self._ticks_starts[i] + (time - self._time_starts[i]) * self._ticks_per_second[i])
+            else:
+                ticks = round(self._ticks_starts[i] + (value - self._bartime_starts[i]) * self._ticks_per_bar[i])
+        
+        diff_ticks = ticks - self._ticks_starts[i]
+        if metric not in ("time", "idx"):
+            time = self._time_starts[i] + diff_ticks / self._ticks_per_second[i]
+        bartime = value if metric == "bartime" else self._bartime_starts[i] + diff_ticks / self._ticks_per_bar[i]
+        
+        idx = None
+        if Fs is not None:
+            idx = value if metric == "idx" else int(time * Fs)
+        return ticks, time, bartime, idx
+    
+    def _locate_array(self, value, metric, Fs):
+        time = value / Fs if metric == "idx" else value
+        if metric == "ticks":
+            ticks = value
+            i = np.maximum(np.searchsorted(self.ticks_starts, ticks, side="right") - 1, 0)
+        elif metric == "bartime":
+            i = np.maximum(np.searchsorted(self.bartime_starts, value, side="right") - 1, 0)
+            ticks = np.rint(self.ticks_starts[i] + (value - self.bartime_starts[i]) * self.ticks_per_bar[i]).astype(np.int64)
+        else:
+            i = np.maximum(np.searchsorted(self.time_starts, time, side="right") - 1, 0)
+            ticks = np.rint(self.ticks_starts[i] + (time - self.time_starts[i]) * self.ticks_per_second[i]).astype(np.int64)
+        
+        diff_ticks = ticks - self.ticks_starts[i]
+        if metric not in ("time", "idx"):
+            time = self.time_starts[i] + diff_ticks / self.ticks_per_second[i]
+        bartime = value if metric == "bartime" else self.bartime_starts[i] + diff_ticks / self.ticks_per_bar[i]
+        
+        idx = None
+        if Fs is not None:
+            idx = value if metric == "idx" else (time * Fs).astype(np.int64)
+        return ticks, time, bartime, idx
+          
 if __name__ == "__main__":
     ticks_per_beat = 100
     
@@ -0,0 +1,367 @@
+import threading
+import time
+import mido
+import numpy as np
+
+import music_tools.midi_utils as mu
+from music_tools.midi_frame import DRUM_CHANNEL
+from music_tools.utils import stereo_sound
+
+# Grown from the prototype of old/midi_live_synthesizer.py: instead of one precomputed sine per midi note,
+# a single cycle table is read at the phase of each voice, the phase being kept from a block to the next.
+
+TABLE_SIZE = 2048
+# One more sample so that the linear interpolation never wraps
+SINE_TABLE = np.sin(2 * np.pi * np.arange(TABLE_SIZE + 1) / TABLE_SIZE)
+
+ATTACK = 0
+DECAY = 1
+SUSTAIN = 2
+RELEASE = 3
+IDLE = 4
+
+VOICE_CHUNK_SIZE = 64
+
+
+class WavetableSynthesizer:
+    """Polyphonic wavetable synthesizer rendering blocks of samples.
+
+    Every voice has a phase accumulator reading the wavetable (linearly interpolated), and an ADSR envelope
+    advanced once per block, its gain being ramped linearly over the block. When all voices are taken,
+    a new note steals the quietest released voice or else the oldest one.
+
+    If budget is given, rendering a block has to take less than this ratio of the block duration:
+    the render time per voice and sample and the fixed time per sub-block (the blocks being split at every note
+    event) are measured separately, and the quietest voices beyond what fits in the budget are muted for the block,
+    their envelopes and phases still being advanced so that they are heard again in the next blocks.
+
+    Notes can be played live (note_on, note_off, send), or from a note dataframe (set_notes, then read and seek),
+    the synthesizer then being a drop-in for the StreamingSynthesizer of MidiPlayer.
+    """
+
+    def __init__(self,
+                 Fs=22050,
+                 max_polyphony=64,
+                 envelope=(0.01, 0.1, 0.7, 0.2),
+                 gain=0.1,
+                 budget=0.5,
+                 table=SINE_TABLE):
+        """
+        Args:
+            Fs (int, optional): Sample frequency. Defaults to 22050.
+            max_polyphony (int, optional): Number of voices. Defaults to 64.
+            envelope (tuple, optional): Attack, decay and release durations in seconds, and sustain level,
+                as (attack, decay, sustain, release). Defaults to (0.01, 0.1, 0.7, 0.2).
+            gain (float, optional): Gain of a voice of velocity 127. Defaults to 0.1.
+            budget (float, optional): Ratio of the block duration a render may take, None for no limit. Defaults to 0.5.
+            table (np.ndarray, optional): Single cycle wavetable, with the first sample repeated at the end.
+                Defaults to SINE_TABLE.
+        """
+        self.Fs = Fs
+        self.max_polyphony = max_polyphony
+        self.gain = gain
+        self.budget = budget
+        self.table_size = len(table) - 1
+        # Float32 table and slopes between its samples, so that the interpolation only needs one lookup of each
+        self.table = table[:-1].astype(np.float32)
+        self.table_slopes = np.diff(table).astype(np.float32)
+
+        attack, decay, sustain, release = envelope
+        self.sustain = sustain
+        # Level change per sample of each stage
+        self.attack_slope = 1 / max(attack * Fs, 1)
+        self.decay_slope = (1 - sustain) / max(decay * Fs, 1)
+        self.release_slope = 1 / max(release * Fs, 1)
+        self.release_duration = release
+
+        self.voice_channel = np.zeros(max_polyphony, dtype=np.int64)
+        self.voice_note = np.zeros(max_polyphony, dtype=np.int64)
+        self.voice_velocity = np.zeros(max_polyphony, dtype=np.float64)
+        self.voice_phase = np.zeros(max_polyphony, dtype=np.float64)
+        self.voice_increment = np.zeros(max_polyphony, dtype=np.float64)
+        self.voice_level = np.zeros(max_polyphony, dtype=np.float64)
+        self.voice_stage = np.full(max_polyphony, IDLE, dtype=np.int8)
+        # Allocation order of the voices, the oldest voice being stolen when all are playing
+        self.voice_order = np.zeros(max_polyphony, dtype=np.int64)
+        self.allocation_count = 0
+
+        self.voice_limit = max_polyphony
+        self.voice_sample_cost = 0.0
+        self.sub_block_cost = 0.0
+        self.block_voice_samples = 0
+        self.block_voice_time = 0.0
+        self.block_sub_blocks = 0
+        self.overrun_count = 0
+
+        self.lock = threading.RLock()
+        self.position = 0
+        self.set_notes(None)
+
+    @property
+    def active_voice_count(self):
+        return int(np.count_nonzero(self.voice_stage != IDLE))
+
+    def note_on(self, channel, note, velocity):
+        if velocity == 0:
+            self.note_off(channel, note)
+            return
+        with self.lock:
+            same = np.flatnonzero((self.voice_stage != IDLE) & (self.voice_channel == channel) & (self.voice_note == note))
+            if len(same) > 0:
+                # Retriggered from its current level and phase, without click
+                voice = same[0]
+            else:
+                voice = self.allocate_voice()
+                self.voice_phase[voice] = 0
+                self.voice_level[voice] = 0
+            self.voice_channel[voice] = channel
+            self.voice_note[voice] = note
+            self.voice_velocity[voice] = velocity / 127
+            self.voice_increment[voice] = mu.to_freq(note) / self.Fs
+            self.voice_stage[voice] = ATTACK
+            self.allocation_count += 1
+            self.voice_order[voice] = self.allocation_count
+
+    def note_off(self, channel, note):
+        with self.lock:
+            self.voice_stage[(self.voice_stage < RELEASE) & (self.voice_channel == channel) & (self.voice_note == note)] = RELEASE
+
+    def all_notes_off(self, immediately=False):
+        with self.lock:
+            if immediately:
+                self.voice_stage[:] = IDLE
+                self.voice_level[:] = 0
+            else:
+                self.voice_stage[self.voice_stage < RELEASE] = RELEASE
+
+    def allocate_voice(self):
+        idle = np.flatnonzero(self.voice_stage == IDLE)
+        if len(idle) > 0:
+            return idle[0]
+        released = np.flatnonzero(self.voice_stage == RELEASE)
+        if len(released) > 0:
+            return released[np.argmin(self.voice_level[released])]
+        return np.argmin(self.voice_order)
+
+    def send(self, message: mido.Message):
+        """Play a mido message (note_on, note_off, and all notes off control changes)"""
+        if message.type == "note_on":
+            self.note_on(message.channel, message.note, message.velocity)
+        elif message.type == "note_off":
+            self.note_off(message.channel, message.note)
+        elif message.type == "control_change" and message.control in (120, 123):
+            self.all_notes_off(immediately=message.control == 120)
+
+    def advance_envelopes(self, voices, sample_count):
+        """Envelope levels of the voices after sample_count samples, updating their stages"""
+        level = self.voice_level[voices].copy()
+        stage = self.voice_stage[voices].copy()
+        left = np.full(len(voices), float(sample_count))
+
+        # Samples left after the end of a stage are spent in the next one
+        in_stage = stage == ATTACK
+        level[in_stage] += left[in_stage] * self.attack_slope
+        done = in_stage & (level >= 1)
+        left = np.where(done, (level - 1) / self.attack_slope, np.where(in_stage, 0, left))
+        level[done] = 1
+        stage[done] = DECAY
+
+        in_stage = (stage == DECAY) & (left > 0)
+        level[in_stage] -= left[in_stage] * self.decay_slope
+        done = in_stage & (level <= self.sustain)
+        level[done] = self.sustain
+        stage[done] = SUSTAIN
+
+        in_stage = stage == RELEASE
+        level[in_stage] -= left[in_stage] * self.release_slope
+        done = in_stage & (level <= 0)
+        level[done] = 0
+        stage[done] = IDLE
+
+        self.voice_stage[voices] = stage
+        return level
+
+    def start_block(self, frame_count, sub_block_count=1):
+        """Start measuring the render of frame_count samples split in sub_block_count sub-blocks, the voice limit
+        being what fits in the budget once the fixed cost of the sub-blocks is taken"""
+        self.block_start_time = time.perf_counter()
+        self.block_voice_samples = 0
+        self.block_voice_time = 0.0
+        self.block_sub_blocks = 0
+        if self.budget is not None and self.voice_sample_cost > 0:
+            voice_budget = self.budget * frame_count / self.Fs - sub_block_count * self.sub_block_cost
+            self.voice_limit = max(1, min(self.max_polyphony, int(voice_budget / (frame_count * self.voice_sample_cost))))
+
+    def end_block(self, frame_count):
+        elapsed = time.perf_counter() - self.block_start_time
+        # Moving averages of the render time per voice and sample, and of the rest per sub-block,
+        # so that blocks split at many events do not count as more expensive voices
+        if self.block_voice_samples > 0:
+            cost = self.block_voice_time / self.block_voice_samples
+            self.voice_sample_cost = cost if self.voice_sample_cost == 0 else 0.9 * self.voice_sample_cost + 0.1 * cost
+        if self.block_sub_blocks > 0:
+            cost = (elapsed - self.block_voice_time) / self.block_sub_blocks
+            self.sub_block_cost = cost if self.sub_block_cost == 0 else 0.9 * self.sub_block_cost + 0.1 * cost
+        if self.budget is not None and elapsed > self.budget * frame_count / self.Fs:
+            self.overrun_count += 1
+
+    def enforce_budget(self, voices):
+        """Indexes in voices of the voices that can be rendered within the budget, the quietest others being 
+        muted for the current block only"""
+        if self.budget is None or len(voices) <= self.voice_limit:
+            return np.arange(len(voices))
+        loudness = self.voice_level[voices] * self.voice_velocity[voices]
+        return np.sort(np.argsort(-loudness, kind="stable")[:self.voice_limit])
+
+    def render_voices(self, sample_count):
+        """Next sample_count samples of the playing voices"""
+        self.block_sub_blocks += 1
+        voices = np.flatnonzero(self.voice_stage != IDLE)
+        if len(voices) == 0:
+            self.position += sample_count
+            return np.zeros(sample_count, dtype=np.float32)
+
+        rendered = self.enforce_budget(voices)
+        start_levels = self.voice_level[voices]
+        # Muted voices go on with their envelopes too
+        end_levels = self.advance_envelopes(voices, sample_count)
+        rendered_voices = voices[rendered]
+        velocities = self.voice_velocity[rendered_voices]
+        # Per block gains: (start + (end - start) * step / sample_count) * velocity
+        start_gains = (start_levels[rendered] * velocities).astype(np.float32)
+        gain_slopes = ((end_levels[rendered] - start_levels[rendered]) * velocities / sample_count).astype(np.float32)
+        
+        voice_start_time = time.perf_counter()
+        steps = np.arange(sample_count, dtype=np.float32)
+        constant = np.zeros(sample_count, dtype=np.float32)
+        ramped = np.zeros(sample_count, dtype=np.float32)
+        # Voices rendered by chunks whose waves fit in the cache
+        for chunk in range(0, len(rendered_voices), VOICE_CHUNK_SIZE):
+            chunk_voices = rendered_voices[chunk:chunk+VOICE_CHUNK_SIZE]
+            # Table positions, the phase of a block being below 1 so that float32 is precise enough within it
+            positions = (self.voice_phase[chunk_voices, None] * self.table_size).astype(np.float32) \
+                            + (self.voice_increment[chunk_voices, None] * self.table_size).astype(np.float32) * steps[None, :]
+            np.fmod(positions, self.table_size, out=positions)
+            indices = positions.astype(np.int32)
+            positions -= indices
+            waves = np.take(self.table_slopes, indices)
+            waves *= positions
+            waves += np.take(self.table, indices)
+            constant += start_gains[chunk:chunk+VOICE_CHUNK_SIZE] @ waves
+            ramped += gain_slopes[chunk:chunk+VOICE_CHUNK_SIZE] @ waves
+        samples = (constant + ramped * steps) * self.gain
+        self.block_voice_time += time.perf_counter() - voice_start_time
+
+        self.voice_level[voices] = end_levels
+        self.voice_phase[voices] = (self.voice_phase[voices] + self.voice_increment[voices] * sample_count) % 1
+        self.position += sample_count
+        self.block_voice_samples += len(rendered_voices) * sample_count
+        return np.clip(samples, -1, 1).astype(np.float32)
+
+    def render(self, sample_count):
+        """Next sample_count samples of the live played notes"""
+        with self.lock:
+            self.start_block(sample_count)
+            samples = self.render_voices(sample_count)
+            self.end_block(sample_count)
+            return samples
+
+    # Note dataframe playback, with the interface of synthesis.StreamingSynthesizer
+
+    def set_notes(self, dataframe, channels=None):
+        """Notes to play from a note dataframe (see mu.track_to_dataframe), drums and notes of channels not
+        in channels being ignored"""
+        start = np.empty(0, dtype=np.int64)
+        end = np.empty(0, dtype=np.int64)
+        channel = np.empty(0, dtype=np.int64)
+        note = np.empty(0, dtype=np.int64)
+        velocity = np.empty(0, dtype=np.int64)
+        if dataframe is not None and len(dataframe) > 0:
+            mask = dataframe.channel.to_numpy() != DRUM_CHANNEL
+            if channels is not None:
+                mask &= np.isin(dataframe.channel.to_numpy(), list(channels))
+            start = (self.Fs * dataframe.time.to_numpy()[mask]).astype(np.int64)
+            end = (self.Fs * dataframe.time_release.to_numpy()[mask]).astype(np.int64)
+            channel = dataframe.channel.to_numpy()[mask]
+            note = dataframe.note.to_numpy()[mask]
+            velocity = dataframe.velocity.to_numpy()[mask]
+
+        # Note events sorted by sample, releases first at the same sample so that a note can be pressed again
+        event_sample = np.concatenate([end, start])
+        event_on = np.concatenate([np.zeros(len(end), dtype=bool), np.ones(len(start), dtype=bool)])
+        order = np.lexsort((event_on, event_sample))
+        with self.lock:
+            self.notes = {"start": start, "end": end, "channel": channel, "note": note, "velocity": velocity}
+            self.event_sample = event_sample[order]
+            self.event_on = event_on[order]
+            self.event_channel = np.concatenate([channel, channel])[order]
+            self.event_note = np.concatenate([note, note])[order]
+            self.event_velocity = np.concatenate([velocity, velocity])[order]
+            self.sample_count = int(np.max(end, initial=0) + self.release_duration * self.Fs) + 1 if len(end) > 0 else 0
+            self.seek(self.position, force=True)
+
+    def seek(self, position, force=False):
+        """Move to the given sample index, the notes being played at this position starting over"""
+        with self.lock:
+            if position == self.position and not force:
+                return
+            self.all_notes_off(immediately=True)
+            self.position = position
+            self.event_index = int(np.searchsorted(self.event_sample, position, side="left"))
+            playing = np.flatnonzero((self.notes["start"] < position) & (self.notes["end"] > position))
+            for i in playing[-self.max_polyphony:]:
+                self.note_on(self.notes["channel"][i], self.notes["note"][i], self.notes["velocity"][i])
+
+    def read(self, frame_count):
+        """Next frame_count samples of the note dataframe, note events being applied at their exact sample"""
+        with self.lock:
+            end = self.position + frame_count
+            # A sub-block up to each distinct event sample of the block
+            events = self.event_sample[self.event_index:np.searchsorted(self.event_sample, end, side="left")]
+            self.start_block(frame_count, 1 + len(np.unique(events[events > self.position])))
+            blocks = []
+            while self.position < end:
+                # Apply the events of the current sample, then render up to the next event
+                while self.event_index < len(self.event_sample) and self.event_sample[self.event_index] <= self.position:
+                    i = self.event_index
+                    if self.event_on[i]:
+                        self.note_on(self.event_channel[i], self.event_note[i], self.event_velocity[i])
+                    else:
+                        self.note_off(self.event_channel[i], self.event_note[i])
+                    self.event_index += 1
+                next_event = self.event_sample[self.event_index] if self.event_index < len(self.event_sample) else end
+                blocks.append(self.render_voices(int(min(next_event, end) - self.position)))
+            self.end_block(frame_count)
+            return np.concatenate(blocks) if len(blocks) > 0 else np.zeros(0, dtype=np.float32)
+
+
+class WavetableOutput(mido.ports.BaseOutput):
+    """Mido output port playing the messages sent to it live with a WavetableSynthesizer on the default sound device"""
+
+    def __init__(self, synthesizer=None, block_size=512, volume=1.0, balance=0, **kwargs):
+        import sounddevice as sd
+
+        self.synthesizer = WavetableSynthesizer() if synthesizer is None else synthesizer
+        self.volume = volume
+        self.balance = balance
+
+        def output_callback(outdata, frame_count, time, status):
+            sound = self.volume * self.synthesizer.render(frame_count)
+            outdata[:] = stereo_sound(sound, sound, min(1-self.balance, 1.0), min(1+self.balance, 1.0))
+
+        self.stream = sd.OutputStream(samplerate=self.synthesizer.Fs,
+                                      channels=2,
+                                      dtype="float32",
+                                      blocksize=block_size,
+                                      callback=output_callback)
+        super().__init__(**kwargs)
+
+    def _open(self, **kwargs):
+        self.stream.start()
+
+    def _send(self, message):
+        self.synthesizer.send(message)
+
+    def _close(self):
+        self.stream.stop()
+        self.stream.close()
@@ -1,12 +1,20 @@
-import pickle
+import hashlib
+import os
+import time
 import numpy as np
 import pandas as pd
-import copy
 
 from music_tools.scales import *
 from music_tools.utils import base_to_list, list_to_str
 
-FOLDER = "scale_researches/"
+FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "")
+# Sheets naming the scales of the catalogue (csv, or Excel as the research sheets), the scales being in the order 
+# they are first named and the names of a scale in several sheets being joined.
+# The catalogue is the curated list of scale_final_data.csv: the sheets of past_research/ it was selected from also
+# hold chords and names that were corrected by hand, so they are not joined.
+NAME_SHEETS = [FOLDER + "scale_final_data.csv"]
+# Scale ids and names of every sheet already read, by content digest
+BUILD_CACHE_FOLDER = FOLDER + "build_cache/"
 
 
 def treat_scale_coding_jan_2011():
@@ -18,19 +26,19 @@ def treat_scale_coding_jan_2011():
     rid_to_id = {}
     
     for j, id in enumerate(df.scale_id):
-        b = ChromaBitmap()
-        b.bitmap = id
-        n = b.note_count()
+        id = int(id)
+        n = POPCOUNTS[id]
         
         if n not in history:
             history[n] = {}
         if id not in history[n]:
+            # The first scale of a rotation met names it
             rotation_id = n << 12 | id
-            for i in range(12):
-                history[n][b.roll(i)] = rotation_id
+            for rotation in ROTATIONS[id]:
+                history[n][rotation] = rotation_id
             rid_to_id[rotation_id] = j
         rotation_ids.append(history[n][id])
-        circular_distance.append(b.circular_distance(history[n][id]))
+        circular_distance.append(bitmap_circular_distance(id, history[n][id]))
     
     df["rotation_id"] = rotation_ids
     df["circular_distance"] = circular_distance
@@ -81,88 +89,79 @@ def treat_scale_coding_jan_2011():
     cleaned_df = cleaned_df.sort_values(["rotation_id", "circular_distance"])
     cleaned_df.to_csv("scale_researches/scale_coding_cleaned.csv", index=False)
     
-def create_scale_trees():
-    scale_list = pd.read_csv(FOLDER + "scale_final_data.csv")
-    scale_list.set_index("scale_id")
-    scale_list = scale_list.sort_index(ascending=False)
-
-    i = 0
-
-    contained = {}
-    for n_notes in scale_list.note_count.unique():
-        ids = np.array(scale_list.loc[scale_list.note_count == n_notes].scale_id.astype(int)) 
-        sub_ids = np.array(scale_list.loc[scale_list.note_count < n_notes].scale_id.astype(int))
-        
-        for id in ids:
-            id = int(id)
-            contained_sub_ids = sub_ids[id & sub_ids == sub_ids]
-            contained[id] = contained_sub_ids.astype(int).tolist()
-            print(n_notes, "-", id, ":", len(contained_sub_ids))
-
-    out_filename = FOLDER + "scale_legacy.pkl"
-
-    with open(out_filename, "wb") as outfile:
-        pickle.dump(contained, outfile)
+def file_digest(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def read_name_sheet(path):
+    """Scale ids and names of a sheet, the theory and alternative names of the research sheets being added to the name"""
+    sheet = pd.read_excel(path) if path.endswith((".xls", ".xlsx")) else pd.read_csv(path)
+    sheet = sheet[~pd.isna(sheet.scale_id)]
+    name_columns = [column for column in ("name", "theory_name", "alt_name") if column in sheet]
+    names = [", ".join(str(name) for name in row if not pd.isna(name) and str(name) != "") 
+             for row in sheet[name_columns].itertuples(index=False)]
+    return sheet.scale_id.to_numpy().astype(np.int64), np.array(names, dtype=str)
+
+def read_name_sheets(paths):
+    """Scale ids and names of the sheets, and their digests. Only the sheets never read before are parsed."""
+    digests = [file_digest(path) for path in paths]
+    sheets = {}
+    for path, digest in zip(paths, digests):
+        cache_path = BUILD_CACHE_FOLDER + digest + ".npz"
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as file:
+                sheets[path] = (file["scale_id"], file["name"])
     
-    parents = {}
-
-    root = None
-    for id, cids in contained.items():
-        valid = {}
-        invalid = []
-        for cid in contained.keys():
-            if id in contained[cid]:
-                new_invalid = [vid for vid, sids in valid.items() if cid in sids]
-                invalid.extend(new_invalid)
-                for i in new_invalid:
-                    del valid[i]
-                i = len(contained[cid]) - 1
-                while i >= 0 and contained[cid][i] not in valid.keys():
-                    i -= 1
-                if i >= 0:
-                    invalid.append(cid)
-                else:
-                    valid[cid] = list(contained[cid]).copy()
-                    if id in valid[cid]:
-                        valid[cid].remove(id)
-                
-        parents[id] = list(valid.keys())
-        if len(parents[id]) == 0:
-            root = id
-            
-    out_filename = FOLDER + "scale_parents.pkl"
-
-    with open(out_filename, "wb") as outfile:
-        pickle.dump(parents, outfile)
-        
-        
-    scales_tree = {}
-    available = {}
-    for id in parents:
-        available[id] = {id: {"self": id}}
-
-    # print(parents)
-    for id, id_parents in parents.items():
-        for id_parent in id_parents:
-            available[id_parent][id_parent][id] = available[id][id]
-
-    for id in available:
-        available[id] = available[id][id]
+    missing = [path for path in paths if path not in sheets]
+    os.makedirs(BUILD_CACHE_FOLDER, exist_ok=True)
+    for path in missing:
+        scale_ids, names = read_name_sheet(path)
+        np.savez(BUILD_CACHE_FOLDER + digests[paths.index(path)] + ".npz", scale_id=scale_ids, name=names)
+        sheets[path] = (scale_ids, names)
+    return [sheets[path] for path in paths], digests
+
+def join_names(sheets):
+    """Names of every scale of the sheets, in the order they are first named, the names of the next sheets 
+    naming a scale being added to its first name if it does not have them yet"""
+    names = {}
+    for scale_ids, sheet_names in sheets:
+        for scale_id, name in zip(scale_ids.tolist(), sheet_names.tolist()):
+            if scale_id not in names:
+                names[scale_id] = name
+            else:
+                parts = names[scale_id].split(", ")
+                names[scale_id] = ", ".join(parts + [part for part in name.split(", ") if part != "" and part not in parts])
+    return names
+
+def build_scale_catalogue(sheets=NAME_SHEETS, path=SCALE_DATA_PATH, force=False):
+    """Build the scale data file music_tools.scales loads from the name sheets: the rotations, circular distances 
+    and inclusion links of the named scales among the 4096 chroma sets (see scale_catalogue_columns and 
+    scale_catalogue_links).
     
-    scales_tree = copy.deepcopy(available[root]) 
+    The build is incremental: nothing is done if the sheets did not change since the last build (unless force), 
+    only the changed sheets are read again, and the inclusion links are kept if the named scales are the same 
+    (e.g. after adding a name to a scale). The file is the same byte for byte for the same sheets.
+    """
+    sheet_names, digests = read_name_sheets(sheets)
+    sources_digest = hashlib.sha256("".join(digests).encode()).hexdigest()
+    previous = None if force else load_scale_data(path)
+    if previous is not None and str(previous.get("sources_digest")) == sources_digest:
+        return False
     
-    out_filename = FOLDER + "scale_tree.pkl"
-
-    with open(out_filename, "wb") as outfile:
-        pickle.dump(scales_tree, outfile)
-    
-    out_filename = FOLDER + "scale_forest.pkl"
-
-    with open(out_filename, "wb") as outfile:
-        pickle.dump(available, outfile)
+    names = join_names(sheet_names)
+    arrays = scale_catalogue_columns(list(names.keys()), list(names.values()))
+    if previous is not None and np.array_equal(previous["scale_id"], arrays["scale_id"]):
+        arrays.update({name: previous[name] for name in previous if name.startswith(("forest", "parents"))})
+    else:
+        arrays.update(scale_catalogue_links(arrays["scale_id"]))
+    arrays["sources_digest"] = np.array(sources_digest)
+    save_scale_data(path, arrays)
+    return True
 
 
 if __name__ == "__main__":      
-    create_scale_trees()
+    start = time.perf_counter()
+    built = build_scale_catalogue()
+    print(f"Scale catalogue {'built' if built else 'up to date'} in {time.perf_counter() - start:.2f} s")
 
     
\ No newline at end of file